@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""
+    benchmarks/generators.py
+    ------------------------
+
+    Generators of synthetic source documents and matching rules files.
+
+    A source document looks like::
+
+        <data>
+          <header><field0>…</field0> … </header>
+          <records>
+            <record id="0" a0="…" …>
+              <name>…</name>
+              <group a0="…" …>          (`fanout` groups per record,
+                <group …>…</group>       nested `depth` levels)
+              </group>
+              <attachment>…</attachment>  (base64 `payload`, optional)
+              <audit><event …/> …</audit> (`audit` events, optional)
+            </record>
+            …
+          </records>
+        </data>
+
+    `rules` generates basic rules reading header fields and nested @foreach
+    rules (like ``026_rules.py``) for records and every level of groups.
+    `batch_rules` generates rules relative to a record for ``batch_run``.
+
+    Usage::
+
+        python3 benchmarks/generators.py outdir --records 1000 --depth 2
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import base64
+import random
+import argparse
+
+
+# prefixed destination paths are not supported, hence use a default namespace
+NAMESPACES = {None: 'http://example.com/ruledxml/out'}
+
+
+def source_document(records: int, *, fields=10, depth=1, fanout=3,
+    attributes=2, comments=False, payload=0, audit=0, seed=0) -> bytes:
+    """Generate a source document.
+
+    :param records:     number of record elements
+    :type records:      int
+    :param fields:      number of header fields
+    :type fields:       int
+    :param depth:       nesting depth of groups within a record
+    :type depth:        int
+    :param fanout:      number of child groups per record or group
+    :type fanout:       int
+    :param attributes:  number of attributes per record and group
+    :type attributes:   int
+    :param comments:    add a comment to every record
+    :type comments:     bool
+    :param payload:     size in bytes of a base64 attachment of every record
+    :type payload:      int
+    :param audit:       number of audit events of every record
+    :type audit:        int
+    :param seed:        seed of the random values
+    :type seed:         int
+    :return:            the XML document
+    :rtype:             bytes
+    """
+    rand = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+
+    def word():
+        return '{}{}'.format(rand.choice(words), rand.randrange(1000))
+
+    def attrs():
+        return ''.join(' a{}="{}"'.format(i, word()) for i in range(attributes))
+
+    def groups(level, indent):
+        if level >= depth:
+            return []
+        lines = []
+        for _ in range(fanout):
+            children = groups(level + 1, indent + '  ')
+            if children:
+                lines.append('{}<group{}>'.format(indent, attrs()))
+                lines.extend(children)
+                lines.append('{}</group>'.format(indent))
+            else:
+                lines.append('{}<group{}>{}</group>'.format(indent, attrs(), word()))
+        return lines
+
+    lines = ['<?xml version="1.0"?>', '<data>', '  <header>']
+    lines.extend('    <field{0}>{1}</field{0}>'.format(i, word()) for i in range(fields))
+    lines.extend(['  </header>', '  <records>'])
+    for i in range(records):
+        lines.append('    <record id="{}"{}>'.format(i, attrs()))
+        if comments:
+            lines.append('      <!-- record {} -->'.format(i))
+        lines.append('      <name>{}</name>'.format(word()))
+        lines.extend(groups(0, '      '))
+        if payload:
+            data = bytes(rand.getrandbits(8) for _ in range(payload * 3 // 4))
+            lines.append('      <attachment encoding="base64">{}</attachment>'.format(
+                base64.b64encode(data).decode('ascii')))
+        if audit:
+            lines.append('      <audit>')
+            lines.extend('        <event user="{}" action="{}">{}</event>'.format(
+                word(), word(), word()) for _ in range(audit))
+            lines.append('      </audit>')
+        lines.append('    </record>')
+    lines.extend(['  </records>', '</data>', ''])
+    return '\n'.join(lines).encode('utf-8')
+
+
+def group_path(base: str, level: int) -> str:
+    """Path of groups at nesting `level` (1-based) below `base`"""
+    return base + '/group' * level
+
+
+def rules(basic: int, *, fields=10, depth=1, namespaced=False) -> str:
+    """Generate a rules file for documents of `source_document`.
+
+    :param basic:       number of basic rules
+    :type basic:        int
+    :param fields:      number of header fields of the document
+    :type fields:       int
+    :param depth:       nesting depth of groups of the document
+    :type depth:        int
+    :param namespaced:  write the output in an XML namespace
+    :type namespaced:   bool
+    :return:            python source code of the rules file
+    :rtype:             str
+    """
+    lines = ['from ruledxml import source, destination, foreach', '']
+    if namespaced:
+        lines.append('output_namespaces = {!r}'.format(NAMESPACES))
+        lines.append('')
+
+    for i in range(basic):
+        lines.extend([
+            '',
+            '@source("/data/header/field{}")'.format(i % max(fields, 1)),
+            '@destination("/out/header/f{}")'.format(i),
+            'def ruleField{}(value):'.format(i),
+            '    return value.upper()',
+            ''
+        ])
+
+    record = ('/data/records/record', '/out/entries/entry')
+    lines.extend([
+        '',
+        '@foreach("{}", "{}")'.format(*record),
+        '@source("/data/records/record@id")',
+        '@destination("/out/entries/entry@id")',
+        'def ruleRecordId(identifier):',
+        '    return identifier',
+        '',
+        '',
+        '@foreach("{}", "{}")'.format(*record),
+        '@source("/data/records/record/name")',
+        '@source("/data/header/field0")',
+        '@destination("/out/entries/entry/name")',
+        'def ruleRecordName(field, name):',
+        '    return field + ": " + name',
+        ''
+    ])
+
+    bases = [record]
+    for level in range(1, depth + 1):
+        bases.insert(0, (group_path(record[0], level), group_path(record[1], level)))
+        src, dst = bases[0]
+        foreach = ['@foreach("{}", "{}")'.format(*base) for base in bases]
+        lines.extend([''] + foreach + [
+            '@source("{}@a0")'.format(src),
+            '@destination("{}@value")'.format(dst),
+            'def ruleGroup{}Value(value):'.format(level),
+            '    return value',
+            ''
+        ])
+        if level == depth:
+            lines.extend([''] + foreach + [
+                '@source("{}")'.format(src),
+                '@destination("{}/text")'.format(dst),
+                'def ruleGroup{}Text(text):'.format(level),
+                '    return text[::-1]',
+                ''
+            ])
+
+    return '\n'.join(lines)
+
+
+def batch_rules(*, depth=1) -> str:
+    """Generate a rules file applied to every record by ``batch_run``.
+
+    :param depth:       nesting depth of groups of the document
+    :type depth:        int
+    :return:            python source code of the rules file
+    :rtype:             str
+    """
+    lines = [
+        'from ruledxml import source, destination, foreach',
+        '',
+        '',
+        '@source("@id")',
+        '@destination("/entry@id")',
+        'def ruleRecordId(identifier):',
+        '    return identifier',
+        '',
+        '',
+        '@source("name")',
+        '@destination("/entry/name")',
+        'def ruleRecordName(name):',
+        '    return name.upper()',
+        ''
+    ]
+    if depth:
+        lines.extend([
+            '',
+            '@foreach("group", "/entry/group")',
+            '@source("group@a0")',
+            '@destination("/entry/group@value")',
+            'def ruleGroupValue(value):',
+            '    return value',
+            ''
+        ])
+    return '\n'.join(lines)
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main routine"""
+    os.makedirs(args.outdir, exist_ok=True)
+    files = {
+        'source.xml': source_document(args.records, fields=args.fields, depth=args.depth,
+            fanout=args.fanout, attributes=args.attributes, payload=args.payload,
+            audit=args.audit, seed=args.seed),
+        'rules.py': rules(args.basic, fields=args.fields, depth=args.depth,
+            namespaced=args.namespaced).encode('utf-8'),
+        'batch_rules.py': batch_rules(depth=args.depth).encode('utf-8')
+    }
+    for name, content in files.items():
+        with open(os.path.join(args.outdir, name), 'wb') as fp:
+            fp.write(content)
+        print(os.path.join(args.outdir, name))
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    parser = argparse.ArgumentParser(description='Generate synthetic documents and rules files.')
+    parser.add_argument('outdir', help='directory to write source.xml, rules.py and batch_rules.py to')
+    parser.add_argument('--records', type=int, default=100, help='number of record elements')
+    parser.add_argument('--fields', type=int, default=10, help='number of header fields')
+    parser.add_argument('--depth', type=int, default=1, help='nesting depth of groups')
+    parser.add_argument('--fanout', type=int, default=3, help='groups per record or group')
+    parser.add_argument('--attributes', type=int, default=2, help='attributes per element')
+    parser.add_argument('--payload', type=int, default=0,
+                        help='bytes of a base64 attachment per record')
+    parser.add_argument('--audit', type=int, default=0, help='audit events per record')
+    parser.add_argument('--basic', type=int, default=10, help='number of basic rules')
+    parser.add_argument('--namespaced', action='store_true', help='write output in an XML namespace')
+    parser.add_argument('--seed', type=int, default=0, help='seed of random values')
+
+    sys.exit(main(parser.parse_args()))
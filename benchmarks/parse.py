@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+    benchmarks/parse.py
+    -------------------
+
+    Parser benchmark of ruledxml.
+
+    A document is generated by `generators` (with a comment per record)
+    and parsed
+
+    * ``default_text``: by ``lxml.etree.parse`` with the default parser
+      from a file opened in text mode (like `xml.read` used to)
+    * ``default_binary``: by ``lxml.etree.parse`` from the filepath
+    * ``tuned_mmap``: by `xml.read` from the filepath (memory-mapped)
+    * ``tuned_bytes``: by `xml.read` from bytes in memory
+    * ``tuned_mmap_stripped``: like ``tuned_mmap`` without whitespace-only
+      text (``input_remove_blank_text``), comments and processing
+      instructions (as used if rules do not select them)
+    * ``pruned``: by `xml.read` keeping only elements reachable by the
+      source paths of the generated rules (header fields, record ids and
+      names and groups; see `paths.reachable`)
+
+    For every variant, min and median wall time, the increase of the peak
+    resident set size (measured once in a new python process) as well as
+    the number of nodes (elements, text, comments) of the resulting tree
+    are reported. ``--payload`` and ``--audit`` add attachments and audit
+    trails, which no rule reads, to every record.
+
+    Usage::
+
+        python3 benchmarks/parse.py --records 20000 --output parse.json
+        python3 benchmarks/parse.py --records 5000 --payload 8192 --audit 20
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lxml.etree
+
+import ruledxml
+import ruledxml.xml
+
+import generators
+
+
+def variants(filepath: str, rules_filepath: str) -> dict:
+    """Return functions parsing the document at `filepath` by variant name"""
+    def default_text():
+        with open(filepath) as fd:
+            return lxml.etree.parse(fd).getroot()
+
+    with open(filepath, 'rb') as fd:
+        data = fd.read()
+    reachable = ruledxml.load_plan(rules_filepath).reachable
+
+    return {
+        'default_text': default_text,
+        'default_binary': lambda: lxml.etree.parse(filepath).getroot(),
+        'tuned_mmap': lambda: ruledxml.xml.read(filepath),
+        'tuned_bytes': lambda: ruledxml.xml.read(data),
+        'tuned_mmap_stripped': lambda: ruledxml.xml.read(filepath,
+            remove_blank_text=True, remove_comments=True, remove_pis=True),
+        'pruned': lambda: ruledxml.xml.read(filepath, reachable=reachable,
+            remove_blank_text=True, remove_comments=True, remove_pis=True)
+    }
+
+
+def nodes(root: lxml.etree.Element) -> int:
+    """Number of nodes (elements, text, comments, …) in the tree of `root`"""
+    return int(root.xpath('count(//node())'))
+
+
+def peak_memory(variant: str, filepath: str, rules_filepath: str):
+    """Parse the document once by `variant` in a new python process and
+    return the increase of its peak resident set size in KiB.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), '--memory', variant,
+           filepath, rules_filepath]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+    return int(result.stdout)
+
+
+def memory_status() -> tuple:
+    """Return current and peak resident set size in KiB. The peak is
+    None unless the platform reports it per process image (eg. Linux).
+    """
+    try:
+        with open('/proc/self/status') as fp:
+            status = dict(line.split(':', 1) for line in fp if ':' in line)
+        return int(status['VmRSS'].split()[0]), int(status['VmHWM'].split()[0])
+    except (OSError, KeyError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, None
+
+
+def measure_memory(variant: str, filepath: str, rules_filepath: str) -> int:
+    """Parse the document by `variant` in this process and
+    return the increase of the peak resident set size in KiB
+    """
+    func = variants(filepath, rules_filepath)[variant]
+    before, _ = memory_status()
+    root = func()
+    current, peak = memory_status()
+    del root
+    return (current if peak is None else peak) - before
+
+
+def measure(variant: str, func, runs: int, filepath: str, rules_filepath: str) -> dict:
+    """Call `func` `runs` times and report its wall time in seconds,
+    its peak memory and the number of nodes of the returned tree.
+
+    :param variant:         name of the variant
+    :type variant:          str
+    :param func:            a callable without arguments returning a root element
+    :type func:             callable
+    :param runs:            number of runs
+    :type runs:             int
+    :param filepath:        filepath of the document
+    :type filepath:         str
+    :param rules_filepath:  filepath of the rules file
+    :type rules_filepath:   str
+    :return:                min and median wall time, peak memory and number of nodes
+    :rtype:                 dict
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        root = func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'runs': runs,
+        'min': min(times),
+        'median': statistics.median(times),
+        'peak_kib': peak_memory(variant, filepath, rules_filepath),
+        'nodes': nodes(root)
+    }
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main routine"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'source.xml')
+        with open(filepath, 'wb') as fd:
+            fd.write(generators.source_document(args.records, depth=args.depth,
+                comments=True, payload=args.payload, audit=args.audit))
+        rules_filepath = os.path.join(tmpdir, 'rules.py')
+        with open(rules_filepath, 'w') as fd:
+            fd.write(generators.rules(10, depth=args.depth))
+
+        results = {
+            'benchmark': 'parse',
+            'python': sys.version,
+            'platform': platform.platform(),
+            'lxml': '.'.join(map(str, lxml.etree.LXML_VERSION)),
+            'size': os.path.getsize(filepath),
+            'records': args.records,
+            'results': {name: measure(name, func, args.runs, filepath, rules_filepath)
+                        for name, func in variants(filepath, rules_filepath).items()}
+        }
+
+    print('document of {} bytes'.format(results['size']))
+    for name, values in results['results'].items():
+        print('  {:<20} {:>10.3f} / {:>10.3f} ms {:>10} KiB {:>10} nodes'.format(name,
+            values['min'] * 1000, values['median'] * 1000, values['peak_kib'],
+            values['nodes']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--memory']:
+        print(measure_memory(*sys.argv[2:5]))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='Benchmark parsing of source documents.')
+    parser.add_argument('-r', '--records', type=int, default=10000,
+                        help='number of records of the generated document')
+    parser.add_argument('-d', '--depth', type=int, default=2,
+                        help='nesting depth of groups of the generated document')
+    parser.add_argument('-p', '--payload', type=int, default=0,
+                        help='bytes of an unused base64 attachment per record')
+    parser.add_argument('-a', '--audit', type=int, default=0,
+                        help='unused audit events per record')
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='number of runs per variant')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+"""
+    benchmarks/startup.py
+    ---------------------
+
+    Startup benchmark of ruledxml.
+
+    Measures
+
+    * the import time of ``import ruledxml; ruledxml.run`` reported by
+      ``python -X importtime`` (interpreter startup itself excluded)
+    * the cold-start wall time of ``bin/ruledxml`` transforming
+      a trivial document (a new interpreter per run)
+
+    Results are printed and written as JSON. If a baseline JSON file
+    is given, the exit code is 1 if startup got slower than the
+    baseline by more than the given tolerance.
+
+    Usage::
+
+        python3 benchmarks/startup.py --runs 20 --output startup.json
+        python3 benchmarks/startup.py --baseline startup.json
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOT_PATH = 'import ruledxml; ruledxml.run'
+
+SOURCE = b'<root><body><header>Hello World</header></body></root>\n'
+RULES = '''from ruledxml import source, destination
+
+
+@source("/root/body/header")
+@destination("/html/body/article/h1")
+def ruleFirstHeader(header):
+    return header + "!"
+'''
+
+
+def environment() -> dict:
+    """Environment of subprocesses: this source tree is imported first"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    return env
+
+
+def importtime(code: str) -> dict:
+    """Run `code` in a new interpreter with ``-X importtime``.
+
+    :param code:    python source code to run
+    :type code:     str
+    :return:        self time in microseconds of every imported module
+    :rtype:         dict
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+        env=environment(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        check=True, universal_newlines=True)
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selftime, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(selftime)
+    return modules
+
+
+def measure_imports(runs: int) -> dict:
+    """Measure the import time of the hot path, ie. the modules
+    imported by `HOT_PATH` which are not imported by an empty interpreter.
+    Every module's self time is the minimum over `runs` runs.
+
+    :param runs:    number of runs
+    :type runs:     int
+    :return:        total import time and self time per module in microseconds
+    :rtype:         dict
+    """
+    baseline = set(importtime('pass'))
+    modules = {}
+    for _ in range(runs):
+        for name, selftime in importtime(HOT_PATH).items():
+            if name not in baseline:
+                modules[name] = min(modules.get(name, selftime), selftime)
+
+    return {
+        'code': HOT_PATH,
+        'total_us': sum(modules.values()),
+        'modules': dict(sorted(modules.items(), key=lambda m: -m[1]))
+    }
+
+
+def wall_time(command, runs: int, env: dict) -> dict:
+    """Run a command `runs` times and report its wall time in seconds.
+
+    :param command:     callable returning the command line of a run
+    :type command:      callable
+    :param runs:        number of runs
+    :type runs:         int
+    :param env:         environment variables
+    :type env:          dict
+    :return:            min, median and max wall time
+    :rtype:             dict
+    """
+    times = []
+    for _ in range(runs):
+        cmd = command()
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, env=env)
+        times.append(time.perf_counter() - start)
+
+    return {
+        'runs': runs,
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times)
+    }
+
+
+def measure_cold_start(runs: int) -> dict:
+    """Measure the wall time of ``bin/ruledxml`` on a trivial document.
+    The cache of compiled rules files is warmed by the first run.
+
+    :param runs:    number of runs
+    :type runs:     int
+    :return:        wall times of the interpreter itself and of bin/ruledxml
+                    with and without the rules cache
+    :rtype:         dict
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, 'source.xml')
+        rules = os.path.join(tmpdir, 'rules.py')
+        with open(source, 'wb') as fp:
+            fp.write(SOURCE)
+        with open(rules, 'w') as fp:
+            fp.write(RULES)
+
+        env = environment()
+        env['RULEDXML_CACHE_DIR'] = os.path.join(tmpdir, 'cache')
+        cli = [sys.executable, os.path.join(ROOT, 'bin', 'ruledxml'), source, rules]
+
+        def run_cli(name, *flags):
+            # bin/ruledxml never overwrites files, so use a new directory per run
+            outdir = tempfile.mkdtemp(dir=tmpdir)
+            return cli + [os.path.join(outdir, name)] + list(flags)
+
+        subprocess.run(run_cli('warmup.xml'), check=True, env=env)
+
+        return {
+            'python': wall_time(lambda: [sys.executable, '-c', 'pass'], runs, env),
+            'ruledxml': wall_time(lambda: run_cli('target.xml'), runs, env),
+            'ruledxml_no_cache': wall_time(lambda: run_cli('target.xml', '--no-cache'), runs, env)
+        }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Compare `results` with `baseline`.
+
+    :param results:     results of this run
+    :type results:      dict
+    :param baseline:    results of a previous run
+    :type baseline:     dict
+    :param tolerance:   allowed relative slowdown, eg. 0.2 for 20%
+    :type tolerance:    float
+    :return:            messages describing regressions
+    :rtype:             list
+    """
+    pairs = [
+        ('import time [us]', results['imports']['total_us'],
+         baseline['imports']['total_us']),
+        ('bin/ruledxml median [s]', results['cold_start']['ruledxml']['median'],
+         baseline['cold_start']['ruledxml']['median'])
+    ]
+
+    msgs = []
+    for name, now, before in pairs:
+        if now > before * (1 + tolerance):
+            msgs.append('{}: {:.4g} > {:.4g} (+{:.0%})'.format(
+                name, now, before, now / before - 1))
+    return msgs
+
+
+def report(results: dict):
+    """Print a summary of `results`"""
+    imports = results['imports']
+    print('import time of {!r}: {:.1f} ms'.format(imports['code'], imports['total_us'] / 1000))
+    for name, selftime in list(imports['modules'].items())[:10]:
+        print('  {:>8.1f} ms  {}'.format(selftime / 1000, name))
+
+    print('cold start wall time (min / median / max):')
+    for name, times in results['cold_start'].items():
+        print('  {:<18} {:.1f} / {:.1f} / {:.1f} ms'.format(name,
+            times['min'] * 1000, times['median'] * 1000, times['max'] * 1000))
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main routine"""
+    results = {
+        'benchmark': 'startup',
+        'python': sys.version,
+        'platform': platform.platform(),
+        'imports': measure_imports(args.runs),
+        'cold_start': measure_cold_start(args.runs)
+    }
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        msgs = regressions(results, baseline, args.tolerance)
+        for msg in msgs:
+            print('REGRESSION ' + msg, file=sys.stderr)
+        return 1 if msgs else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of ruledxml.')
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='number of runs per measurement')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('-b', '--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown compared to the baseline')
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+"""
+    benchmarks/suite.py
+    -------------------
+
+    Synthetic benchmark suite of ruledxml.
+
+    Documents and rules files are generated by `generators` at several
+    scales. For every scale, it measures
+
+    * ``classify_rules``: validation, classification and ordering of rules
+    * ``compile_rules``: creation of a `RulePlan`
+    * ``run``: a compiled plan applied to the generated document
+    * ``batch_run``: rules applied to every record, one output file each
+    * ``traverse``: `xml.traverse` of the paths of all groups
+    * ``read_source``: `xml.read_source` of all header fields and record names
+    * ``write_destination``: `xml.write_destination` of one element per basic rule
+
+    The last three are repeated `REPEAT` times per run.
+
+    Every benchmark is repeated and min, median and max wall time are
+    reported. Results are written as JSON. If a baseline JSON file is
+    given, the exit code is 1 if some median got slower than the baseline
+    by more than the given tolerance.
+
+    Usage::
+
+        python3 benchmarks/suite.py --scale small --scale medium --output suite.json
+        python3 benchmarks/suite.py --baseline suite.json
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ruledxml.core
+import ruledxml.xml
+
+import generators
+
+
+SCALES = {
+    'small': {'records': 100, 'basic': 10, 'depth': 1, 'fanout': 3, 'attributes': 2},
+    'medium': {'records': 1000, 'basic': 50, 'depth': 2, 'fanout': 3, 'attributes': 4},
+    'large': {'records': 5000, 'basic': 200, 'depth': 2, 'fanout': 4, 'attributes': 8}
+}
+REPEAT = 100
+
+
+def measure(func, runs: int) -> dict:
+    """Call `func` `runs` times and report its wall time in seconds.
+
+    :param func:    a callable without arguments
+    :type func:     callable
+    :param runs:    number of runs
+    :type runs:     int
+    :return:        min, median and max wall time
+    :rtype:         dict
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'runs': runs,
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times)
+    }
+
+
+def benchmark_scale(params: dict, runs: int, namespaced: bool, tmpdir: str) -> dict:
+    """Run all benchmarks for one scale.
+
+    :param params:      parameters of the generators
+    :type params:       dict
+    :param runs:        number of runs per benchmark
+    :type runs:         int
+    :param namespaced:  write the output in an XML namespace
+    :type namespaced:   bool
+    :param tmpdir:      directory for generated files
+    :type tmpdir:       str
+    :return:            results per benchmark
+    :rtype:             dict
+    """
+    source = generators.source_document(params['records'], depth=params['depth'],
+        fanout=params['fanout'], attributes=params['attributes'])
+    rules_path = os.path.join(tmpdir, 'rules.py')
+    batch_path = os.path.join(tmpdir, 'batch_rules.py')
+    with open(rules_path, 'w') as fp:
+        fp.write(generators.rules(params['basic'], depth=params['depth'],
+            namespaced=namespaced))
+    with open(batch_path, 'w') as fp:
+        fp.write(generators.batch_rules(depth=params['depth']))
+
+    rules, meta = ruledxml.core.read_rulesfile(rules_path)
+    plan = ruledxml.core.compile_rules(rules, meta)
+    batch_plan = ruledxml.core.load_plan(batch_path)
+    dom = ruledxml.xml.read(io.BytesIO(source))
+
+    outdir = tempfile.mkdtemp(dir=tmpdir)
+    outputs = [os.path.join(outdir, '{}.xml'.format(i)) for i in range(params['records'])]
+
+    group_paths = [generators.group_path('/data/records/record', level)
+                   for level in range(1, params['depth'] + 1)]
+    source_paths = ['/data/header/field{}'.format(i) for i in range(10)] + \
+                   ['/data/records/record/name', '/data/records/record@id']
+    destinations = ['/out/header/f{}'.format(i) for i in range(params['basic'])]
+
+    def classify():
+        ruledxml.core.validate_rules(rules)
+        ruledxml.core.reorder_rules(ruledxml.core.classify_rules(rules))
+
+    def run():
+        ruledxml.core.run(io.BytesIO(source), plan, io.BytesIO())
+
+    def batch_run():
+        ruledxml.core.batch_run(io.BytesIO(source), batch_plan, outputs,
+            '/data/records/record')
+
+    def traverse():
+        for _ in range(REPEAT):
+            for path in group_paths:
+                ruledxml.xml.traverse(dom, path)
+
+    def read_source():
+        for _ in range(REPEAT):
+            for path in source_paths:
+                ruledxml.xml.read_source(dom, path)
+
+    def write_destination():
+        for _ in range(REPEAT):
+            target, index = None, ruledxml.xml.TargetIndex()
+            for path in destinations:
+                target = ruledxml.xml.write_destination(target, path, 'value', index=index)
+
+    return {
+        'classify_rules': measure(classify, runs),
+        'compile_rules': measure(lambda: ruledxml.core.compile_rules(rules, meta), runs),
+        'run': measure(run, runs),
+        'batch_run': measure(batch_run, runs),
+        'traverse': measure(traverse, runs),
+        'read_source': measure(read_source, runs),
+        'write_destination': measure(write_destination, runs)
+    }
+
+
+def git_commit() -> str:
+    """Return the commit of the source tree or an empty string"""
+    try:
+        proc = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return proc.stdout.strip()
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Compare median wall times of `results` with `baseline`.
+    Benchmarks missing in either are skipped.
+
+    :param results:     results of this run
+    :type results:      dict
+    :param baseline:    results of a previous run
+    :type baseline:     dict
+    :param tolerance:   allowed relative slowdown, eg. 0.2 for 20%
+    :type tolerance:    float
+    :return:            messages describing regressions
+    :rtype:             list
+    """
+    msgs = []
+    for scale, benchmarks in results['scales'].items():
+        before = baseline['scales'].get(scale, {}).get('results', {})
+        for name, times in benchmarks['results'].items():
+            if name not in before:
+                continue
+            now, then = times['median'], before[name]['median']
+            if now > then * (1 + tolerance):
+                msgs.append('{}/{}: {:.4g} s > {:.4g} s (+{:.0%})'.format(
+                    scale, name, now, then, now / then - 1))
+    return msgs
+
+
+def report(results: dict):
+    """Print a summary of `results`"""
+    for scale, benchmarks in results['scales'].items():
+        print('{} ({})'.format(scale, ', '.join('{}={}'.format(k, v)
+                                               for k, v in benchmarks['parameters'].items())))
+        for name, times in benchmarks['results'].items():
+            print('  {:<20} {:>10.3f} / {:>10.3f} / {:>10.3f} ms'.format(name,
+                times['min'] * 1000, times['median'] * 1000, times['max'] * 1000))
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main routine"""
+    results = {
+        'benchmark': 'suite',
+        'commit': git_commit(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'namespaced': args.namespaced,
+        'scales': {}
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in args.scales or ['small', 'medium']:
+            results['scales'][scale] = {
+                'parameters': SCALES[scale],
+                'results': benchmark_scale(SCALES[scale], args.runs, args.namespaced, tmpdir)
+            }
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        msgs = regressions(results, baseline, args.tolerance)
+        for msg in msgs:
+            print('REGRESSION ' + msg, file=sys.stderr)
+        return 1 if msgs else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the synthetic benchmark suite of ruledxml.')
+    parser.add_argument('-s', '--scale', dest='scales', action='append', choices=sorted(SCALES),
+                        help='scale to benchmark; repeat for several (default: small, medium)')
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='number of runs per benchmark')
+    parser.add_argument('--namespaced', action='store_true',
+                        help='write the output in an XML namespace')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('-b', '--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown compared to the baseline')
+
+    sys.exit(main(parser.parse_args()))
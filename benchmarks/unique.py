@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+    benchmarks/unique.py
+    --------------------
+
+    Benchmark of the allocation of unique output filepaths.
+
+    A directory is filled with ``--files`` files named like outputs of
+    ``ruledxml-batched`` (``out.xml``, ``out_0.xml``, …) and
+    ``--allocations`` further filepaths with the same prefix are reserved
+
+    * ``probing``: by probing every candidate with ``os.path.exists``
+      (like `fs.create_unique_filepath` used to), only for the first
+      ``--probing-allocations`` filepaths, since it takes quadratic time
+    * ``allocator``: by one `fs.UniqueFilepaths` (scanning the directory
+      once after a few taken candidates)
+    * ``allocator_fresh``: by a new `fs.UniqueFilepaths` per filepath
+      (like independent ``ruledxml`` processes)
+
+    For every variant, total wall time and time per filepath are reported.
+
+    Usage::
+
+        python3 benchmarks/unique.py --files 100000 --output unique.json
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import sys
+import json
+import time
+import string
+import argparse
+import platform
+import tempfile
+import itertools
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ruledxml.fs
+
+
+def probing(folder: str, prefix: str, suffix: str) -> str:
+    """Reserve a filepath by probing candidates one by one"""
+    def candidates():
+        yield prefix + suffix
+        for i in itertools.count(1):
+            for variation in itertools.product(string.digits, repeat=i):
+                yield prefix + '_' + ''.join(variation) + suffix
+
+    for name in candidates():
+        filepath = os.path.join(folder, name)
+        if not os.path.exists(filepath):
+            open(filepath, 'w').close()
+            return filepath
+
+
+def populate(folder: str, files: int):
+    """Create `files` empty files, which take the first candidates of ``out.xml``"""
+    allocator = ruledxml.fs.UniqueFilepaths(folder)
+    for index in range(files):
+        open(os.path.join(folder, allocator.candidate('out', '.xml', index)), 'w').close()
+
+
+def measure(files: int, allocations: int, variant: str) -> dict:
+    """Reserve `allocations` filepaths in a directory of `files` files.
+
+    :param files:           number of existing files
+    :type files:            int
+    :param allocations:     number of filepaths to reserve
+    :type allocations:      int
+    :param variant:         ``probing``, ``allocator`` or ``allocator_fresh``
+    :type variant:          str
+    :return:                total wall time and wall time per filepath
+    :rtype:                 dict
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        populate(folder, files)
+
+        allocator = ruledxml.fs.UniqueFilepaths(folder)
+        start = time.perf_counter()
+        for _ in range(allocations):
+            if variant == 'probing':
+                probing(folder, 'out', '.xml')
+            elif variant == 'allocator':
+                allocator.allocate('out', '.xml', reserve=True)
+            else:
+                ruledxml.fs.UniqueFilepaths(folder).allocate('out', '.xml', reserve=True)
+        elapsed = time.perf_counter() - start
+
+        if len(os.listdir(folder)) != files + allocations:
+            raise RuntimeError('{} allocated a filepath twice'.format(variant))
+
+    return {'allocations': allocations, 'total': elapsed,
+            'per_allocation': elapsed / max(allocations, 1)}
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main routine"""
+    results = {
+        'benchmark': 'unique',
+        'python': sys.version,
+        'platform': platform.platform(),
+        'files': args.files,
+        'results': {
+            'probing': measure(args.files, args.probing_allocations, 'probing'),
+            'allocator': measure(args.files, args.allocations, 'allocator'),
+            'allocator_fresh': measure(args.files, args.probing_allocations, 'allocator_fresh')
+        }
+    }
+
+    print('directory of {} files'.format(args.files))
+    for name, values in results['results'].items():
+        print('  {:<16} {:>7} filepaths {:>10.3f} s {:>12.3f} ms/filepath'.format(name,
+            values['allocations'], values['total'], values['per_allocation'] * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark allocation of unique filepaths.')
+    parser.add_argument('-f', '--files', type=int, default=100000,
+                        help='number of files in the directory')
+    parser.add_argument('-a', '--allocations', type=int, default=10000,
+                        help='number of filepaths to allocate')
+    parser.add_argument('-p', '--probing-allocations', type=int, default=10,
+                        help='number of filepaths to allocate by probing or by fresh allocators')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+
+    sys.exit(main(parser.parse_args()))
@@ -21,25 +21,65 @@ __license__ = '3-clause BSD license'
 __docformat__ = 'reStructuredText en'
 
 
-# shorter names
-from .core import read_rulesfile
-from .xml import read as read_source_xml
-from .xml import write as write_target_xml
+import importlib
 
 # names with modified module ref
-from .decorators import source, destination, foreach
+from .decorators import source, destination, foreach, batch, memoize, lookup
 
-# generic names
-from .core import unique_function, required_exists
-from .core import apply_rules, batch_run, run
-from . import xml
-from . import exceptions
-from . import fs
+
+# Everything else is imported on first access (see `__getattr__`).
+# Hence rules files and command line tools only load lxml and
+# the submodules they actually use.
+LAZY_NAMES = {
+    # shorter names
+    'read_rulesfile': ('core', 'read_rulesfile'),
+    'read_source_xml': ('xml', 'read'),
+    'write_target_xml': ('xml', 'write'),
+
+    # generic names
+    'unique_function': ('core', 'unique_function'),
+    'required_exists': ('core', 'required_exists'),
+    'apply_rules': ('core', 'apply_rules'),
+    'batch_run': ('core', 'batch_run'),
+    'run': ('core', 'run'),
+    'run_many': ('core', 'run_many'),
+    'RulePlan': ('core', 'RulePlan'),
+    'compile_rules': ('core', 'compile_rules'),
+    'load_plan': ('core', 'load_plan')
+}
+LAZY_MODULES = {'core', 'xml', 'paths', 'exceptions', 'fs', 'cache', 'parallel',
+                'memo', 'lookups', 'profiling', 'fingerprints', 'watch',
+                'client', 'server', 'pipeline'}
+
+
+def __getattr__(name: str):
+    """Import submodules and their members on first access.
+
+    :param name:            attribute name
+    :type name:             str
+    :return:                a submodule or a member of a submodule
+    :raises AttributeError: `name` is unknown
+    """
+    if name in LAZY_MODULES:
+        value = importlib.import_module('.' + name, __name__)
+    elif name in LAZY_NAMES:
+        module, member = LAZY_NAMES[name]
+        value = getattr(importlib.import_module('.' + module, __name__), member)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_NAMES) | LAZY_MODULES)
 
 
 __all__ = [
     'read_source_xml', 'read_rulesfile', 'write_target_xml',
-    'source', 'destination', 'foreach',
-    'unique_function', 'required_exists', 'batch_run', 'run'
-    'xml', 'exceptions', 'fs'
+    'source', 'destination', 'foreach', 'batch', 'memoize', 'lookup',
+    'unique_function', 'required_exists', 'batch_run', 'run', 'run_many',
+    'RulePlan', 'compile_rules', 'load_plan',
+    'xml', 'paths', 'exceptions', 'fs'
 ]
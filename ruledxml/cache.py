@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.cache
+    --------------
+
+    On-disk caches of compiled rules files and of transformation results.
+
+    `RulesCache` entries are keyed by the SHA-256 hash of the rules file's content,
+    the python bytecode tag, the ruledxml version and a hash of the source
+    code of the modules classifying rules (see `engine_digest`), hence
+    entries of other checkouts are never restored. An entry stores the
+    bytecode of the rules file, a `portable` representation of the
+    decorator metadata of all rules and the computed order of rules. Loading a rules file from the
+    cache skips the unique function scan, validation, classification
+    and compilation of the python source.
+
+    `ResultCache` entries are output XML documents keyed by the SHA-256
+    hash of the input document, the rules file, the fingerprints of its
+    rules (covering helper functions and global values they use, also if
+    imported from other modules), its lookup documents and the ruledxml
+    version. Hence redelivered byte-identical input files are not parsed
+    and transformed again. The total size of all entries is bounded (also
+    if several processes share the directory); least recently used
+    entries are evicted first.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import sys
+import types
+import shutil
+import pickle
+import marshal
+import hashlib
+import logging
+import weakref
+
+from . import core
+from . import exceptions
+
+
+def default_directory() -> str:
+    """Return the default cache directory.
+    ``$RULEDXML_CACHE_DIR`` or ``ruledxml`` in the user's cache directory.
+
+    :return:        a directory path
+    :rtype:         str
+    """
+    if os.environ.get('RULEDXML_CACHE_DIR'):
+        return os.environ['RULEDXML_CACHE_DIR']
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join('~', '.cache')
+    return os.path.join(os.path.expanduser(base), 'ruledxml')
+
+
+def digest(content: bytes) -> str:
+    """Return the SHA-256 hex digest of `content`"""
+    return hashlib.sha256(content).hexdigest()
+
+
+# modules whose implementation determines cached plans and results
+ENGINE_MODULES = ('core', 'paths', 'xml', 'decorators', 'memo', 'lookups')
+_engine_digest = None
+
+
+def engine_digest() -> str:
+    """Return a hash of the source code of `ENGINE_MODULES`.
+    The structure of compiled plans changes along with this code.
+
+    :return:        SHA-256 hex digest
+    :rtype:         str
+    """
+    global _engine_digest
+
+    if _engine_digest is None:
+        import importlib
+        from . import __version__
+
+        hashed = hashlib.sha256(__version__.encode('utf-8'))
+        for name in ENGINE_MODULES:
+            module = importlib.import_module('.' + name, __package__)
+            try:
+                with open(module.__file__, 'rb') as fp:
+                    hashed.update(b'\0' + fp.read())
+            except (OSError, TypeError):
+                hashed.update(b'\0' + name.encode('ascii'))
+        _engine_digest = hashed.hexdigest()
+    return _engine_digest
+
+
+def portable(value):
+    """Return a representation of decorator metadata `value`, which
+    consists of builtin values only. Other objects (eg. a ``dtype``
+    function defined in the rules file) are represented by their module
+    and qualified name (or their repr), hence the representation can be
+    loaded by a process which did not execute the rules file yet.
+
+    :param value:   metadata of a rule
+    :return:        the representation
+    """
+    if isinstance(value, (str, bytes, int, float, complex, bool, type(None))):
+        return value
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return type(value)(portable(item) for item in value)
+    elif isinstance(value, dict):
+        return {portable(key): portable(item) for key, item in value.items()}
+
+    name = getattr(value, '__qualname__', None)
+    if isinstance(name, str):
+        return ('<object>', getattr(value, '__module__', None) or '', name)
+    return ('<object>', type(value).__module__, repr(value))
+
+
+def execute(code, filepath: str) -> types.ModuleType:
+    """Execute the bytecode of a rules file as new module.
+
+    :param code:        bytecode of the rules file
+    :type code:         code
+    :param filepath:    filepath of the rules file
+    :type filepath:     str
+    :return:            the module
+    :rtype:             module
+    """
+    name = core.modulename(filepath)
+    module = types.ModuleType(name)
+    module.__file__ = filepath
+    sys.modules[name] = module
+    exec(code, module.__dict__)
+    return module
+
+
+class RulesCache:
+    """Cache of compiled rules files in a directory"""
+
+    def __init__(self, directory=None):
+        """Initialize the cache. The directory is created on first write.
+
+        :param directory:   cache directory; see `default_directory` if None
+        :type directory:    str
+        """
+        from . import __version__
+
+        self.directory = directory or default_directory()
+        self.tag = '{}-{}-{}'.format(sys.implementation.cache_tag, __version__,
+                                     engine_digest()[:16])
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, source: bytes) -> str:
+        """Filepath of the cache entry for a rules file with content `source`.
+
+        :param source:      content of a rules file
+        :type source:       bytes
+        :return:            filepath of the cache entry
+        :rtype:             str
+        """
+        return os.path.join(self.directory, '{}.{}.rules'.format(digest(source), self.tag))
+
+    def load(self, filepath: str) -> core.RulePlan:
+        """Return the compiled plan of a rules file.
+        On a cache miss the rules file is compiled and stored.
+
+        :param filepath:            filepath of a rules file
+        :type filepath:             str
+        :return:                    the compiled plan
+        :rtype:                     core.RulePlan
+        :raises RuledXmlException:  rules file or some rule is invalid
+        """
+        with open(filepath, 'rb') as fp:
+            source = fp.read()
+
+        entry_path = self.entry(source)
+        entry = self.read(entry_path)
+        if entry is not None:
+            plan = self.restore(entry, filepath, source)
+            if plan is not None:
+                self.hits += 1
+                logging.info('Loaded rules of %s from cache %s', filepath, entry_path)
+                return plan
+
+        self.misses += 1
+        plan, entry = self.compile(source, filepath)
+        self.write(entry_path, entry)
+        return plan
+
+    def compile(self, source: bytes, filepath: str) -> tuple:
+        """Compile a rules file and create its cache entry.
+
+        :param source:              content of the rules file
+        :type source:               bytes
+        :param filepath:            filepath of the rules file
+        :type filepath:             str
+        :return:                    the compiled plan and the cache entry
+        :rtype:                     tuple(core.RulePlan, dict)
+        :raises RuledXmlException:  rules file or some rule is invalid
+        """
+        core.unique_function(filepath)
+        code = compile(source, filepath, 'exec', dont_inherit=True)
+        rules, meta = core.rulesfile_members(execute(code, filepath), filepath)
+        plan = core.compile_rules(rules, meta, digest=digest(source))
+
+        entry = {
+            'code': marshal.dumps(code),
+            'metadata': {name: portable(rule.metadata) for name, rule in rules.items()},
+            'order': plan.order
+        }
+        return plan, entry
+
+    def restore(self, entry: dict, filepath: str, source=None):
+        """Create a plan from a cache entry. Return None, if the rules
+        defined by the executed bytecode do not match the entry (eg. because
+        a module imported by the rules file has changed).
+
+        :param entry:       the cache entry
+        :type entry:        dict
+        :param filepath:    filepath of the rules file
+        :type filepath:     str
+        :param source:      content of the rules file
+        :type source:       bytes
+        :return:            the compiled plan or None
+        :rtype:             core.RulePlan
+        """
+        module = execute(marshal.loads(entry['code']), filepath)
+        names = {member for member in dir(module) if member.startswith('rule')}
+        if names != set(entry['metadata']):
+            return None
+
+        # metadata objects are taken from the executed module
+        rules = {}
+        for name in names:
+            rule = getattr(module, name)
+            if portable(getattr(rule, 'metadata', None)) != entry['metadata'][name]:
+                return None
+            rules[name] = rule
+
+        # metadata is cheap to collect and refers to paths relative to the rules file
+        meta = core.rulesfile_members(module, filepath)[1]
+        return core.RulePlan(rules, meta, order=entry['order'],
+            digest=None if source is None else digest(source))
+
+    def read(self, entry_path: str):
+        """Read a cache entry. Return None if it does not exist or is corrupt.
+
+        :param entry_path:  filepath of the cache entry
+        :type entry_path:   str
+        :return:            the cache entry or None
+        :rtype:             dict
+        """
+        try:
+            with open(entry_path, 'rb') as fp:
+                return pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning('Ignoring corrupt cache entry %s: %s', entry_path, e)
+            return None
+
+    def write(self, entry_path: str, entry: dict):
+        """Atomically write a cache entry. Failures are logged, but ignored.
+
+        :param entry_path:  filepath of the cache entry
+        :type entry_path:   str
+        :param entry:       the cache entry
+        :type entry:        dict
+        """
+        import tempfile
+
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry_path)
+        except Exception as e:
+            logging.warning('Could not write cache entry %s: %s', entry_path, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+# default size limit of a `ResultCache` in bytes
+DEFAULT_RESULT_CACHE_SIZE = 256 * 1024 * 1024
+RESULT_COUNTERS = ('hits', 'misses', 'evictions')
+# file in a result cache directory holding the total size of all entries
+RESULT_SIZE_FILE = 'size'
+
+
+class ResultCache:
+    """Size-bounded cache of output documents in a directory.
+
+    The modification time of an entry is updated whenever it is used.
+    If the cache exceeds `maxsize` bytes after storing an entry, entries
+    with the oldest modification time are removed. Several processes
+    can share the same directory. They keep the total size of all
+    entries in `RESULT_SIZE_FILE`, which is locked while it is updated.
+    """
+
+    def __init__(self, directory=None, maxsize=DEFAULT_RESULT_CACHE_SIZE):
+        """Initialize the cache. The directory is created on first write.
+
+        :param directory:   cache directory; ``results`` in `default_directory` if None
+        :type directory:    str
+        :param maxsize:     maximum total size of all entries in bytes
+        :type maxsize:      int
+        """
+        from . import __version__
+
+        self.directory = directory or os.path.join(default_directory(), 'results')
+        self.maxsize = maxsize
+        self.version = __version__
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._fingerprints = weakref.WeakKeyDictionary()
+
+    def fingerprints(self, plan: core.RulePlan) -> str:
+        """Return a hash of the fingerprints of all rules of `plan`.
+        Unlike `RulePlan.digest`, it changes if a helper function or
+        global value imported by the rules file changes. It is computed
+        once per plan.
+
+        :param plan:    the compiled rules
+        :type plan:     core.RulePlan
+        :return:        SHA-256 hex digest
+        :rtype:         str
+        """
+        from . import fingerprints
+
+        cached = self._fingerprints.get(plan)
+        if cached is not None:
+            return cached
+
+        hashed = hashlib.sha256()
+        for name in sorted(plan.rules):
+            hashed.update(name.encode('utf-8') + b'\0')
+            hashed.update(fingerprints.fingerprint(plan.rules[name]).encode('ascii') + b'\0')
+        digest = hashed.hexdigest()
+        self._fingerprints[plan] = digest
+        return digest
+
+    def key(self, source: bytes, plan: core.RulePlan) -> str:
+        """Return the key of the output of applying `plan` to `source`.
+
+        :param source:              content of the input XML document
+        :type source:               bytes
+        :param plan:                the compiled rules
+        :type plan:                 core.RulePlan
+        :return:                    the key
+        :rtype:                     str
+        :raises RuledXmlException:  the rules file of `plan` is unknown
+        """
+        if plan.digest is None:
+            msg = "Cannot cache results of rules, which were not loaded from a rules file"
+            raise exceptions.RuledXmlException(msg)
+
+        hashed = hashlib.sha256()
+        hashed.update(self.version.encode('utf-8') + b'\0' + plan.digest.encode('ascii'))
+        hashed.update(b'\0' + self.fingerprints(plan).encode('ascii'))
+        for name in sorted(plan.lookups):
+            hashed.update(b'\0' + name.encode('utf-8') + b'\0' + plan.lookups[name].digest.encode('ascii'))
+        hashed.update(b'\0' + source)
+        return hashed.hexdigest()
+
+    def entry(self, key: str) -> str:
+        """Filepath of the cache entry with `key`"""
+        return os.path.join(self.directory, key + '.xml')
+
+    def get(self, key: str, out_fd) -> bool:
+        """Copy the cached output with `key` to file descriptor `out_fd`.
+
+        :param key:         key as returned by `key`
+        :type key:          str
+        :param out_fd:      binary file descriptor to write to
+        :type out_fd:       _io.BufferedWriter
+        :return:            whether the output was cached
+        :rtype:             bool
+        """
+        entry_path = self.entry(key)
+        try:
+            with open(entry_path, 'rb') as fp:
+                shutil.copyfileobj(fp, out_fd)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass  # evicted concurrently
+        self.hits += 1
+        logging.info('Copied result from cache %s', entry_path)
+        return True
+
+    def put(self, key: str, output: bytes):
+        """Atomically store `output` with `key` and evict entries if the
+        cache got too large. Failures are logged, but ignored.
+
+        :param key:         key as returned by `key`
+        :type key:          str
+        :param output:      the output XML document
+        :type output:       bytes
+        """
+        import tempfile
+
+        if len(output) > self.maxsize:
+            return
+
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(output)
+            os.replace(tmp, self.entry(key))
+        except Exception as e:
+            logging.warning('Could not write cache entry %s: %s', self.entry(key), e)
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+
+        try:
+            self.account(len(output))
+        except OSError as e:
+            logging.warning('Could not update the size of cache %s: %s', self.directory, e)
+
+    def account(self, added: int):
+        """Add `added` bytes to the total size of all entries shared by all
+        processes using the directory and evict entries if the cache got
+        too large. Without ``fcntl``, the directory is scanned instead.
+
+        :param added:       size of a new entry in bytes
+        :type added:        int
+        """
+        try:
+            import fcntl
+        except ImportError:
+            if self.size() > self.maxsize:
+                self.evict()
+            return
+
+        size_path = os.path.join(self.directory, RESULT_SIZE_FILE)
+        fd = os.open(size_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                total = int(os.read(fd, 32)) + added
+            except ValueError:
+                # new or corrupt size file; the new entry is counted by the scan
+                total = self.size()
+            if total > self.maxsize:
+                total = self.evict()
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(total).encode('ascii'))
+        finally:
+            os.close(fd)
+
+    def entries(self) -> list:
+        """Return (modification time, size, filepath) of all entries"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for dirent in it:
+                    if not dirent.name.endswith('.xml'):
+                        continue
+                    try:
+                        stat = dirent.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, dirent.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def size(self) -> int:
+        """Return the total size of all entries in bytes"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits `maxsize`.
+
+        :return:    the total size of the remaining entries in bytes
+        :rtype:     int
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.unlink(entry_path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # evicted by another process
+            total -= size
+        return total
+
+    def counters(self) -> dict:
+        """Return hit, miss and eviction counts"""
+        return {name: getattr(self, name) for name in RESULT_COUNTERS}
+
+    def merge(self, counters: dict):
+        """Add counters of another process to the counters of this cache.
+
+        :param counters:    counters as returned by `counters`
+        :type counters:     dict
+        """
+        for name in RESULT_COUNTERS:
+            setattr(self, name, getattr(self, name) + counters.get(name, 0))
+
+    def stats(self) -> dict:
+        """Return hit, miss and eviction counts as well as the current
+        and maximum size of the cache in bytes.
+
+        :return:        the statistics
+        :rtype:         dict
+        """
+        stats = self.counters()
+        stats.update(size=self.size(), maxsize=self.maxsize)
+        return stats
+
+    def report(self) -> str:
+        """Format the statistics as one line of text"""
+        stats = self.stats()
+        template = 'result cache: {} hits, {} misses, {} evictions ({:.1f} of {:.1f} MiB used)'
+        return template.format(stats['hits'], stats['misses'], stats['evictions'],
+            stats['size'] / 2 ** 20, stats['maxsize'] / 2 ** 20)
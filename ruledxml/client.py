@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.client
+    ---------------
+
+    Client of the ruledxml daemon (see `ruledxml.server`).
+
+    Client and daemon communicate over a Unix domain socket. Every message
+    consists of a 4-byte big-endian length, a JSON header of this length
+    and a payload of ``header['size']`` bytes. A request header contains
+
+    * ``rules``: filepath to the rules file
+    * ``input``: filepath to the input XML file (if no payload is sent)
+    * ``output``: filepath of the output XML file (optional)
+    * ``incremental``: write the target XML incrementally (optional)
+    * ``prune``: parse only source elements rules can reach (optional)
+
+    The response header contains ``exitcode``, ``error``, ``output`` and
+    ``elapsed``. If the request did not specify an output filepath,
+    the target XML document is sent as payload.
+
+    This module does not import lxml or the rules engine,
+    hence clients start fast.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import json
+import socket
+import struct
+import collections
+
+from . import exceptions
+
+
+HEADER_LENGTH = struct.Struct('!I')
+
+Response = collections.namedtuple('Response',
+    ['exitcode', 'error', 'output', 'data', 'elapsed'])
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """Receive exactly `size` bytes from `sock`.
+    Returns fewer bytes only if the peer closed the connection.
+
+    :param sock:    a connected socket
+    :type sock:     socket.socket
+    :param size:    number of bytes to receive
+    :type size:     int
+    :return:        the received bytes
+    :rtype:         bytes
+    """
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(min(size - len(buf), 1 << 20))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+
+def send_message(sock: socket.socket, header: dict, payload=b''):
+    """Send one message.
+
+    :param sock:        a connected socket
+    :type sock:         socket.socket
+    :param header:      the message header; must be serializable as JSON
+    :type header:       dict
+    :param payload:     the payload
+    :type payload:      bytes
+    """
+    header = dict(header, size=len(payload))
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(HEADER_LENGTH.pack(len(encoded)) + encoded)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock: socket.socket):
+    """Receive one message. Returns None if the peer closed
+    the connection before a message started.
+
+    :param sock:                a connected socket
+    :type sock:                 socket.socket
+    :return:                    header and payload
+    :rtype:                     tuple(dict, bytes)
+    :raises RuledXmlException:  connection closed within a message
+    """
+    prefix = recv_exactly(sock, HEADER_LENGTH.size)
+    if not prefix:
+        return None
+    elif len(prefix) < HEADER_LENGTH.size:
+        raise exceptions.RuledXmlException("Connection closed within a message")
+
+    length, = HEADER_LENGTH.unpack(prefix)
+    encoded = recv_exactly(sock, length)
+    if len(encoded) < length:
+        raise exceptions.RuledXmlException("Connection closed within a message")
+    header = json.loads(encoded.decode('utf-8'))
+
+    size = header.get('size', 0)
+    payload = recv_exactly(sock, size)
+    if len(payload) < size:
+        raise exceptions.RuledXmlException("Connection closed within a message")
+
+    return header, payload
+
+
+class Client:
+    """A connection to a ruledxml daemon. Requests are sent one after
+    another over the same connection; use one client per thread.
+
+    >>> with Client('/run/ruledxml.sock') as client:
+    ...     response = client.transform('rules.py', 'in.xml', output='out.xml')
+    ...     print(response.exitcode)
+    """
+
+    def __init__(self, path: str, timeout=None):
+        """Initialize a client. The connection is established on first use.
+
+        :param path:        filepath of the daemon's socket
+        :type path:         str
+        :param timeout:     socket timeout in seconds; no timeout if None
+        :type timeout:      float
+        """
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        """Connect to the daemon, unless already connected"""
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._sock = sock
+
+    def close(self):
+        """Close the connection"""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def request(self, header: dict, payload=b'') -> tuple:
+        """Send a request and wait for its response.
+
+        :param header:              the request header
+        :type header:               dict
+        :param payload:             the request payload
+        :type payload:              bytes
+        :return:                    header and payload of the response
+        :rtype:                     tuple(dict, bytes)
+        :raises RuledXmlException:  daemon closed the connection
+        """
+        self.connect()
+        try:
+            send_message(self._sock, header, payload)
+            response = recv_message(self._sock)
+        except Exception:
+            self.close()
+            raise
+
+        if response is None:
+            self.close()
+            raise exceptions.RuledXmlException("Daemon closed the connection")
+        return response
+
+    def transform(self, rules: str, source=None, *, data=None, output=None,
+        incremental=False, prune=False) -> Response:
+        """Let the daemon apply a rules file to an XML document.
+        The document is either given as filepath `source` or as bytes `data`.
+        If `output` is None, the target XML document is returned
+        as `Response.data`. Relative filepaths are sent as absolute paths.
+
+        :param rules:           filepath to the rules file
+        :type rules:            str
+        :param source:          filepath to the input XML file
+        :type source:           str
+        :param data:            content of the input XML file
+        :type data:             bytes
+        :param output:          filepath of the output XML file
+        :type output:           str
+        :param incremental:     write the target XML incrementally
+        :type incremental:      bool
+        :param prune:           parse only source elements rules can reach
+        :type prune:            bool
+        :return:                the response of the daemon
+        :rtype:                 Response
+        :raises RuledXmlException:  neither or both of `source` and `data` given
+        """
+        if (source is None) == (data is None):
+            msg = "Exactly one of source filepath and data must be given"
+            raise exceptions.RuledXmlException(msg)
+
+        header = {
+            'rules': os.path.abspath(rules),
+            'input': None if source is None else os.path.abspath(source),
+            'output': None if output is None else os.path.abspath(output),
+            'incremental': incremental,
+            'prune': prune
+        }
+        response, payload = self.request(header, data or b'')
+        return Response(response['exitcode'], response['error'],
+            response['output'], payload if output is None else None,
+            response['elapsed'])
@@ -16,19 +16,26 @@
     (C) 2015, meisterluk, BSD 3-clause license
 """
 
+import io
 import re
 import sys
+import copy
+import time
+import types
+import hashlib
 import os.path
 import logging
-import pathlib
-import argparse
-import importlib.machinery
-import collections
+import threading
+import traceback
 
 import lxml.etree
 
 from . import fs
 from . import xml
+from . import memo
+from . import lookups
+from . import profiling
+from . import paths
 from . import exceptions
 
 
@@ -57,12 +64,14 @@ def unique_function(filepath: str):
                 raise exceptions.RuledXmlException(msg)
 
             functions[name] = lineno
-            logging.info("Found {} at line {}".format(name, lineno))
+            logging.info("Found %s at line %d", name, lineno)
 
 
-def required_exists(dom: lxml.etree.Element, nonempty=None, required=None, *, filepath=''):
+def required_exists(dom: lxml.etree.Element, nonempty=None, required=None, *,
+    filepath='', resolved=None):
     """Validate `required` and `nonempty` fields.
     ie. raise InvalidPathException if path does not exist in `dom`.
+    If `resolved` is given, paths are looked up there instead of in `dom`.
 
     :param dom:                   the root element of a DOM to validate
     :type dom:                    lxml.etree.Element
@@ -72,8 +81,12 @@ def required_exists(dom: lxml.etree.Element, nonempty=None, required=None, *, fi
     :type required:               set
     :param filepath:              filepath (additional info for error message)
     :type filepath:               str
+    :param resolved:              paths resolved in `dom`
+    :type resolved:               paths.Resolution
     :raises InvalidPathException: some required path does not exist / is empty
     """
+    if resolved is None:
+        resolved = paths.PathTrie(()).resolve(dom)
     if not required:
         required = set()
     if not nonempty:
@@ -84,16 +97,41 @@ def required_exists(dom: lxml.etree.Element, nonempty=None, required=None, *, fi
         suffix = " in XML file '{}'".format(filepath)
 
     for req in required:
-        if not dom.xpath(req):
+        if not resolved.exists(req):
             errmsg = 'Path {} does not exist{}'.format(req, suffix)
             raise exceptions.InvalidPathException(errmsg.format(req))
 
     for req in nonempty:
-        if xml.read_source(dom, req) == '':
+        if resolved.first(req) == '':
             errmsg = 'Path {} is empty{}; must contain value'.format(req, suffix)
             raise exceptions.InvalidPathException(errmsg.format(req))
 
 
+def default_metadata() -> dict:
+    """Return the metadata of a rules file which does not declare any.
+
+    :return:        metadata such as required attributes,
+                    xml namespaces and encoding
+    :rtype:         dict
+    """
+    return {
+        'input_required': set(),
+        'input_nonempty': set(),
+        'input_xml_namespaces': {},
+        'output_required': set(),
+        'output_nonempty': set(),
+        'output_encoding': 'utf-8',
+        'output_xml_namespaces': {},
+        'lookup_documents': {},
+        'input_remove_blank_text': False
+    }
+
+
+def modulename(path: str) -> str:
+    """Return module name for a rule file in given path"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
 def read_rulesfile(filepath: str) -> tuple([dict, set]):
     """Given a `filepath`, return its contained rules and required attributes.
     Raises a exceptions.RuledXmlException if file does not contain any rule.
@@ -104,23 +142,35 @@ def read_rulesfile(filepath: str) -> tuple([dict, set]):
                             such as required attributes, xml namespaces and encoding
     :rtype:                 tuple(dict, dict)
     """
-    def modulename(path: str) -> str:
-        """Return module name for a rule file in given path"""
-        return os.path.splitext(os.path.basename(path))[0]
+    import importlib.machinery
 
     logging.info('Reading rules from %s', filepath)
 
+    # a rules file with the same module name might have been loaded before;
+    # do not execute this rules file into the old module
+    sys.modules.pop(modulename(filepath), None)
+
     loader = importlib.machinery.SourceFileLoader(modulename(filepath), filepath)
     rulesfile = loader.load_module()
 
+    return rulesfile_members(rulesfile, filepath)
+
+
+def rulesfile_members(rulesfile, filepath=''):
+    """Given a loaded rules file module, return its contained rules
+    and required attributes.
+    Raises a exceptions.RuledXmlException if file does not contain any rule.
+
+    :param rulesfile:       the module of a rules file
+    :type rulesfile:        module
+    :param filepath:        filepath of the module for error messages
+    :type filepath:         str
+    :return:                rules (associates name to implementation) and metadata
+                            such as required attributes, xml namespaces and encoding
+    :rtype:                 tuple(dict, dict)
+    """
     rules = {}
-    metadata = {
-        'input_required': set(),
-        'input_nonempty': set(),
-        'input_xml_namespaces': {},
-        'output_encoding': 'utf-8',
-        'output_xml_namespaces': {}
-    }
+    metadata = default_metadata()
     tmpl = "Found %s attribute with %d elements"
 
     for member in dir(rulesfile):
@@ -137,16 +187,23 @@ def read_rulesfile(filepath: str) -> tuple([dict, set]):
         elif member == "output_namespaces":
             metadata['output_xml_namespaces'] = getattr(rulesfile, member)
             logging.info(tmpl, 'output_namespaces', len(metadata['output_xml_namespaces']))
+        elif member == "input_remove_blank_text":
+            metadata[member] = bool(getattr(rulesfile, member))
+            logging.info('Attribute %s found. Is set to %s', member, metadata[member])
         elif member == "output_encoding":
             metadata['output_encoding'] = getattr(rulesfile, member)
             logging.info('Attribute %s found. Is set to %s', 'output_encoding',
                 metadata['output_encoding'])
+        elif member == "lookup_documents":
+            directory = os.path.dirname(os.path.abspath(filepath)) if filepath else ''
+            metadata[member] = lookups.declarations(getattr(rulesfile, member), directory)
+            logging.info(tmpl, member, len(metadata[member]))
 
     if not rules:
         msg = "Expected at least one rule definition, none given in {}"
         raise exceptions.RuledXmlException(msg.format(filepath))
 
-    logging.debug('metadata found: %s', str(metadata))
+    logging.debug('metadata found: %s', metadata)
 
     return rules, metadata
 
@@ -172,6 +229,23 @@ def validate_rules(rules: dict):
             msg = "A rule must have exactly 1 @destination. {} has {}"
             raise exceptions.TooManyRuleDestinations(msg.format(rulename, dst_len))
 
+        if 'batch' in rule.metadata and 'each' not in rule.metadata:
+            msg = "A @batch rule requires @foreach. {} has no @foreach"
+            raise exceptions.MissingRuleForeach(msg.format(rulename))
+
+        if 'lookup' in rule.metadata and 'batch' in rule.metadata:
+            msg = "@lookup cannot be combined with @batch. {} has both"
+            raise exceptions.InvalidRuleSource(msg.format(rulename))
+
+        if 'memoize' in rule.metadata:
+            maxsize = rule.metadata['memoize']['maxsize']
+            if maxsize is not None and (not isinstance(maxsize, int) or maxsize < 0):
+                msg = "@memoize requires maxsize None or an integer >= 0. {} has {!r}"
+                raise exceptions.InvalidRuleMemoize(msg.format(rulename, maxsize))
+            if 'batch' in rule.metadata:
+                msg = "@memoize cannot be combined with @batch. {} has both"
+                raise exceptions.InvalidRuleMemoize(msg.format(rulename))
+
         # distinguish: foreach, no-foreach
         if 'each' in rule.metadata:
             each_len = len(rule.metadata['each'])
@@ -274,17 +348,37 @@ def build_recursive_structure(rules: list) -> list:
     return structure
 
 
-def classify_rules(rules: dict):
+def prepare_rule(rulename: str, rule, indexes=None):
+    """Wrap `rule` to substitute @lookup arguments and cache results of @memoize.
+
+    :param rulename:            name of the rule
+    :type rulename:             str
+    :param rule:                the rule
+    :type rule:                 function
+    :param indexes:             names associated to lookup indexes
+    :type indexes:              dict(str: lookups.LookupIndex)
+    :return:                    the rule to call
+    :rtype:                     function
+    :raises InvalidRuleSource:  @lookup refers to an undeclared document
+    """
+    return memo.memoized(lookups.bind(rule, indexes or {}, rulename))
+
+
+def classify_rules(rules: dict, indexes=None):
     """Classify rules. Represent rules as dictionary with associated metadata.
     Returns a data structure with is nicely structured to perform the @source
     and @destination algorithms with respect to @foreach semantics.
+    Rules are wrapped by `prepare_rule`.
 
     :param rules:       rule names associated to their implementation
     :type rules:        dict(str: function)
+    :param indexes:     names associated to lookup indexes
+    :type indexes:      dict(str: lookups.LookupIndex)
     :return:            a list of dictionaries containing rules with metadata;
                         might be recursive (dicts contain lists of dicts)
     :rtype:             [dict(), dict(), ...]
     """
+    rules = {name: prepare_rule(name, rule, indexes) for name, rule in rules.items()}
     classified = []
     max_user_dorder = None
 
@@ -406,9 +500,18 @@ def reorder_rules(rules: dict):
 
 
 def run_rules(src_dom: lxml.etree.Element, target_dom: lxml.etree.Element,
-    classified: list, xmlmap=None):
+    classified: list, xmlmap=None, progress=None, sources=None, profile=None):
     """Actually apply the classified rules to a target DOM.
 
+    If `sources` is given, sources of basic rules are looked up there
+    instead of evaluating them in `src_dom`. Elements of the target DOM
+    are looked up in a `xml.TargetIndex` built along with the DOM.
+
+    If `progress` is given, it is called with the index of a top-level
+    element of `classified` and the target DOM after this element was applied.
+    If a `profiling.Profile` is given, rule calls and path evaluations
+    are recorded there.
+
     :param src_dom:     the root element of a DOM to retrieve source data from
     :type src_dom:      lxml.etree.Element
     :param target_dom:  the root element of a DOM to write destination data to
@@ -418,55 +521,745 @@ def run_rules(src_dom: lxml.etree.Element, target_dom: lxml.etree.Element,
     :type classified:   [dict(), dict(), ...]
     :param xmlmap:      association of XML namespace name to URI
     :type xmlmap:       dict
-    :param bases:       Base elements (created for source @foreach elements)
-    :type bases:        list
+    :param progress:    callback invoked after every top-level element
+    :type progress:     function
+    :param sources:     paths resolved in `src_dom`
+    :type sources:      paths.Resolution
+    :param profile:     profile to record measurements in
+    :type profile:      profiling.Profile
     :return:            the root element of a new DOM
     :rtype:             lxml.etree.Element
     """
-    def finish_a_tree(src_dom, target_dom, node, src_bases, dst_bases):
+    def read_foreach_source(src_dom, src, rel, src_bases):
+        if profile is not None:
+            profile.count('sources')
+        if rel is None:
+            return xml.read_base_source(src_dom, src, bases=src_bases)
+        return xml.read_relative_source(src_bases[rel.level], rel)
+
+    def write_foreach_destination(target_dom, node, output, dst_bases, anchored):
+        if output is None:
+            return target_dom
+        if profile is not None:
+            profile.count('destinations')
+
+        rel = node['dstrel'][0] if node.get('dstrel') else None
+        if rel is not None and anchored[rel.level]:
+            xml.write_relative_destination(dst_bases[rel.level], rel,
+                output, xmlmap, index)
+            return target_dom
+        return xml.write_base_destination(target_dom, node['dst'][0],
+            output, bases=dst_bases, xmlmap=xmlmap, index=index)
+
+    def apply_batches(src_dom, node, members, src_bases):
+        # read the source columns of @batch rules and apply them once;
+        # returns the values of every @batch rule by index among children
+        rules = {j: child for j, child in enumerate(node['children'])
+                 if child.get('batch') is not None}
+        columns = {j: [[] for _ in rule['src']] for j, rule in rules.items()}
+        for src_base in members:
+            src_bases.append(src_base)
+            for j, rule in rules.items():
+                srcrels = rule.get('srcrel') or [None] * len(rule['src'])
+                for column, src, rel in zip(columns[j], rule['src'], srcrels):
+                    column.append(read_foreach_source(src_dom, src, rel, src_bases))
+            src_bases.pop()
+
+        results = {}
+        for j, rule in rules.items():
+            logging.info("Applying %s to %d iterations", rule['name'], len(members))
+            args = [batch_column(column, rule['batch']) for column in columns[j]]
+            if profile is None:
+                output = list(rule['rule'](*args))
+            else:
+                output = list(profile.call(rule, args))
+            if len(output) != len(members):
+                msg = "@batch rule {} returned {} values for {} iterations"
+                raise exceptions.InvalidBatchResult(msg.format(rule['name'],
+                    len(output), len(members)))
+            results[j] = output
+        return results
+
+    # bases of the enclosing iterations are kept on stacks; `anchored`
+    # tells whether a destination base is part of the target DOM
+    def finish_a_tree(src_dom, target_dom, node, src_bases, dst_bases, anchored):
         if node['class'] == 'iteration':
-            for src_base in xml.read_ambiguous_element(src_dom, node['srcbase'], src_bases):
-                dst_base = xml.write_new_ambiguous_element(target_dom,
-                    node['dstbase'], dst_bases, xmlmap)
-                for child in node['children']:
-                    target_dom = finish_a_tree(src_dom, target_dom, child,
-                        src_bases.copy() + [src_base], dst_bases.copy() + [dst_base])
+            srciter, dstiter = node.get('srciter'), node.get('dstiter')
+            if srciter is None:
+                members = xml.read_ambiguous_element(src_dom, node['srcbase'], src_bases)
+            else:
+                members = xml.iter_relative_elements(src_bases[srciter.level], srciter)
+            if profile is not None:
+                profile.count('iterations')
+
+            results = {}
+            if node.get('batched'):
+                members = list(members)
+                if members:
+                    results = apply_batches(src_dom, node, members, src_bases)
+
+            for i, src_base in enumerate(members):
+                if dstiter is not None and anchored[dstiter.level]:
+                    dst_base = xml.new_relative_element(dst_bases[dstiter.level],
+                        dstiter, xmlmap, index)
+                else:
+                    dst_base = xml.write_new_ambiguous_element(target_dom,
+                        node['dstbase'], dst_bases, xmlmap, index=index)
+
+                src_bases.append(src_base)
+                dst_bases.append(dst_base)
+                anchored.append(target_dom is not None)
+                for j, child in enumerate(node['children']):
+                    if j in results:
+                        target_dom = write_foreach_destination(target_dom, child,
+                            results[j][i], dst_bases, anchored)
+                    else:
+                        target_dom = finish_a_tree(src_dom, target_dom, child,
+                            src_bases, dst_bases, anchored)
+                src_bases.pop()
+                dst_bases.pop()
+                anchored.pop()
             return target_dom
+
         elif node['class'] == 'foreach-rule':
-            args = []
-            for src in node['src']:
-                args.append(xml.read_base_source(src_dom, src, bases=src_bases))
-            output = node['rule'](*args)
-            if output is None:
-                return target_dom
-            return xml.write_base_destination(target_dom, node['dst'][0],
-                output, bases=dst_bases, xmlmap=xmlmap)
+            srcrels = node.get('srcrel') or [None] * len(node['src'])
+            args = [read_foreach_source(src_dom, src, rel, src_bases)
+                    for src, rel in zip(node['src'], srcrels)]
+            if profile is None:
+                output = node['rule'](*args)
+            else:
+                output = profile.call(node, args)
+            return write_foreach_destination(target_dom, node, output,
+                dst_bases, anchored)
 
-    for obj in classified:
+    index = xml.TargetIndex()
+    for position, obj in enumerate(classified):
         if obj['class'] == 'basicrule':
             logging.info("Applying %s", obj['name'])
 
-            args = []
-            for src in obj['src']:
-                args.append(xml.read_source(src_dom, src))
+            if sources is None:
+                args = [xml.read_source(src_dom, src) for src in obj['src']]
+                if profile is not None:
+                    profile.count('sources', len(args))
+            else:
+                args = [sources.first(src) for src in obj['src']]
 
-            logging.debug("Applying %s with arguments %s", obj['name'], str(args))
+            logging.debug("Applying %s with arguments %s", obj['name'], args)
 
-            output = obj['rule'](*args)
-            if output is None:
-                continue
-            dst = obj['dst'][0]
-            target_dom = xml.write_destination(target_dom, dst, output, xmlmap=xmlmap)
+            if profile is None:
+                output = obj['rule'](*args)
+            else:
+                output = profile.call(obj, args)
+            if output is not None:
+                if profile is not None:
+                    profile.count('destinations')
+                dst = obj['dst'][0]
+                target_dom = xml.write_destination(target_dom, dst, output,
+                    xmlmap=xmlmap, index=index)
 
         elif obj['class'] in ('iteration', 'foreach-rule'):
-            target_dom = finish_a_tree(src_dom, target_dom, obj, [], [])
+            target_dom = finish_a_tree(src_dom, target_dom, obj, [], [], [])
+
+        if progress is not None and target_dom is not None:
+            progress(position, target_dom)
+            # progress might remove children of the root element
+            index.forget(target_dom)
 
     return target_dom
 
 
+def compile_paths(node):
+    """Recursively replace all @source, @destination and @foreach paths
+    of classified rules by compiled paths.
+
+    :param node:    a list of dictionaries containing rules with metadata
+    :type node:     [dict(), dict(), ...]
+    :return:        the same structure with `paths.CompiledPath` objects
+    :rtype:         [dict(), dict(), ...]
+    """
+    compiled = []
+    for obj in node:
+        obj = dict(obj)
+        for key in ('src', 'dst'):
+            if key in obj:
+                obj[key] = [paths.compile_path(p) for p in obj[key]]
+        for key in ('srcbase', 'dstbase'):
+            if key in obj:
+                obj[key] = paths.compile_path(obj[key])
+        if 'children' in obj:
+            obj['children'] = compile_paths(obj['children'])
+        compiled.append(obj)
+    return compiled
+
+
+def batch_column(values: list, options: dict):
+    """Convert the column of source values of a @batch rule
+    as requested by the options of its decorator.
+
+    :param values:      source values of all iterations
+    :type values:       list
+    :param options:     options of @batch (`dtype` and `numpy`)
+    :type options:      dict
+    :return:            a NumPy array or a list
+    :rtype:             numpy.ndarray | list
+    """
+    dtype = options.get('dtype')
+    if options.get('numpy'):
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            return numpy.asarray(values, dtype=dtype)
+
+    if dtype is not None:
+        return [dtype(value) for value in values]
+    return values
+
+
+def compile_scopes(node: list, srcbases=(), dstbases=()) -> list:
+    """Annotate iterations and foreach rules of compiled classified rules
+    with their paths relative to the bases of enclosing iterations.
+    Paths which cannot be evaluated relative to a base are annotated
+    with None and are traversed from the root element.
+    Furthermore annotate @batch rules and iterations containing them.
+
+    :param node:        a list of dictionaries with compiled paths
+    :type node:         [dict(), dict(), ...]
+    :param srcbases:    source base paths of enclosing iterations
+    :type srcbases:     tuple
+    :param dstbases:    destination base paths of enclosing iterations
+    :type dstbases:     tuple
+    :return:            `node`, modified in place
+    :rtype:             [dict(), dict(), ...]
+    """
+    def members(path, bases):
+        rel = paths.relative_path(path, bases)
+        if rel is None or not rel.steps or rel.attribute is not None:
+            return None
+        return rel
+
+    for obj in node:
+        if obj['class'] == 'iteration':
+            obj['srciter'] = members(obj['srcbase'], srcbases)
+            obj['dstiter'] = members(obj['dstbase'], dstbases)
+            compile_scopes(obj['children'], srcbases + (obj['srcbase'],),
+                dstbases + (obj['dstbase'],))
+            obj['batched'] = any(child.get('batch') is not None
+                                 for child in obj['children'])
+        elif obj['class'] == 'foreach-rule':
+            obj['srcrel'] = [paths.relative_path(p, srcbases) for p in obj['src']]
+            obj['dstrel'] = [paths.relative_path(p, dstbases) for p in obj['dst']]
+            obj['batch'] = getattr(obj['rule'], 'metadata', {}).get('batch')
+    return node
+
+
+def detach_rules(classified: list) -> list:
+    """Return a copy of classified rules, where rule
+    implementations are replaced by rule names.
+
+    :param classified:  a list of dictionaries containing rules with metadata
+    :type classified:   [dict(), dict(), ...]
+    :return:            a list of dictionaries without functions
+    :rtype:             [dict(), dict(), ...]
+    """
+    detached = []
+    for obj in classified:
+        obj = {k: list(v) if isinstance(v, (list, tuple)) else v
+               for k, v in obj.items()}
+        if 'rule' in obj:
+            obj['rule'] = obj['name']
+        if 'children' in obj:
+            obj['children'] = detach_rules(obj['children'])
+        detached.append(obj)
+    return detached
+
+
+def attach_rules(detached: list, rules: dict, indexes=None) -> list:
+    """Inverse of `detach_rules`. Replace rule names by implementations.
+    Rules are wrapped by `prepare_rule`.
+
+    :param detached:    a list of dictionaries without functions
+    :type detached:     [dict(), dict(), ...]
+    :param rules:       rule names associated to their implementation
+    :type rules:        dict(str: function)
+    :param indexes:     names associated to lookup indexes
+    :type indexes:      dict(str: lookups.LookupIndex)
+    :return:            a list of dictionaries containing rules with metadata
+    :rtype:             [dict(), dict(), ...]
+    :raises RuledXmlException: a rule does not exist in `rules`
+    """
+    attached = []
+    for obj in detached:
+        obj = dict(obj)
+        if 'rule' in obj:
+            try:
+                rule = rules[obj['name']]
+            except KeyError:
+                msg = "Rule {} does not exist"
+                raise exceptions.RuledXmlException(msg.format(obj['name']))
+            obj['rule'] = prepare_rule(obj['name'], rule, indexes)
+        if 'children' in obj:
+            obj['children'] = attach_rules(obj['children'], rules, indexes)
+        attached.append(obj)
+    return attached
+
+
+def flush_points(classified: list) -> tuple:
+    """Determine when top-level elements of a target DOM are complete.
+
+    For every top-level element of `classified`, return the set of tags of
+    top-level target elements, which are not modified by any subsequent
+    rule. None is returned while the root element itself might still be
+    modified. If top-level elements cannot be determined reliably,
+    every entry is None.
+
+    :param classified:  classified rules with compiled paths
+    :type classified:   [dict(), dict(), ...]
+    :return:            a set of tags or None for every element of `classified`
+    :rtype:             tuple
+    """
+    def destinations(obj):
+        if 'dstbase' in obj:
+            yield obj['dstbase']
+        for dst in obj.get('dst', []):
+            yield dst
+        for child in obj.get('children', []):
+            yield from destinations(child)
+
+    root_names = set()
+    root_last = -1
+    last = {}
+    for index, obj in enumerate(classified):
+        for dst in destinations(obj):
+            if not dst.absolute or not all(step.simple for step in dst.steps):
+                return (None,) * len(classified)
+            root_names.add(dst.steps[0].name)
+            if len(dst.steps) < 2:
+                root_last = index
+            else:
+                last[dst.steps[1].name] = index
+
+    if len(root_names) > 1:
+        return (None,) * len(classified)
+
+    points = []
+    for index in range(len(classified)):
+        if index < root_last:
+            points.append(None)
+        else:
+            points.append(frozenset(n for n, i in last.items() if i <= index))
+    return tuple(points)
+
+
+def walk(classified):
+    """Yield all rules and iterations of `classified` recursively.
+
+    :param classified:  a list of dictionaries containing rules with metadata
+    :type classified:   [dict(), dict(), ...]
+    :return:            a generator of dictionaries
+    :rtype:             generator
+    """
+    for obj in classified:
+        yield obj
+        yield from walk(obj.get('children', ()))
+
+
+def source_paths(order: list, meta: dict) -> list:
+    """Return all paths of the source document rules refer to: @source
+    and @foreach paths as well as `input_required` and `input_nonempty`.
+
+    :param order:   classified rules with rule names (see `detach_rules`)
+    :type order:    list
+    :param meta:    metadata as returned by `read_rulesfile`
+    :type meta:     dict
+    :return:        the paths
+    :rtype:         list
+    """
+    sources = list(meta['input_required']) + list(meta['input_nonempty'])
+    for obj in walk(order):
+        sources.extend(obj.get('src', ()))
+        if 'srcbase' in obj:
+            sources.append(obj['srcbase'])
+    return sources
+
+
+def check_relative_sources(plan: 'RulePlan', reason: str):
+    """Validate that all source paths of `plan` only select descendants
+    of the base element (see `paths.base_relative`).
+
+    :param plan:                    the compiled rules
+    :type plan:                     RulePlan
+    :param reason:                  why the base element is taken out of
+                                    its document (for the error message)
+    :type reason:                   str
+    :raises InvalidPathException:   some path is absolute or might select
+                                    elements outside the base element
+    """
+    order, meta = plan.order, plan.meta
+    checks = [(key, src) for key in ('input_required', 'input_nonempty')
+              for src in meta[key]]
+    for obj in walk(order):
+        checks.extend((obj['name'], src) for src in obj.get('src', ()))
+        if 'srcbase' in obj:
+            checks.append(('@foreach', obj['srcbase']))
+
+    for name, src in checks:
+        if not paths.base_relative(src):
+            msg = ("{} reads {}, but only paths relative to the base element "
+                   "are supported {}")
+            raise exceptions.InvalidPathException(msg.format(name, src, reason))
+
+
+def parser_options(order: list, meta: dict) -> dict:
+    """Determine parser options for source documents of rules.
+    Comments and processing instructions are only kept if some
+    source path might select them. Whitespace-only text nodes are
+    only removed if the rules file sets ``input_remove_blank_text``.
+
+    :param order:   classified rules with rule names (see `detach_rules`)
+    :type order:    list
+    :param meta:    metadata as returned by `read_rulesfile`
+    :type meta:     dict
+    :return:        options of `xml.parser`
+    :rtype:         dict
+    """
+    sources = source_paths(order, meta)
+    return {
+        'remove_blank_text': bool(meta.get('input_remove_blank_text', False)),
+        'remove_comments': not any('comment()' in src or 'node()' in src for src in sources),
+        'remove_pis': not any('processing-instruction(' in src or 'node()' in src
+                              for src in sources)
+    }
+
+
+def freeze(node):
+    """Recursively turn lists into tuples and dictionaries into read-only
+    mappings. Functions and other values are returned as they are.
+
+    :param node:    a (potentially nested) structure of lists and dicts
+    :return:        the immutable equivalent of `node`
+    """
+    if isinstance(node, (list, tuple)):
+        return tuple(freeze(v) for v in node)
+    elif isinstance(node, (set, frozenset)):
+        return frozenset(node)
+    elif isinstance(node, dict):
+        return types.MappingProxyType({k: freeze(v) for k, v in node.items()})
+    return node
+
+
+class RulePlan:
+    """A set of rules compiled for repeated application.
+
+    Validation, classification and ordering of rules happens exactly once,
+    when the plan is created. Afterwards the plan is immutable and can be
+    applied to an arbitrary number of DOMs. Use `timing` to retrieve how
+    much time was spent compiling and applying the plan. Lookup documents
+    are indexed when the plan is created.
+    """
+    __slots__ = ('_rules', '_meta', '_order', '_classified', '_checks',
+                 '_sources', '_flushes', '_stats', '_memo', '_lookups', '_digest',
+                 '_parser', '_reachable', '_lock', '__weakref__')
+
+    def __init__(self, rules: dict, meta=None, *, order=None, digest=None):
+        """Compile `rules`.
+
+        `order` is the value of `order` of a plan compiled previously from
+        the same rules. If given, validation and classification is skipped.
+
+        :param rules:               rule names associated to their implementation
+        :type rules:                dict(str: function)
+        :param meta:                metadata as returned by `read_rulesfile`
+        :type meta:                 dict
+        :param order:               classified rules of a previous compilation
+        :type order:                list
+        :param digest:              SHA-256 hex digest of the rules file
+        :type digest:               str
+        :raises RuledXmlException:  some rule is invalid
+        """
+        start = time.perf_counter()
+        self._digest = digest
+
+        metadata = default_metadata()
+        metadata.update(meta or {})
+        metadata['lookup_documents'] = lookups.declarations(metadata['lookup_documents'])
+        self._lookups = types.MappingProxyType(lookups.load(metadata['lookup_documents']))
+
+        if order is None:
+            validate_rules(rules)
+            classified = reorder_rules(classify_rules(rules, self._lookups))
+        else:
+            classified = attach_rules(order, rules, self._lookups)
+
+        self._order = detach_rules(classified)
+        self._rules = types.MappingProxyType(dict(rules))
+        self._meta = freeze(metadata)
+        self._classified = freeze(compile_scopes(compile_paths(classified)))
+        self._flushes = flush_points(self._classified)
+        self._checks = freeze({
+            key: [paths.compile_path(p) for p in sorted(metadata[key])]
+            for key in ('input_required', 'input_nonempty',
+                        'output_required', 'output_nonempty')
+        })
+        self._sources = paths.PathTrie(
+            [src for obj in self._classified if obj['class'] == 'basicrule'
+                 for src in obj['src']] +
+            list(self._checks['input_required']) +
+            list(self._checks['input_nonempty']))
+        self._memo = {obj['name']: obj['rule'] for obj in walk(self._classified)
+                      if isinstance(obj.get('rule'), memo.Memoized)}
+        self._parser = freeze(parser_options(self._order, metadata))
+        self._reachable = freeze(paths.reachable(source_paths(self._order, metadata)))
+        self._stats = {
+            'compile_time': time.perf_counter() - start,
+            'applications': 0,
+            'apply_time': 0.0
+        }
+        # plans are applied by several threads of the daemon concurrently
+        self._lock = threading.Lock()
+
+    @property
+    def rules(self):
+        """Rule names associated to their implementation"""
+        return self._rules
+
+    @property
+    def meta(self):
+        """Metadata such as required attributes, xml namespaces and encoding"""
+        return self._meta
+
+    @property
+    def lookups(self):
+        """Names of lookup documents associated to their `lookups.LookupIndex`"""
+        return self._lookups
+
+    @property
+    def digest(self):
+        """SHA-256 hex digest of the rules file the plan was compiled from
+        or None, if unknown (eg. rules were not read from a file)
+        """
+        return self._digest
+
+    @property
+    def parser_options(self):
+        """Options to parse source documents with (see `xml.parser`)"""
+        return self._parser
+
+    @property
+    def reachable(self):
+        """Prefix tree of the source elements rules can reach (see
+        `paths.reachable`) or None, if any element might be reached.
+        Other elements need not be kept when parsing source documents.
+        """
+        return self._reachable
+
+    @property
+    def order(self):
+        """Classified and ordered rules with rule names instead of
+        implementations. This is a structure of lists, dicts and
+        strings, which can be serialized.
+        """
+        return copy.deepcopy(self._order)
+
+    @property
+    def classified(self):
+        """Classified and ordered rules as consumed by `run_rules`"""
+        return self._classified
+
+    @property
+    def resolved_paths(self):
+        """Compiled paths `resolve` evaluates: the sources of all basic
+        rules as well as `input_required` and `input_nonempty` paths
+        """
+        return tuple(self._sources.paths)
+
+    def resolve(self, dom: lxml.etree.Element, *, profile=None) -> paths.Resolution:
+        """Resolve the sources of all basic rules as well as
+        `input_required` and `input_nonempty` paths in one walk of `dom`.
+        Pass the result to `check_input` and `apply` to share it.
+
+        :param dom:         the root element of a source DOM
+        :type dom:          lxml.etree.Element
+        :param profile:     profile to count the evaluated paths in
+        :type profile:      profiling.Profile
+        :return:            the resolved paths
+        :rtype:             paths.Resolution
+        """
+        if profile is not None:
+            profile.count('sources', len(self._sources.paths))
+        return self._sources.resolve(dom)
+
+    def check_input(self, dom: lxml.etree.Element, *, filepath='', resolved=None):
+        """Validate `input_required` and `input_nonempty` against `dom`.
+
+        :param dom:                   the root element of a source DOM
+        :type dom:                    lxml.etree.Element
+        :param filepath:              filepath (additional info for error message)
+        :type filepath:               str
+        :param resolved:              result of `resolve` for `dom`
+        :type resolved:               paths.Resolution
+        :raises InvalidPathException: some required path does not exist / is empty
+        """
+        if resolved is None:
+            resolved = self.resolve(dom)
+        required_exists(dom, self._checks['input_nonempty'],
+            self._checks['input_required'], filepath=filepath, resolved=resolved)
+
+    def check_output(self, dom: lxml.etree.Element, *, filepath=''):
+        """Validate `output_required` and `output_nonempty` against `dom`.
+
+        :param dom:                   the root element of a target DOM
+        :type dom:                    lxml.etree.Element
+        :param filepath:              filepath (additional info for error message)
+        :type filepath:               str
+        :raises InvalidPathException: some required path does not exist / is empty
+        """
+        required_exists(dom, self._checks['output_nonempty'],
+            self._checks['output_required'], filepath=filepath)
+
+    def apply(self, dom: lxml.etree.Element, *, writer=None,
+        resolved=None, profile=None) -> lxml.etree.Element:
+        """Apply the compiled rules to the given DOM.
+
+        If an `xml.IncrementalWriter` is given, top-level subtrees of the
+        target DOM are written and removed as soon as no subsequent rule
+        modifies them. Call ``writer.close`` with the returned DOM to
+        write the remainder.
+
+        :param dom:         the root element of a source DOM
+        :type dom:          lxml.etree.Element
+        :param writer:      writer to flush completed subtrees to
+        :type writer:       xml.IncrementalWriter
+        :param resolved:    result of `resolve` for `dom`
+        :type resolved:     paths.Resolution
+        :param profile:     profile to record measurements in
+        :type profile:      profiling.Profile
+        :return:            root element of a new DOM
+        :rtype:             lxml.etree.Element
+        """
+        def flush(index, target_dom):
+            names = self._flushes[index]
+            if names:
+                writer.flush(target_dom, names)
+
+        start = time.perf_counter()
+        if resolved is None:
+            with profiling.timed(profile, 'resolve'):
+                resolved = self.resolve(dom, profile=profile)
+        with profiling.timed(profile, 'apply'):
+            target_dom = run_rules(dom, None, self._classified,
+                self._meta['output_xml_namespaces'],
+                progress=None if writer is None else flush, sources=resolved,
+                profile=profile)
+        with self._lock:
+            self._stats['applications'] += 1
+            self._stats['apply_time'] += time.perf_counter() - start
+        return target_dom
+
+    def timing(self) -> dict:
+        """Return timing information about this plan.
+
+        `compile_time` is the time spent for validation, classification and
+        ordering (in seconds). `applications` counts calls to `apply` and
+        `apply_time` is the cumulative time spent in them.
+
+        :return:        timing information
+        :rtype:         dict
+        """
+        with self._lock:
+            timing = dict(self._stats)
+        if timing['applications']:
+            timing['apply_time_avg'] = timing['apply_time'] / timing['applications']
+        else:
+            timing['apply_time_avg'] = 0.0
+        return timing
+
+    def memoization(self) -> dict:
+        """Return hit, miss and eviction counts of every @memoize rule.
+        Caches persist across all applications of this plan.
+
+        :return:        rule names associated to `memo.Memoized.stats`
+        :rtype:         dict
+        """
+        return {name: rule.stats() for name, rule in self._memo.items()}
+
+    def merge_memoization(self, stats: dict):
+        """Add counters of @memoize rules applied elsewhere
+        (eg. in worker processes) to the counters of this plan.
+
+        :param stats:   rule names associated to `memo.Memoized.stats`
+        :type stats:    dict
+        """
+        for name, values in stats.items():
+            if name in self._memo:
+                self._memo[name].merge(values)
+
+
+def compile_rules(rules: dict, meta=None, *, digest=None) -> RulePlan:
+    """Compile `rules` into a reusable `RulePlan`.
+
+    :param rules:               rule names associated to their implementation
+    :type rules:                dict(str: function)
+    :param meta:                metadata as returned by `read_rulesfile`
+    :type meta:                 dict
+    :param digest:              SHA-256 hex digest of the rules file
+    :type digest:               str
+    :return:                    the compiled plan
+    :rtype:                     RulePlan
+    :raises RuledXmlException:  some rule is invalid
+    """
+    return RulePlan(rules, meta, digest=digest)
+
+
+def load_plan(rules_filepath: str, *, cache=None) -> RulePlan:
+    """Read a rules file and compile it into a `RulePlan`.
+    If a `cache.RulesCache` is given, compilation results are
+    retrieved from respectively stored in the cache.
+
+    :param rules_filepath:      Filepath to a rulesfile
+    :type rules_filepath:       str
+    :param cache:               cache of compiled rules files
+    :type cache:                cache.RulesCache
+    :return:                    the compiled plan
+    :rtype:                     RulePlan
+    :raises RuledXmlException:  rules file or some rule is invalid
+    """
+    if cache is not None:
+        return cache.load(rules_filepath)
+
+    unique_function(rules_filepath)
+    rules, meta = read_rulesfile(rules_filepath)
+    with open(rules_filepath, 'rb') as fp:
+        digest = hashlib.sha256(fp.read()).hexdigest()
+    plan = compile_rules(rules, meta, digest=digest)
+    logging.info('Compiled %d rules of %s in %.6f seconds', len(rules),
+        rules_filepath, plan.timing()['compile_time'])
+    return plan
+
+
+def as_plan(rules, *, cache=None) -> RulePlan:
+    """Return `rules` if it is a `RulePlan`. Otherwise consider `rules`
+    a filepath to a rules file and load it.
+
+    :param rules:       a compiled plan or a filepath to a rulesfile
+    :type rules:        RulePlan | str
+    :param cache:       cache of compiled rules files
+    :type cache:        cache.RulesCache
+    :return:            the compiled plan
+    :rtype:             RulePlan
+    """
+    if isinstance(rules, RulePlan):
+        return rules
+    return load_plan(rules, cache=cache)
+
+
 def apply_rules(dom: lxml.etree.Element, rules: dict, *, xmlmap=None):
     """Apply given rules to the given DOM.
 
+    If rules are applied to several DOMs, use `compile_rules`
+    once and `RulePlan.apply` for every DOM instead.
+
     :param dom:                 the root element of a DOM
     :type dom:                  lxml.etree.Element
     :param rules:               rule names associated to their implementation
@@ -477,94 +1270,299 @@ def apply_rules(dom: lxml.etree.Element, rules: dict, *, xmlmap=None):
     :rtype:                     lxml.etree.Element
     :raises RuledXmlException:  some rule is invalid
     """
-    validate_rules(rules)
-    classified = classify_rules(rules)
-    ordered = reorder_rules(classified)
-    return run_rules(dom, None, ordered, xmlmap)
+    plan = compile_rules(rules, {'output_xml_namespaces': xmlmap or {}})
+    return plan.apply(dom)
 
 
-def run(in_fd, rules_filepath: str, out_fd, *, infile='', outfile='') -> int:
+def run(in_fd, rules_filepath, out_fd, *, infile='', outfile='',
+    incremental=False, prune=False, profile=None, results=None) -> int:
     """Process one file.
 
+    If `incremental` is set, the target DOM is written subtree by subtree
+    and completed subtrees are written while rules are still applied.
+    If `prune` is set, only source elements rules can reach (see
+    `RulePlan.reachable`) are kept while parsing the input. This saves
+    memory, if rules read a small part of large documents.
+    If a `profiling.Profile` is given, the wall time of every phase
+    and rule is recorded there. If a `cache.ResultCache` is given and it
+    contains the output for the same input and rules, the output is copied
+    from the cache instead of applying rules. Otherwise the output is stored
+    in the cache (`incremental` does not apply then).
+
     :param in_fd:           File descriptor to one input XML file
     :type in_fd:            _io.TextIOWrapper
-    :param rules_filepath:  Filepath to a rulesfile
-    :type rules_filepath:   str
+    :param rules_filepath:  Filepath to a rulesfile or a compiled RulePlan
+    :type rules_filepath:   str | RulePlan
     :param out_fd:          File descriptor to an output XML file
     :type out_fd:           _io.TextIOWrapper
     :param infile:          original XML input file path for debugging purposes
     :type infile:           str
     :param outfile:         output XML file path for debugging purposes
     :type outfile:          str
+    :param incremental:     write the target XML incrementally
+    :type incremental:      bool
+    :param prune:           parse only elements rules can reach
+    :type prune:            bool
+    :param profile:         profile to record measurements in
+    :type profile:          profiling.Profile
+    :param results:         cache of output documents
+    :type results:          cache.ResultCache
     :return:                exit code 0
     :rtype:                 int
     """
     # read rules file
-    unique_function(rules_filepath)
-    rules, meta = read_rulesfile(rules_filepath)
+    loading = not isinstance(rules_filepath, RulePlan)
+    with profiling.timed(profile if loading else None, 'load'):
+        plan = as_plan(rules_filepath)
+
+    if results is not None:
+        with profiling.timed(profile, 'result_cache'):
+            source = in_fd.read()
+            if isinstance(source, str):
+                source = source.encode('utf-8')
+            key = results.key(source, plan)
+            if results.get(key, out_fd):
+                return 0
+
+        output = io.BytesIO()
+        exitcode = run(io.BytesIO(source), plan, output, infile=infile,
+            outfile=outfile, prune=prune, profile=profile)
+        out_fd.write(output.getvalue())
+        results.put(key, output.getvalue())
+        return exitcode
 
     # retrieve source xmlfile
-    src_dom = xml.read(in_fd)
+    with profiling.timed(profile, 'read'):
+        reachable = plan.reachable if prune else None
+        src_dom = xml.read(in_fd, reachable=reachable, **plan.parser_options)
 
     # test: required elements exist?
-    required_exists(src_dom, meta['input_nonempty'], meta['input_required'], filepath=infile)
+    with profiling.timed(profile, 'resolve'):
+        resolved = plan.resolve(src_dom, profile=profile)
+    with profiling.timed(profile, 'check_input'):
+        plan.check_input(src_dom, filepath=infile, resolved=resolved)
+
+    # apply rules and write target XML to file
+    if incremental:
+        writer = xml.IncrementalWriter(out_fd, encoding=plan.meta['output_encoding'])
+        target_dom = plan.apply(src_dom, writer=writer, resolved=resolved, profile=profile)
+        with profiling.timed(profile, 'write'):
+            writer.close(target_dom)
+    else:
+        target_dom = plan.apply(src_dom, resolved=resolved, profile=profile)
+        with profiling.timed(profile, 'write'):
+            xml.write(target_dom, out_fd, encoding=plan.meta['output_encoding'])
+
+    return 0
+
+
+def transform(plan: RulePlan, src_dom: lxml.etree.Element,
+    resolved: paths.Resolution, *, infile='') -> tuple:
+    """Apply `plan` to a source DOM (without modifying it) and serialize
+    the target DOM. Failures are returned instead of raised.
+
+    :param plan:        the compiled rules
+    :type plan:         RulePlan
+    :param src_dom:     the root element of the source DOM
+    :type src_dom:      lxml.etree.Element
+    :param resolved:    paths resolved in `src_dom`; must contain
+                        the paths resolved by `plan.resolve`
+    :type resolved:     paths.Resolution
+    :param infile:      original XML input file path for debugging purposes
+    :type infile:       str
+    :return:            the serialized target XML and an empty string,
+                        or None and the traceback of a failure
+    :rtype:             tuple(bytes, str)
+    """
+    try:
+        plan.check_input(src_dom, filepath=infile, resolved=resolved)
+        target_dom = plan.apply(src_dom, resolved=resolved)
+        output = io.BytesIO()
+        xml.write(target_dom, output, encoding=plan.meta['output_encoding'])
+        return output.getvalue(), ''
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_many(in_fd, targets, *, infile='', prune=False, processes=None) -> list:
+    """Process one file with several rules files.
+
+    The input is parsed once (keeping comments, processing instructions
+    or, if `prune` is set, elements if any of the rules need them). The
+    source paths of all rules are resolved in one walk of the DOM, which
+    is then shared read-only by all rules. If `processes` is greater
+    than 1, rules are applied in worker processes forked after parsing.
+    They share the DOM copy-on-write and send back the serialized outputs.
+
+    Failing rules (eg. if a required element is missing) are logged
+    and do not affect other targets.
+
+    :param in_fd:           File descriptor to one input XML file
+    :type in_fd:            _io.TextIOWrapper
+    :param targets:         tuples of a filepath to a rulesfile (or a compiled
+                            RulePlan) and a file descriptor to an output XML file
+    :type targets:          list
+    :param infile:          original XML input file path for debugging purposes
+    :type infile:           str
+    :param prune:           parse only elements some rules can reach
+    :type prune:            bool
+    :param processes:       number of worker processes; rules are applied
+                            in this process if not greater than 1
+    :type processes:        int
+    :return:                an exit code for every target (0 or 1)
+    :rtype:                 list
+    :raises RuledXmlException: the input cannot be parsed
+    """
+    plans = [as_plan(rules) for rules, _ in targets]
+    if not plans:
+        return []
+
+    options = {key: all(plan.parser_options[key] for plan in plans)
+               for key in plans[0].parser_options}
+    reachable = None
+    if prune:
+        reachable = paths.reachable([src for plan in plans
+                                     for src in source_paths(plan.order, plan.meta)])
+    src_dom = xml.read(in_fd, reachable=reachable, **options)
+    resolved = paths.PathTrie([path for plan in plans
+                               for path in plan.resolved_paths]).resolve(src_dom)
+
+    if processes is not None and processes > 1 and len(plans) > 1:
+        from . import parallel
+        outputs = parallel.transform_shared(src_dom, resolved, plans, processes,
+                                            infile=infile)
+    else:
+        outputs = [transform(plan, src_dom, resolved, infile=infile) for plan in plans]
+
+    exitcodes = []
+    for index, ((rules, out_fd), (output, error)) in enumerate(zip(targets, outputs)):
+        if error:
+            name = rules if isinstance(rules, str) else 'rules #{}'.format(index)
+            logging.error('Applying %s to %s failed:\n%s', name, infile or 'input', error)
+            exitcodes.append(1)
+        else:
+            out_fd.write(output)
+            exitcodes.append(0)
+    return exitcodes
+
+
+def batch_element(plan: RulePlan, element: lxml.etree.Element,
+    out_filepath: str, *, infile='', incremental=False, profile=None):
+    """Apply `plan` to one base element and write the result to `out_filepath`.
+
+    :param plan:            the compiled rules
+    :type plan:             RulePlan
+    :param element:         the base element to apply rules to
+    :type element:          lxml.etree.Element
+    :param out_filepath:    filepath of the output XML file
+    :type out_filepath:     str
+    :param infile:          original XML input file path for debugging purposes
+    :type infile:           str
+    :param incremental:     write the target XML file incrementally
+    :type incremental:      bool
+    :param profile:         profile to record measurements in
+    :type profile:          profiling.Profile
+    """
+    # test: required elements exist?
+    with profiling.timed(profile, 'resolve'):
+        resolved = plan.resolve(element, profile=profile)
+    with profiling.timed(profile, 'check_input'):
+        plan.check_input(element, filepath=infile, resolved=resolved)
 
     # apply rules
-    target_dom = apply_rules(src_dom, rules, xmlmap=meta['output_xml_namespaces'])
+    target_dom = plan.apply(element, resolved=resolved, profile=profile)
 
-    # write target XML to file
-    xml.write(target_dom, out_fd, encoding=meta['output_encoding'])
+    # test: required elements exist?
+    with profiling.timed(profile, 'check_output'):
+        plan.check_output(target_dom)
 
-    return 0
+    # write target XML to file
+    with profiling.timed(profile, 'write'):
+        fs.create_base_directories(out_filepath)
+        with open(out_filepath, 'wb') as out_fd:
+            xml.write(target_dom, out_fd, encoding=plan.meta['output_encoding'],
+                incremental=incremental)
 
 
-def batch_run(in_fd, rules_filepath: str, out_filepaths: list([str]),
-    base: str, *, infile='') -> int:
+def batch_run(in_fd, rules_filepath, out_filepaths: list([str]),
+    base: str, *, infile='', stream=False, incremental=False,
+    processes=None, profile=None) -> int:
     """Process one file. Apply rules for some base path.
     Create several target DOMs.
 
+    If `stream` is set, the source file is parsed incrementally and
+    every base element is discarded once its output file is written.
+    Then `base` must be an absolute path of element names and rules
+    must only read paths relative to the base element.
+    If `incremental` is set, target DOMs are written subtree by subtree.
+
+    If `processes` is greater than 1, base elements are serialized and
+    distributed in chunks to this number of worker processes. Workers
+    rebuild every base element below empty copies of its ancestors, hence
+    rules must only read paths relative to the base element as well. The i-th
+    base element is always written to the i-th output filepath.
+
+    If a `profiling.Profile` is given, the wall time of every phase and
+    rule is recorded there (also of worker processes). If `stream` is set,
+    parsing is interleaved with processing and not measured as `read`.
+
     :param in_fd:           File descriptor to one input XML file
     :type in_fd:            _io.TextIOWrapper
-    :param rules_filepath:  Filepath to a rulesfile
-    :type rules_filepath:   str
+    :param rules_filepath:  Filepath to a rulesfile or a compiled RulePlan
+    :type rules_filepath:   str | RulePlan
     :param out_filepaths:   File descriptor to an output XML file
     :type out_filepaths:    _io.TextIOWrapper
     :param base:            A base XPath, all rules are applied relative to this path
     :type base:             str
     :param infile:          original XML input file path for debugging purposes
     :type infile:           str
+    :param stream:          parse the source file incrementally
+    :type stream:           bool
+    :param incremental:     write the target XML files incrementally
+    :type incremental:      bool
+    :param processes:       number of worker processes
+    :type processes:        int
+    :param profile:         profile to record measurements in
+    :type profile:          profiling.Profile
     :return:                exit code 0
     :rtype:                 int
+    :raises InvalidPathException: a rule reads a path outside the base
+                                  element, but `stream` is set or
+                                  `processes` is greater than 1
     """
     # read rules file
-    unique_function(rules_filepath)
-    rules, meta = read_rulesfile(rules_filepath)
+    loading = not isinstance(rules_filepath, RulePlan)
+    with profiling.timed(profile if loading else None, 'load'):
+        plan = as_plan(rules_filepath)
+    if stream:
+        check_relative_sources(plan, 'when streaming')
+    elif processes is not None and processes > 1:
+        check_relative_sources(plan, 'in worker processes')
 
     # retrieve source xmlfile
-    src_dom = xml.read(in_fd)
-
-    count = 0
-    for element in src_dom.xpath(base):
-        # test: required elements exist?
-        required_exists(element, meta['input_nonempty'],
-            meta['input_required'], filepath=infile)
-
-        # apply rules
-        target_dom = apply_rules(element, rules,
-            xmlmap=meta['output_xml_namespaces'])
-
-        # test: required elements exist?
-        required_exists(target_dom, meta['output_nonempty'], meta['output_required'])
-
-        # write target XML to file
-        fs.create_base_directories(out_filepaths[count])
-        with open(out_filepaths[count], 'wb') as out_fd:
-            xml.write(target_dom, out_fd, encoding=meta['output_encoding'])
-
-        count += 1
+    with profiling.timed(profile, 'read'):
+        if stream:
+            elements = xml.iterelements(in_fd, base, **plan.parser_options)
+        else:
+            elements = xml.read(in_fd, **plan.parser_options).xpath(base)
+
+    if processes is not None and processes > 1:
+        from . import parallel
+        count = parallel.batch_elements(plan, elements, out_filepaths,
+            processes, infile=infile, incremental=incremental, profile=profile)
+    else:
+        count = 0
+        for element in elements:
+            batch_element(plan, element, out_filepaths[count],
+                infile=infile, incremental=incremental, profile=profile)
+            count += 1
 
     if count < len(out_filepaths):
         msg = "Number of output filepaths was {}; expected {}"
         logging.warn(msg.format(count, len(out_filepaths)))
 
+    logging.info('Applied rules %d times; %s', count, str(plan.timing()))
+    for line in memo.report(plan.memoization()):
+        logging.info('Memoized %s', line)
+
     return 0
@@ -44,6 +44,20 @@ def source(*vals):
     return annotate_function("src", list(vals), lambda v: v.extend(vals) or v)
 
 
+def lookup(name, path):
+    """Decorator: Declare a source value which is looked up in the
+    lookup document `name` (see `lookup_documents` of a rules file).
+    The value at `path` is the key; the rule receives the element
+    or value indexed for this key.
+    """
+    def decorator(func):
+        position = len(getattr(func, 'metadata', {}).get('src', []))
+        func = source(path)(func)
+        names = {position: name}
+        return annotate_function("lookup", names, lambda v: v.update(names) or v)(func)
+    return decorator
+
+
 def destination(*vals, order=None):
     """Decorator: Declare the destination values that data will be written to"""
     data = {'dests': vals, 'order': order}
@@ -66,3 +80,39 @@ def foreach(*vals):
       * written to the corresponding destination Y
     """
     return annotate_function("each", [tuple(vals)], lambda v: v.extend([vals]) or v)
+
+
+def batch(func=None, *, dtype=None, numpy=True):
+    """Decorator: Apply a @foreach rule once to all iterations of its
+    innermost @foreach instead of once per iteration.
+
+    For every @source, the rule receives the column of values of all
+    iterations. If `numpy` is set and NumPy is available, columns are
+    NumPy arrays, otherwise lists. If `dtype` is given, values are
+    converted to it. The rule must return a sequence with one value
+    per iteration; value i is written to the destination of iteration i.
+    A value None is not written.
+
+    Use as ``@batch`` or with arguments, eg. ``@batch(dtype=float)``.
+    """
+    options = {'dtype': dtype, 'numpy': numpy}
+    decorator = annotate_function("batch", options, lambda v: v)
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def memoize(func=None, *, maxsize=128):
+    """Decorator: Cache return values of a pure rule by its arguments.
+
+    Results are cached per compiled rules file and reused for all
+    documents processed with it. At most `maxsize` results are kept
+    (unbounded if None); the least recently used result is evicted first.
+
+    Use as ``@memoize`` or with arguments, eg. ``@memoize(maxsize=1024)``.
+    """
+    options = {'maxsize': maxsize}
+    decorator = annotate_function("memoize", options, lambda v: v)
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -15,9 +15,11 @@
     │  ├─── MissingRuleDestination
     │  ├─── InvalidRuleDestination
     │  └─── TooManyRuleDestinations
-    └──┬ RuleForeachException [TypeError]
-       ├─── MissingRuleForeach
-       └─── InvalidRuleForeach
+    ├──┬ RuleForeachException [TypeError]
+    │  ├─── MissingRuleForeach
+    │  └─── InvalidRuleForeach
+    ├─── InvalidRuleMemoize [TypeError]
+    └─── InvalidBatchResult [ValueError]
 
     (C) 2015, meisterluk, BSD 3-clause license
 """
@@ -77,4 +79,14 @@ class InvalidRuleForeach(RuleForeachException):
 
 
 class TooManyRuleDestinations(RuleDestinationException):
-    """The rule has too many @destination decorators applied"""
\ No newline at end of file
+    """The rule has too many @destination decorators applied"""
+
+
+class InvalidRuleMemoize(RuledXmlException, TypeError):
+    """The rule's @memoize decorator has invalid arguments
+    or is combined with @batch.
+    """
+
+
+class InvalidBatchResult(RuledXmlException, ValueError):
+    """A @batch rule did not return one value per iteration"""
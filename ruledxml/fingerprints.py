@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.fingerprints
+    ---------------------
+
+    Incremental re-evaluation of rules after some rules changed.
+
+    Every rule has a fingerprint, a hash of its decorator metadata and
+    its bytecode including constants, default arguments, closures and
+    global values it refers to (eg. helper functions or tables). Whenever
+    `Updater` writes an output file, it stores a manifest next to it
+    (``<output>.ruledxml``). The manifest contains the fingerprint of every
+    rule and, for basic rules, a hash of the source values passed to them.
+
+    When the same output file is updated again, the file is
+
+    * skipped entirely, if neither the input nor any rule changed.
+    * patched, if only basic rules changed or received different source
+      values. Only those rules are applied and their destinations are
+      overwritten in the existing output DOM.
+    * written again by applying all rules otherwise. This is the case if
+      rule names, destinations, @foreach paths or the metadata of the rules
+      file changed, a rule within a @foreach changed, the input of rules
+      with @foreach changed, the output was modified elsewhere or a
+      patched destination is shared, namespaced or does not exist yet.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import io
+import json
+import types
+import hashlib
+import logging
+import collections
+
+from . import fs
+from . import xml
+from . import core
+from . import paths
+
+
+MANIFEST_SUFFIX = '.ruledxml'
+OUTCOMES = ('skipped', 'patched', 'applied')
+
+
+def normalize(obj):
+    """Turn mappings, sets and sequences (recursively) into JSON
+    serializable values with a deterministic order.
+    Other values are represented by their `repr`.
+    """
+    if isinstance(obj, (str, int, float, bool, type(None))):
+        return obj
+    elif isinstance(obj, (dict, types.MappingProxyType)):
+        return {str(k): normalize(v) for k, v in obj.items()}
+    elif isinstance(obj, (set, frozenset)):
+        return sorted((normalize(v) for v in obj), key=repr)
+    elif isinstance(obj, (list, tuple)):
+        return [normalize(v) for v in obj]
+    return repr(obj)
+
+
+def canonical(obj) -> bytes:
+    """Deterministic serialization of `obj` (see `normalize`)"""
+    return json.dumps(normalize(obj), sort_keys=True).encode('utf-8')
+
+
+def feed(hashed, value, seen: set):
+    """Feed `value` into `hashed`. Functions are represented by their
+    bytecode, defaults, closures and the global values they refer to.
+
+    :param hashed:  a hash object
+    :type hashed:   hashlib._Hash
+    :param value:   the value to hash
+    :param seen:    ids of functions hashed before (to break recursion)
+    :type seen:     set
+    """
+    if isinstance(value, types.FunctionType):
+        if id(value) in seen:
+            hashed.update(b'<recursion>')
+            return
+        seen.add(id(value))
+        feed_code(hashed, value.__code__, value.__globals__, seen)
+        feed(hashed, value.__defaults__, seen)
+        feed(hashed, sorted((value.__kwdefaults__ or {}).items()), seen)
+        for cell in value.__closure__ or ():
+            try:
+                feed(hashed, cell.cell_contents, seen)
+            except ValueError:
+                hashed.update(b'<empty cell>')
+    elif isinstance(value, (str, bytes, int, float, complex, bool, type(None))):
+        hashed.update(repr(value).encode('utf-8'))
+    elif isinstance(value, (tuple, list, set, frozenset)):
+        hashed.update(type(value).__name__.encode('ascii'))
+        items = sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value
+        for item in items:
+            feed(hashed, item, seen)
+    elif isinstance(value, dict):
+        hashed.update(b'dict')
+        for key in sorted(value, key=repr):
+            feed(hashed, key, seen)
+            feed(hashed, value[key], seen)
+    elif isinstance(value, types.ModuleType):
+        hashed.update(value.__name__.encode('utf-8'))
+    else:
+        # classes, builtins and other objects by name only
+        name = getattr(value, '__qualname__', type(value).__qualname__)
+        hashed.update(name.encode('utf-8'))
+
+
+def feed_code(hashed, code: types.CodeType, namespace: dict, seen: set):
+    """Feed bytecode `code` and the values of global names it refers
+    to in `namespace` into `hashed`.
+    """
+    hashed.update(code.co_code)
+    hashed.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            feed_code(hashed, const, namespace, seen)
+        else:
+            feed(hashed, const, seen)
+    for name in code.co_names:
+        if name in namespace:
+            feed(hashed, namespace[name], seen)
+
+
+def fingerprint(rule) -> str:
+    """Return the fingerprint of a rule.
+
+    :param rule:    a rule
+    :type rule:     function
+    :return:        SHA-256 hex digest of its metadata and bytecode
+    :rtype:         str
+    """
+    hashed = hashlib.sha256(canonical(getattr(rule, 'metadata', {})))
+    feed(hashed, rule, set())
+    return hashed.hexdigest()
+
+
+def structure(plan: core.RulePlan) -> str:
+    """Return a hash of everything of `plan` except the implementation
+    and the source paths of basic rules. If it changes, outputs cannot
+    be patched.
+
+    :param plan:    the compiled rules
+    :type plan:     core.RulePlan
+    :return:        SHA-256 hex digest
+    :rtype:         str
+    """
+    from . import __version__
+
+    order = [{k: v for k, v in obj.items() if k != 'src'}
+             if obj['class'] == 'basicrule' else obj for obj in plan.order]
+    meta = {k: v for k, v in plan.meta.items() if k != 'lookup_documents'}
+    return hashlib.sha256(canonical([__version__, order, meta])).hexdigest()
+
+
+def manifest_path(out_filepath: str) -> str:
+    """Filepath of the manifest of output file `out_filepath`"""
+    return out_filepath + MANIFEST_SUFFIX
+
+
+class Updater:
+    """Writes output files and updates them incrementally later.
+
+    >>> updater = Updater(ruledxml.load_plan('rules.py'))
+    >>> updater.update('source.xml', 'target.xml')
+    'patched'
+    """
+
+    def __init__(self, plan: core.RulePlan, *, prune=False):
+        """Fingerprint all rules of `plan`.
+
+        :param plan:    the compiled rules
+        :type plan:     core.RulePlan
+        :param prune:   parse only source elements rules can reach
+        :type prune:    bool
+        """
+        self.plan = plan
+        self.prune = prune
+        self.fingerprints = {name: fingerprint(rule) for name, rule in plan.rules.items()}
+        self.structure = structure(plan)
+        self.lookups = {name: index.digest for name, index in plan.lookups.items()}
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+
+        self._basic = {obj['name']: obj for obj in plan.classified
+                       if obj['class'] == 'basicrule'}
+        self._iterated = len(self._basic) < len(plan.classified)
+
+        # rules writing to the same destination are not patched
+        destinations = collections.Counter(dst for obj in core.walk(plan.order)
+                                           for dst in obj.get('dst', ()))
+        self._shared = {obj['name'] for obj in core.walk(plan.order)
+                        if any(destinations[dst] > 1 for dst in obj.get('dst', ()))}
+        self._patchable = not plan.meta['output_xml_namespaces']
+
+    def inputs(self, name: str, args: list) -> str:
+        """Return a hash of the arguments of basic rule `name`
+        and the lookup documents it refers to.
+        """
+        lookup = self.plan.rules[name].metadata.get('lookup', {})
+        digests = sorted(self.plan.lookups[n].digest for n in lookup.values())
+        return hashlib.sha256(canonical([args, digests])).hexdigest()
+
+    def manifest(self, out_filepath: str):
+        """Read the manifest of `out_filepath`. Return None if it does not
+        exist, is corrupt or refers to other rules or another output file.
+
+        :param out_filepath:    filepath of the output XML file
+        :type out_filepath:     str
+        :return:                the manifest or None
+        :rtype:                 dict
+        """
+        try:
+            with open(manifest_path(out_filepath)) as fp:
+                manifest = json.load(fp)
+            with open(out_filepath, 'rb') as fp:
+                output = hashlib.sha256(fp.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning('Ignoring manifest of %s: %s', out_filepath, e)
+            return None
+
+        if not isinstance(manifest, dict) or manifest.get('structure') != self.structure \
+                or manifest.get('output') != output:
+            return None
+        return manifest
+
+    def update(self, in_filepath: str, out_filepath: str) -> str:
+        """Apply rules to `in_filepath` and write (or update) `out_filepath`
+        and its manifest. Returns whether the output was ``skipped``,
+        ``patched`` or written again (``applied``).
+
+        :param in_filepath:         filepath of the input XML file
+        :type in_filepath:          str
+        :param out_filepath:        filepath of the output XML file
+        :type out_filepath:         str
+        :return:                    one of `OUTCOMES`
+        :rtype:                     str
+        :raises RuledXmlException:  the input is invalid
+        """
+        with open(in_filepath, 'rb') as fp:
+            source = fp.read()
+        digest = hashlib.sha256(source).hexdigest()
+
+        manifest = self.manifest(out_filepath)
+        changed = set()
+        if manifest is not None:
+            changed = {name for name, fp in self.fingerprints.items()
+                       if manifest.get('rules', {}).get(name, {}).get('fingerprint') != fp}
+            # lookup documents are considered part of the input
+            same_input = (manifest.get('input') == digest and
+                          manifest.get('lookups') == self.lookups)
+            if not changed and same_input:
+                logging.info('Skipping %s, neither input nor rules changed', out_filepath)
+                self.counts['skipped'] += 1
+                return 'skipped'
+            if not self._patchable or (changed - set(self._basic)) or (changed & self._shared) \
+                    or (self._iterated and not same_input):
+                manifest = None
+
+        reachable = self.plan.reachable if self.prune else None
+        dom = xml.read(source, reachable=reachable, **self.plan.parser_options)
+        resolved = self.plan.resolve(dom)
+        self.plan.check_input(dom, filepath=in_filepath, resolved=resolved)
+        args = {name: [resolved.first(src) for src in obj['src']]
+                for name, obj in self._basic.items()}
+        inputs = {name: self.inputs(name, values) for name, values in args.items()}
+
+        target_dom = None
+        if manifest is not None:
+            target_dom = self.patch(out_filepath, manifest, changed, args, inputs)
+        outcome = 'patched' if target_dom is not None else 'applied'
+        if target_dom is None:
+            target_dom = self.plan.apply(dom, resolved=resolved)
+
+        output = io.BytesIO()
+        xml.write(target_dom, output, encoding=self.plan.meta['output_encoding'])
+        fs.replace_file(out_filepath, output.getvalue())
+        fs.replace_file(manifest_path(out_filepath), canonical({
+            'structure': self.structure,
+            'input': digest,
+            'lookups': self.lookups,
+            'output': hashlib.sha256(output.getvalue()).hexdigest(),
+            'rules': {name: {'fingerprint': fp, 'inputs': inputs.get(name)}
+                      for name, fp in self.fingerprints.items()}
+        }))
+
+        logging.info('%s %s', outcome.capitalize(), out_filepath)
+        self.counts[outcome] += 1
+        return outcome
+
+    def patch(self, out_filepath: str, manifest: dict, changed: set,
+        args: dict, inputs: dict):
+        """Apply basic rules, which changed or received other source values,
+        to the existing output. Return None if the output cannot be patched.
+
+        :param out_filepath:    filepath of the existing output XML file
+        :type out_filepath:     str
+        :param manifest:        manifest of the existing output
+        :type manifest:         dict
+        :param changed:         names of rules with a changed fingerprint
+        :type changed:          set
+        :param args:            arguments of basic rules by rule name
+        :type args:             dict
+        :param inputs:          hash of arguments of basic rules by rule name
+        :type inputs:           dict
+        :return:                root element of the patched output DOM or None
+        :rtype:                 lxml.etree.Element
+        """
+        target_dom = xml.read(out_filepath)
+        for name, obj in self._basic.items():
+            if name not in changed and manifest['rules'][name]['inputs'] == inputs[name]:
+                continue
+            if name in self._shared:
+                return None
+
+            # a destination to remove or insert might change the order of elements
+            dst = obj['dst'][0]
+            output = obj['rule'](*args[name])
+            if output is None or not paths.compile_path(dst).exists(target_dom):
+                return None
+            logging.info('Patching %s of %s', dst, out_filepath)
+            xml.write_destination(target_dom, dst, output)
+
+        return target_dom
+
@@ -6,20 +6,157 @@
 
     File system functionalities for ruledxml.
 
+    `UniqueFilepaths` allocates (and optionally reserves) filepaths of new
+    files in a folder; `create_unique_filepath` keeps one per folder.
+
     (C) 2015, meisterluk, BSD 3-clause license
 """
 
-import shutil
 import string
 import os.path
-import pathlib
-import itertools
-import lxml.etree
+import threading
+
+
+class UniqueFilepaths:
+    """Allocates filepaths of files, which do not exist in a folder yet.
+
+    Candidates are ``prefix + suffix``, then ``prefix_0 + suffix`` to
+    ``prefix_9 + suffix``, ``prefix_00 + suffix`` and so on (for the
+    default alphabet). Candidates are probed by a system call each. After
+    `SCAN_AFTER` taken candidates, the folder is listed once by
+    `os.scandir` and taken names are looked up in memory afterwards.
+    The next candidate to probe is remembered per prefix and suffix,
+    hence allocating n filepaths costs O(n) instead of O(n²) system calls.
+    Names deleted after they were seen are not reused.
+
+    If `reserve` is set, a filepath is reserved by creating an empty file
+    with ``O_CREAT | O_EXCL``. Then no other process and no other allocator
+    gets the same filepath.
+
+    >>> allocator = UniqueFilepaths('target')
+    >>> allocator.allocate('report', '.xml', reserve=True)
+    'target/report.xml'
+    >>> allocator.allocate('report', '.xml', reserve=True)
+    'target/report_0.xml'
+    """
+    SCAN_AFTER = 8
+
+    def __init__(self, folder: str, alphabet=string.digits):
+        """Allocate filepaths in `folder`.
+
+        :param folder:      folder in which filepaths shall be unique
+        :type folder:       str
+        :param alphabet:    the alphabet to use if additional characters are required
+        :type alphabet:     str
+        """
+        self.folder = folder
+        self.alphabet = list(alphabet)
+        self._taken = None
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def candidates(self, prefix: str, suffix: str, start=0):
+        """Yield candidate filenames for `prefix` and `suffix`
+        starting with the `start`-th candidate.
+        """
+        if start == 0:
+            yield prefix + suffix
+            start = 1
+
+        # skip all variations of fewer characters
+        base, length, offset = len(self.alphabet), 1, start - 1
+        while offset >= base ** length:
+            offset -= base ** length
+            length += 1
+
+        digits = []
+        for _ in range(length):
+            offset, digit = divmod(offset, base)
+            digits.insert(0, digit)
+
+        while True:
+            yield prefix + '_' + ''.join([self.alphabet[d] for d in digits]) + suffix
+            # increment like an odometer; continue with one more character
+            position = length - 1
+            while position >= 0 and digits[position] == base - 1:
+                digits[position] = 0
+                position -= 1
+            if position < 0:
+                length += 1
+                digits = [0] * length
+            else:
+                digits[position] += 1
+
+    def candidate(self, prefix: str, suffix: str, index: int) -> str:
+        """Return the `index`-th candidate filename for `prefix` and `suffix`"""
+        return next(self.candidates(prefix, suffix, index))
+
+    def scan(self):
+        """List the names of all entries of the folder"""
+        try:
+            with os.scandir(self.folder or os.curdir) as it:
+                self._taken = {entry.name for entry in it}
+        except FileNotFoundError:
+            self._taken = set()
+
+    def claim(self, filepath: str, reserve: bool) -> bool:
+        """Is `filepath` free? If `reserve` is set, create it atomically."""
+        if not reserve:
+            return not os.path.lexists(filepath)
+        try:
+            os.close(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+        except FileExistsError:
+            return False
+        return True
 
+    def allocate(self, prefix='', suffix='', *, reserve=False) -> str:
+        """Return a filepath, which does not exist yet, starting with
+        `prefix` and ending with `suffix`. Without `reserve`, the same
+        filepath is returned again until a file is created there.
 
-def create_unique_filepath(folder, prefix='', suffix='', alphabet=string.digits):
+        :param prefix:      prefix of the filename
+        :type prefix:       str
+        :param suffix:      suffix of the filename
+        :type suffix:       str
+        :param reserve:     create an empty file at the returned filepath
+        :type reserve:      bool
+        :return:            the new filepath
+        :rtype:             str
+        :raises OSError:    the file cannot be created
+        """
+        with self._lock:
+            start = self._next.get((prefix, suffix), 0)
+            probes = 0
+            for index, name in enumerate(self.candidates(prefix, suffix, start), start):
+                if self._taken is not None and name in self._taken:
+                    continue
+                filepath = os.path.join(self.folder, name)
+                if self.claim(filepath, reserve):
+                    break
+                probes += 1
+                if self._taken is None and probes >= self.SCAN_AFTER:
+                    self.scan()
+                elif self._taken is not None:
+                    self._taken.add(name)
+
+            if reserve:
+                index += 1
+                if self._taken is not None:
+                    self._taken.add(name)
+            self._next[(prefix, suffix)] = index
+            return filepath
+
+
+# allocators by folder and alphabet
+allocators = {}
+
+
+def create_unique_filepath(folder, prefix='', suffix='', alphabet=string.digits,
+    *, reserve=False):
     """Create a filepath to a file which does not exist in `folder` yet.
-    The filepath starts with `prefix` and ends with `suffix`.
+    The filepath starts with `prefix` and ends with `suffix`. Allocators
+    are kept per folder (see `UniqueFilepaths`), hence allocating many
+    filepaths in the same folder does not probe taken names again.
 
     :param folder:      folder in which return value shall be unique
     :type folder:       str
@@ -28,22 +165,18 @@ def create_unique_filepath(folder, prefix='', suffix='', alphabet=string.digits)
     :param suffix:      suffix of the filename
     :type suffix:       str
     :param alphabet:    the alphabet to use if additional characters are required
-    :type alphabet:     set
+    :type alphabet:     str
+    :param reserve:     create an empty file at the returned filepath atomically,
+                        such that no concurrent process gets the same filepath
+    :type reserve:      bool
     :return:            the new filepath
     :rtype:             str
     """
-    def candidates():
-        for i in itertools.count(1):
-            for variation in itertools.product(alphabet, repeat=i):
-                yield ''.join(variation)
-
-    candidate = os.path.join(folder, prefix + suffix)
-    for cand in candidates():
-        if not os.path.exists(candidate):
-            return candidate
-        candidate = os.path.join(folder, prefix + '_' + cand + suffix)
-
-    return candidate
+    key = (os.path.abspath(folder), folder, tuple(alphabet))
+    allocator = allocators.get(key)
+    if allocator is None:
+        allocator = allocators.setdefault(key, UniqueFilepaths(folder, alphabet))
+    return allocator.allocate(prefix, suffix, reserve=reserve)
 
 
 def create_base_directories(path: str, *, wholepath=False):
@@ -61,9 +194,8 @@ def create_base_directories(path: str, *, wholepath=False):
     else:
         basedir = os.path.split(path)[0]
 
-    pathinst = pathlib.Path(basedir)
-    if not pathinst.exists():
-        pathinst.mkdir(parents=True)
+    if basedir and not os.path.exists(basedir):
+        os.makedirs(basedir)
 
 
 def copy_files(src: list([str]), dest: str):
@@ -78,13 +210,15 @@ def copy_files(src: list([str]), dest: str):
     :param dest:    a filepath to a folder where to write files to
     :type dest:     str
     """
+    import shutil
+
     create_base_directories(dest, wholepath=True)
     assert os.path.isdir(dest), "Destination path must be folder"
 
     for s in src:
         basename = os.path.basename(s)
         root, ext = os.path.splitext(basename)
-        target = create_unique_filepath(dest, root, ext)
+        target = create_unique_filepath(dest, root, ext, reserve=True)
         shutil.copy(s, target)
 
 
@@ -100,6 +234,8 @@ def copy_file(src: str, dest: str):
     :param dest:    destination filepath
     :type dest:     str
     """
+    import shutil
+
     folders, filename = os.path.split(dest)
 
     # create parent directories
@@ -107,6 +243,30 @@ def copy_file(src: str, dest: str):
 
     # create unique filename
     root, ext = os.path.splitext(filename)
-    target = create_unique_filepath(folders, root, ext)
+    target = create_unique_filepath(folders, root, ext, reserve=True)
 
     shutil.copy(src, target)
+
+
+def replace_file(filepath: str, content: bytes):
+    """Atomically replace the file at `filepath` by `content`.
+    Readers see either the old or the new content, never a partial file.
+
+    :param filepath:    destination filepath
+    :type filepath:     str
+    :param content:     the new content
+    :type content:      bytes
+    """
+    import tempfile
+
+    folder = os.path.dirname(os.path.abspath(filepath))
+    create_base_directories(folder, wholepath=True)
+
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+        os.replace(tmp, filepath)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.lookups
+    ----------------
+
+    Indexed secondary documents (such as product catalogs or currency
+    tables) rules can join against.
+
+    A rules file declares lookup documents by name::
+
+        lookup_documents = {
+            "catalog": ("catalog.xml", "/catalog/product", "@sku"),
+            "currency": ("currencies.xml", "/currencies/currency", "@code", "rate")
+        }
+
+    Every document is parsed once, when the rules are compiled. For every
+    element at the base path (second item), its key (third item, relative
+    to the element) is associated with the element itself or, if a fourth
+    item is given, with the value at this path relative to the element.
+    If a key occurs several times, the first element wins.
+
+    Rules receive indexed values with @lookup. Worker processes forked
+    from a compiled plan share its indexes.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os.path
+import hashlib
+import logging
+
+import lxml.etree
+
+from . import xml
+from . import paths
+from . import exceptions
+
+
+class LookupIndex:
+    """Hash index of one lookup document"""
+
+    def __init__(self, name: str, filepath: str, base: str, key: str, value=None):
+        """Parse the document at `filepath` and index it.
+
+        :param name:                name of the lookup document
+        :type name:                 str
+        :param filepath:            filepath of the XML document
+        :type filepath:             str
+        :param base:                path of the indexed elements
+        :type base:                 str
+        :param key:                 path of the key relative to an indexed element
+        :type key:                  str
+        :param value:               path of the value relative to an indexed
+                                    element; the element itself if None
+        :type value:                str
+        :raises RuledXmlException:  document cannot be read
+        """
+        self.name = name
+        self.filepath = filepath
+        self.default = None if value is None else ''
+
+        try:
+            with open(filepath, 'rb') as fp:
+                content = fp.read()
+            dom = xml.read(content)
+        except (OSError, lxml.etree.LxmlError) as e:
+            msg = "Cannot read lookup document {} from {}: {}"
+            raise exceptions.RuledXmlException(msg.format(name, filepath, e))
+
+        # identifies the indexed content, eg. for result caches
+        self.digest = hashlib.sha256(content).hexdigest()
+
+        key_path = paths.compile_path(key)
+        value_path = None if value is None else paths.compile_path(value)
+
+        self._index = {}
+        for element in paths.compile_path(base).select(dom):
+            index_key = key_path.first(element)
+            if index_key in self._index:
+                continue
+            if value_path is None:
+                self._index[index_key] = element
+            else:
+                self._index[index_key] = value_path.first(element)
+
+        logging.info('Indexed %d keys of lookup document %s in %s',
+            len(self._index), name, filepath)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        return self._index[key]
+
+    def get(self, key):
+        """Return the indexed element or value of `key`.
+        If `key` is unknown, return None for indexed elements
+        and an empty string for indexed values.
+
+        :param key:     the key
+        :type key:      str
+        :return:        the element or value
+        :rtype:         lxml.etree.Element | str
+        """
+        return self._index.get(key, self.default)
+
+
+def declarations(documents: dict, directory='') -> dict:
+    """Validate the declaration of lookup documents and make filepaths
+    relative to `directory` absolute.
+
+    :param documents:           names associated to declaration tuples
+    :type documents:            dict
+    :param directory:           directory of the rules file
+    :type directory:            str
+    :return:                    names associated to normalized tuples
+    :rtype:                     dict
+    :raises RuledXmlException:  some declaration is invalid
+    """
+    normalized = {}
+    for name, declaration in documents.items():
+        if not isinstance(declaration, (tuple, list)) or len(declaration) not in (3, 4):
+            msg = ("Lookup document {} must be declared as "
+                   "(filepath, base, key) or (filepath, base, key, value)")
+            raise exceptions.RuledXmlException(msg.format(name))
+
+        filepath = os.path.join(directory, os.path.expanduser(declaration[0]))
+        normalized[name] = (os.path.abspath(filepath),) + tuple(declaration[1:])
+    return normalized
+
+
+def load(documents: dict) -> dict:
+    """Parse and index all lookup documents.
+
+    :param documents:           names associated to declaration tuples
+    :type documents:            dict
+    :return:                    names associated to their index
+    :rtype:                     dict(str: LookupIndex)
+    :raises RuledXmlException:  some document cannot be read
+    """
+    return {name: LookupIndex(name, *declaration)
+            for name, declaration in sorted(documents.items())}
+
+
+class LookupRule:
+    """A rule whose @lookup arguments are replaced by indexed values"""
+
+    def __init__(self, rule, indexes: dict):
+        """Wrap `rule`.
+
+        :param rule:        the rule
+        :type rule:         function
+        :param indexes:     argument positions associated to their index
+        :type indexes:      dict(int: LookupIndex)
+        """
+        self.rule = rule
+        self.metadata = rule.metadata
+        self.indexes = indexes
+
+    def __call__(self, *args):
+        args = list(args)
+        for position, index in self.indexes.items():
+            args[position] = index.get(args[position])
+        return self.rule(*args)
+
+
+def bind(rule, indexes: dict, rulename=''):
+    """Return a `LookupRule`, if `rule` is decorated with @lookup.
+    Otherwise return `rule` itself.
+
+    :param rule:                a rule
+    :type rule:                 function
+    :param indexes:             names associated to lookup indexes
+    :type indexes:              dict(str: LookupIndex)
+    :param rulename:            name of the rule for error messages
+    :type rulename:             str
+    :return:                    the rule to call
+    :rtype:                     function | LookupRule
+    :raises InvalidRuleSource:  @lookup refers to an undeclared document
+    """
+    names = getattr(rule, 'metadata', {}).get('lookup')
+    if not names or isinstance(rule, LookupRule):
+        return rule
+
+    bound = {}
+    for position, name in names.items():
+        if name not in indexes:
+            msg = "@lookup of {} refers to undeclared lookup document {}"
+            raise exceptions.InvalidRuleSource(msg.format(rulename, name))
+        bound[position] = indexes[name]
+    return LookupRule(rule, bound)
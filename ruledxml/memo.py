@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.memo
+    -------------
+
+    Caches of rule results for rules decorated with @memoize.
+
+    A `Memoized` rule is created once per `core.RulePlan`, hence its cache
+    persists across all documents the plan is applied to. Worker processes
+    forked from a plan inherit its caches and keep filling them on their own.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import threading
+import collections
+
+
+COUNTERS = ('hits', 'misses', 'evictions')
+
+
+class Memoized:
+    """A rule caching its return values by argument tuple.
+    At most `maxsize` results are kept; the least recently used
+    result is evicted first. Exceptions are not cached.
+    """
+
+    def __init__(self, rule, maxsize=128):
+        """Wrap `rule`.
+
+        :param rule:        the rule to cache results of
+        :type rule:         function
+        :param maxsize:     maximum number of cached results; unbounded if None
+        :type maxsize:      int
+        """
+        self.rule = rule
+        self.metadata = rule.metadata
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            try:
+                result = self._results[args]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._results.move_to_end(args)
+                self.hits += 1
+                return result
+
+        result = self.rule(*args)
+        if self.maxsize == 0:
+            return result
+
+        with self._lock:
+            self._results[args] = result
+            if self.maxsize is not None and len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        """Remove all cached results. Counters are kept."""
+        with self._lock:
+            self._results.clear()
+
+    def merge(self, stats: dict):
+        """Add the counters of `stats` (eg. of a worker process) to this cache.
+
+        :param stats:   statistics as returned by `stats`
+        :type stats:    dict
+        """
+        with self._lock:
+            for counter in COUNTERS:
+                setattr(self, counter, getattr(self, counter) + stats.get(counter, 0))
+
+    def stats(self) -> dict:
+        """Return hit, miss and eviction counts.
+
+        :return:        statistics of this cache
+        :rtype:         dict
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._results),
+            'maxsize': self.maxsize
+        }
+
+
+def memoized(rule):
+    """Return a `Memoized` wrapper, if `rule` is decorated with @memoize.
+    Otherwise return `rule` itself.
+
+    :param rule:    a rule
+    :type rule:     function
+    :return:        the rule to call
+    :rtype:         function | Memoized
+    """
+    options = getattr(rule, 'metadata', {}).get('memoize')
+    if options is None or isinstance(rule, Memoized):
+        return rule
+    return Memoized(rule, options['maxsize'])
+
+
+def combine(stats: list) -> dict:
+    """Sum statistics of several processes per rule.
+    `size` is summed as well, because every process has its own cache.
+
+    :param stats:   dicts associating rule names to `Memoized.stats`
+    :type stats:    list
+    :return:        rule names associated to the combined statistics
+    :rtype:         dict
+    """
+    combined = {}
+    for entry in stats:
+        for name, values in entry.items():
+            total = combined.setdefault(name, dict.fromkeys(COUNTERS + ('size',), 0))
+            total['maxsize'] = values['maxsize']
+            for key in COUNTERS + ('size',):
+                total[key] += values[key]
+    return combined
+
+
+def report(stats: dict) -> list:
+    """Format statistics as one line per rule.
+
+    :param stats:   rule names associated to `Memoized.stats`
+    :type stats:    dict
+    :return:        lines of text
+    :rtype:         list
+    """
+    template = '{} {} hits, {} misses, {} evictions ({} of {} cached)'
+    lines = []
+    for name in sorted(stats):
+        values = stats[name]
+        lines.append(template.format(name, values['hits'], values['misses'],
+            values['evictions'], values['size'],
+            'unlimited' if values['maxsize'] is None else values['maxsize']))
+    return lines
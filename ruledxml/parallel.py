@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.parallel
+    -----------------
+
+    Parallel application of rules using worker processes.
+
+    `WorkerPool` keeps a set of long-lived worker processes. The rules
+    file is loaded once in the parent process. If the platform supports
+    it, workers are forked afterwards and share the loaded rules (and lxml)
+    copy-on-write. Jobs are distributed and results are collected
+    using queues. Optionally, every worker runs a `pipeline.Pipeline`
+    to overlap parsing, applying rules and writing of consecutive jobs.
+
+    `batch_elements` distributes the base elements of one large
+    document in chunks of serialized elements to a process pool.
+
+    `transform_shared` applies several rules files to one parsed document
+    in processes forked after parsing (see `core.run_many`).
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import time
+import queue
+import logging
+import functools
+import traceback
+import collections
+import multiprocessing
+
+import lxml.etree
+
+from . import xml
+from . import core
+from . import memo
+from . import profiling
+from . import exceptions
+
+
+JobResult = collections.namedtuple('JobResult',
+    ['job_id', 'source', 'output', 'pid', 'exitcode', 'error', 'elapsed',
+     'memoization', 'profile', 'result_cache', 'update', 'pipeline'])
+
+# the plan used by processes of `batch_elements`
+batch_plan = None
+
+# the source DOM, its resolved paths and the plans used by processes of `transform_shared`
+shared_source = None
+
+
+def context():
+    """Return the multiprocessing context to use.
+    Forking is preferred, because workers inherit loaded rules.
+
+    :return:        a multiprocessing context
+    :rtype:         multiprocessing.context.BaseContext
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def process_file(plan: core.RulePlan, source: str, output: str, **options) -> int:
+    """Apply `plan` to XML file `source` and write the result to `output`.
+
+    :param plan:        the compiled rules
+    :type plan:         core.RulePlan
+    :param source:      filepath of the input XML file
+    :type source:       str
+    :param output:      filepath of the output XML file
+    :type output:       str
+    :param options:     keyword arguments for `core.run`
+    :type options:      dict
+    :return:            exit code
+    :rtype:             int
+    """
+    with open(source, 'rb') as src_fd:
+        with open(output, 'wb') as dest_fd:
+            return core.run(src_fd, plan, dest_fd,
+                infile=source, outfile=output, **options)
+
+
+def work(rules, jobs, results, options):
+    """Main loop of a worker process. Takes jobs from `jobs`
+    until None is received and puts a `JobResult` into `results`
+    for every job.
+
+    :param rules:       a compiled plan or a filepath to a rulesfile
+    :type rules:        core.RulePlan | str
+    :param jobs:        queue of (job_id, source, output) tuples
+    :type jobs:         multiprocessing.Queue
+    :param results:     queue for JobResult objects; their `memoization`
+                        and `result_cache` count all jobs of this worker so far
+    :type results:      multiprocessing.Queue
+    :param options:     keyword arguments for `core.run`; if `profile`
+                        is set, every job is profiled; if `update` is set,
+                        outputs are updated by a `fingerprints.Updater`;
+                        if `pipeline` is a positive depth, jobs are
+                        processed by a `pipeline.Pipeline`
+    :type options:      dict
+    """
+    pid = os.getpid()
+    plan = core.as_plan(rules)
+    options = dict(options)
+    depth = options.pop('pipeline', 0)
+    if depth:
+        work_pipelined(plan, jobs, results, depth, prune=options.get('prune', False))
+        return
+
+    profiled = options.pop('profile', False)
+    result_cache = options.get('results')
+    updater = None
+    if options.pop('update', False):
+        from . import fingerprints
+        updater = fingerprints.Updater(plan, prune=options.get('prune', False))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, source, output = job
+        profile = profiling.Profile() if profiled else None
+        outcome = None
+        start = time.perf_counter()
+        try:
+            if updater is None:
+                exitcode = process_file(plan, source, output, profile=profile, **options)
+            else:
+                outcome, exitcode = updater.update(source, output), 0
+            error = ''
+        except Exception:
+            exitcode, error = 1, traceback.format_exc()
+
+        results.put(JobResult(job_id, source, output, pid, exitcode,
+            error, time.perf_counter() - start, plan.memoization(),
+            None if profile is None else profile.as_dict(),
+            None if result_cache is None else result_cache.counters(), outcome, None))
+
+
+def work_pipelined(plan: core.RulePlan, jobs, results, depth: int, *, prune=False):
+    """Main loop of a worker process parsing the next jobs and writing
+    the outputs of previous jobs in threads while applying rules.
+    The reader thread takes up to `depth` jobs from `jobs` in advance.
+
+    :param plan:        the compiled rules
+    :type plan:         core.RulePlan
+    :param jobs:        queue of (job_id, source, output) tuples
+    :type jobs:         multiprocessing.Queue
+    :param results:     queue for JobResult objects; their `pipeline`
+                        measurements cover all jobs of this worker so far
+    :type results:      multiprocessing.Queue
+    :param depth:       depth of the queues between the stages
+    :type depth:        int
+    :param prune:       parse only source elements rules can reach
+    :type prune:        bool
+    """
+    from . import pipeline
+
+    job_ids = {}
+
+    def files():
+        for index, (job_id, source, output) in enumerate(iter(jobs.get, None)):
+            job_ids[index] = job_id
+            yield source, output
+
+    for result in pipeline.Pipeline(plan, depth=depth, prune=prune).run(files()):
+        results.put(result._replace(job_id=job_ids.pop(result.job_id)))
+
+
+class WorkerPool:
+    """A pool of long-lived worker processes applying the same rules to files.
+
+    >>> with WorkerPool('rules.py', processes=4) as pool:
+    ...     for source, output in files:
+    ...         pool.submit(source, output)
+    ...     for result in pool.results():
+    ...         print(result.source, result.exitcode)
+    """
+
+    def __init__(self, rules, processes=None, *, profile=False, **options):
+        """Load the rules and start the worker processes.
+        If `profile` is set, workers profile every job and `profile`
+        returns the combined measurements. If a `cache.ResultCache` is
+        given as option `results`, workers share its directory. If option
+        `update` is set, existing outputs are updated incrementally
+        (see `fingerprints.Updater`) and `JobResult.update` tells how.
+        If option `pipeline` is a positive depth, every worker parses and
+        writes files in threads (see `pipeline.Pipeline`) and `pipeline`
+        returns the measurements of every worker.
+
+        :param rules:       a compiled plan or a filepath to a rulesfile
+        :type rules:        core.RulePlan | str
+        :param processes:   number of worker processes; CPU count by default
+        :type processes:    int
+        :param profile:     profile jobs
+        :type profile:      bool
+        :param options:     keyword arguments for `core.run`
+        :type options:      dict
+        :raises RuledXmlException:  `pipeline` is combined with profiling,
+                                    updates or a result cache
+        """
+        ctx = context()
+        forking = ctx.get_start_method() == 'fork'
+
+        if options.get('pipeline') and (profile or options.get('update')
+                                        or options.get('results') is not None):
+            msg = "Pipelined workers cannot profile, update outputs or use a result cache"
+            raise exceptions.RuledXmlException(msg)
+
+        self.plan = core.as_plan(rules)
+        self.processes = processes or os.cpu_count() or 1
+        self.pending = 0
+        self._count = 0
+        self._memo = {}
+        self._result_cache = {}
+        self._pipeline = {}
+        self.profile = profiling.Profile() if profile else None
+        self._jobs = ctx.Queue()
+        self._results = ctx.Queue()
+
+        # without fork, every worker has to load the rules on its own
+        if not forking and isinstance(rules, core.RulePlan):
+            msg = "Worker processes can only inherit a RulePlan if forking is supported"
+            raise exceptions.RuledXmlException(msg)
+
+        options = dict(options, profile=profile)
+        args = (self.plan if forking else rules, self._jobs, self._results, options)
+        self.workers = [ctx.Process(target=work, args=args, daemon=True)
+                        for _ in range(self.processes)]
+        for worker in self.workers:
+            worker.start()
+
+        logging.info('Started %d worker processes', len(self.workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, source: str, output: str) -> int:
+        """Enqueue a file to transform.
+
+        :param source:      filepath of the input XML file
+        :type source:       str
+        :param output:      filepath of the output XML file
+        :type output:       str
+        :return:            the job id
+        :rtype:             int
+        """
+        job_id = self._count
+        self._jobs.put((job_id, source, output))
+        self._count += 1
+        self.pending += 1
+        return job_id
+
+    def result(self, timeout=None) -> JobResult:
+        """Wait for the next finished job.
+
+        :param timeout:     seconds to wait at most; forever if None
+        :type timeout:      float
+        :return:            the result of some finished job
+        :rtype:             JobResult
+        :raises queue.Empty:        no job finished within `timeout`
+        :raises RuledXmlException:  all workers terminated unexpectedly
+        """
+        interval = 1.0 if timeout is None else min(1.0, timeout)
+        waited = 0.0
+        while True:
+            try:
+                result = self._results.get(timeout=interval)
+                break
+            except queue.Empty:
+                waited += interval
+                if not any(w.is_alive() for w in self.workers):
+                    msg = "All worker processes terminated; {} jobs pending"
+                    raise exceptions.RuledXmlException(msg.format(self.pending))
+                if timeout is not None and waited >= timeout:
+                    raise
+
+        self.pending -= 1
+        self._memo[result.pid] = result.memoization
+        if result.result_cache is not None:
+            self._result_cache[result.pid] = result.result_cache
+        if result.pipeline is not None:
+            self._pipeline[result.pid] = result.pipeline
+        if self.profile is not None and result.profile is not None:
+            self.profile.merge(result.profile)
+        return result
+
+    def memoization(self) -> dict:
+        """Return hit, miss and eviction counts of @memoize rules
+        summed over all workers.
+
+        :return:        rule names associated to `memo.Memoized.stats`
+        :rtype:         dict
+        """
+        return memo.combine(self._memo.values())
+
+    def result_cache(self) -> dict:
+        """Return hit, miss and eviction counts of the result cache
+        summed over all workers.
+
+        :return:        counters as returned by `cache.ResultCache.counters`
+        :rtype:         dict
+        """
+        combined = {}
+        for counters in self._result_cache.values():
+            for name, value in counters.items():
+                combined[name] = combined.get(name, 0) + value
+        return combined
+
+    def pipeline(self) -> dict:
+        """Return the latest measurements of every pipelined worker.
+
+        :return:        process ids associated to `pipeline.Utilisation.as_dict`
+        :rtype:         dict
+        """
+        return dict(self._pipeline)
+
+    def results(self):
+        """Yield results of all pending jobs in order of completion.
+
+        :return:        a generator of JobResult objects
+        :rtype:         generator
+        """
+        while self.pending:
+            yield self.result()
+
+    def close(self):
+        """Stop all workers after pending jobs are finished.
+        Results not retrieved until now are discarded.
+        """
+        for _ in self.workers:
+            self._jobs.put(None)
+
+        # a worker cannot terminate before its results are consumed
+        for worker in self.workers:
+            while worker.is_alive():
+                try:
+                    self._results.get(timeout=0.1)
+                    self.pending -= 1
+                except queue.Empty:
+                    pass
+            worker.join()
+        self.workers = []
+
+
+def init_batch_worker(rules):
+    """Initializer of processes used by `batch_elements`.
+
+    :param rules:       a compiled plan or a filepath to a rulesfile
+    :type rules:        core.RulePlan | str
+    """
+    global batch_plan
+    batch_plan = core.as_plan(rules)
+
+
+def batch_chunk(chunk: list, infile='', incremental=False, profile=False) -> tuple:
+    """Rebuild serialized base elements and apply rules to each of them.
+    Elements are parsed with the parser options of the plan.
+
+    :param chunk:       list of (serialized document, depth of the base
+                        element in it, output filepath) tuples
+    :type chunk:        list
+    :param infile:      original XML input file path for debugging purposes
+    :type infile:       str
+    :param incremental: write the target XML files incrementally
+    :type incremental:  bool
+    :param profile:     profile this chunk
+    :type profile:      bool
+    :return:            number of processed elements, process id,
+                        memoization statistics of this process so far
+                        and measurements of this chunk (or None)
+    :rtype:             tuple(int, int, dict, dict)
+    :raises InvalidPathException: a rule reads a path outside the base element
+    """
+    core.check_relative_sources(batch_plan, 'in worker processes')
+
+    chunk_profile = profiling.Profile() if profile else None
+    for data, depth, out_filepath in chunk:
+        with profiling.timed(chunk_profile, 'parse'):
+            element = xml.parse_buffer(data, **batch_plan.parser_options)
+            for _ in range(depth):
+                element = element[0]
+        core.batch_element(batch_plan, element, out_filepath,
+            infile=infile, incremental=incremental, profile=chunk_profile)
+    return (len(chunk), os.getpid(), batch_plan.memoization(),
+            None if chunk_profile is None else chunk_profile.as_dict())
+
+
+def batch_elements(rules, elements, out_filepaths: list, processes: int,
+    *, chunksize=64, infile='', incremental=False, profile=None) -> int:
+    """Apply rules to `elements` in `processes` worker processes.
+    The i-th element is written to the i-th filepath of `out_filepaths`.
+
+    Elements are serialized together with empty copies of their ancestors
+    (see `xml.detach`) in the current process and sent in chunks of
+    `chunksize` elements to the workers. Rules must only read paths
+    relative to the base element (see `core.check_relative_sources`). At most two chunks per worker are
+    in flight, hence `elements` can be a generator of a streamed document.
+    If `rules` is a plan, the @memoize counters of all workers
+    are added to it. Measurements of the workers are added to `profile`.
+
+    :param rules:           a compiled plan or a filepath to a rulesfile
+    :type rules:            core.RulePlan | str
+    :param elements:        iterable of base elements
+    :type elements:         iterable
+    :param out_filepaths:   a filepath for every element
+    :type out_filepaths:    list
+    :param processes:       number of worker processes
+    :type processes:        int
+    :param chunksize:       number of elements sent to a worker at once
+    :type chunksize:        int
+    :param infile:          original XML input file path for debugging purposes
+    :type infile:           str
+    :param incremental:     write the target XML files incrementally
+    :type incremental:      bool
+    :param profile:         profile to record measurements in
+    :type profile:          profiling.Profile
+    :return:                number of processed elements
+    :rtype:                 int
+    :raises RuledXmlException: fewer output filepaths than elements
+    :raises InvalidPathException: a rule reads a path outside the base element
+    """
+    if isinstance(rules, core.RulePlan):
+        core.check_relative_sources(rules, 'in worker processes')
+
+    ctx = context()
+    if ctx.get_start_method() != 'fork':
+        if isinstance(rules, core.RulePlan):
+            msg = "Worker processes can only inherit a RulePlan if forking is supported"
+            raise exceptions.RuledXmlException(msg)
+
+    def chunks():
+        chunk = []
+        for index, element in enumerate(elements):
+            if index >= len(out_filepaths):
+                msg = "Number of output filepaths is {}; more base elements found"
+                raise exceptions.RuledXmlException(msg.format(len(out_filepaths)))
+            with profiling.timed(profile, 'serialize'):
+                detached = xml.detach(element)
+                root = detached.getroottree().getroot()
+                data = lxml.etree.tostring(root)
+            depth = sum(1 for _ in detached.iterancestors())
+            chunk.append((data, depth, out_filepaths[index]))
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    count = 0
+    pending = collections.deque()
+    stats = {}
+    kwargs = {'infile': infile, 'incremental': incremental,
+              'profile': profile is not None}
+
+    def collect(result):
+        done, pid, memoization, measurements = result.get()
+        if measurements is not None:
+            profile.merge(measurements)
+        # statistics are cumulative per process; keep the latest of every process
+        previous = stats.get(pid)
+        if previous is None or sum(v['hits'] + v['misses'] for v in memoization.values()) \
+                >= sum(v['hits'] + v['misses'] for v in previous.values()):
+            stats[pid] = memoization
+        return done
+
+    with ctx.Pool(processes, init_batch_worker, (rules,)) as pool:
+        for chunk in chunks():
+            pending.append(pool.apply_async(batch_chunk, (chunk,), kwargs))
+            if len(pending) >= 2 * processes:
+                count += collect(pending.popleft())
+        while pending:
+            count += collect(pending.popleft())
+
+    if isinstance(rules, core.RulePlan):
+        rules.merge_memoization(memo.combine(stats.values()))
+
+    return count
+
+
+def transform_shared_plan(index: int, infile='') -> tuple:
+    """Apply the `index`-th plan of `shared_source` (see `core.transform`)"""
+    src_dom, resolved, plans = shared_source
+    return core.transform(plans[index], src_dom, resolved, infile=infile)
+
+
+def transform_shared(src_dom: lxml.etree.Element, resolved, plans: list,
+    processes: int, *, infile='') -> list:
+    """Apply every plan of `plans` to `src_dom` in worker processes.
+    Workers are forked now and inherit the DOM and the resolved paths
+    copy-on-write; only the serialized outputs are sent back.
+
+    :param src_dom:     the root element of the source DOM
+    :type src_dom:      lxml.etree.Element
+    :param resolved:    paths of all plans resolved in `src_dom`
+    :type resolved:     paths.Resolution
+    :param plans:       the compiled rules
+    :type plans:        list
+    :param processes:   number of worker processes
+    :type processes:    int
+    :param infile:      original XML input file path for debugging purposes
+    :type infile:       str
+    :return:            result of `core.transform` for every plan
+    :rtype:             list
+    :raises RuledXmlException: forking is not supported
+    """
+    global shared_source
+
+    ctx = context()
+    if ctx.get_start_method() != 'fork':
+        msg = "Worker processes can only share a parsed document if forking is supported"
+        raise exceptions.RuledXmlException(msg)
+
+    shared_source = (src_dom, resolved, plans)
+    try:
+        with ctx.Pool(min(processes, len(plans))) as pool:
+            return pool.map(functools.partial(transform_shared_plan, infile=infile),
+                            range(len(plans)), chunksize=1)
+    finally:
+        shared_source = None
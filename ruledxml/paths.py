@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.paths
+    --------------
+
+    Compilation of XPath expressions used by rules.
+
+    A path like ``/root/body/header@lang`` is compiled once into a
+    `CompiledPath`. It stores the path split into element steps and an
+    optional attribute. Simple paths (only element names on the child
+    axis and an optional attribute) are evaluated with lxml's
+    ``find``/``findall`` and direct attribute access. All other paths
+    are evaluated with a cached ``lxml.etree.XPath`` object.
+
+    A `PathTrie` merges many simple paths into a prefix tree. It resolves
+    all of them in a single walk of a DOM, which visits every shared
+    prefix (eg. ``/Invoice/Header``) once instead of once per path.
+
+    `reachable` determines the elements of a document some paths can
+    reach at all. Other elements need not be parsed (see `xml.read`).
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import re
+import functools
+import threading
+
+import lxml.etree
+
+from . import exceptions
+
+
+SIMPLE_NAME = re.compile(r'^[A-Za-z_][\w.\-]*$')
+ATTRIBUTE = re.compile(r'^(?P<path>.*?)/?@(?P<attr>[\w.\-]+(?::[\w.\-]+)?)$')
+# parent steps, axes, unions, variables and paths within predicates
+# might reach elements anywhere in a document
+UNBOUNDED = re.compile(r'\.\.|::|\||\$|\[[^\]]*/')
+# marks an element of which all descendants are reachable
+SUBTREE = True
+
+
+class LazyXPath:
+    """An ``lxml.etree.XPath`` object which is compiled on first use.
+    Compiled objects are kept per thread.
+    """
+    __slots__ = ('expression', '_local')
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self._local = threading.local()
+
+    def __call__(self, element):
+        try:
+            evaluate = self._local.xpath
+        except AttributeError:
+            evaluate = self._local.xpath = lxml.etree.XPath(self.expression)
+        return evaluate(element)
+
+
+class Step:
+    """One element step of a path, eg. ``body`` in ``/root/body/header``"""
+    __slots__ = ('name', 'simple', '_xpath')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.simple = bool(SIMPLE_NAME.match(name))
+        self._xpath = None if self.simple else LazyXPath(name)
+
+    def select(self, element: lxml.etree.Element) -> list:
+        """Return all elements matching this step relative to `element`.
+        Equivalent to ``element.xpath(name)``.
+
+        :param element:     the context element
+        :type element:      lxml.etree.Element
+        :return:            matching elements in document order
+        :rtype:             list
+        """
+        if self.simple:
+            return element.findall(self.name)
+        return self._xpath(element)
+
+    def __repr__(self):
+        return 'Step({!r})'.format(self.name)
+
+
+class CompiledPath:
+    """A path of a rule compiled for repeated evaluation.
+
+    `steps` contains the element steps (a leading slash is dropped),
+    `attribute` and `attr_xmlns` the referenced attribute, if any.
+    """
+    __slots__ = ('string', 'steps', 'attribute', 'attr_xmlns',
+                 'absolute', 'simple', '_rest', '_xpath', '_split')
+
+    def __init__(self, path: str):
+        self.string = path
+
+        m = ATTRIBUTE.match(path)
+        if m:
+            elements, attribute = m.group('path'), m.group('attr')
+            if ':' in attribute:
+                self.attr_xmlns, self.attribute = attribute.split(':')
+            else:
+                self.attr_xmlns, self.attribute = None, attribute
+            expression = elements + '/@' + attribute if elements else '@' + attribute
+        else:
+            elements, self.attribute, self.attr_xmlns = path, None, None
+            expression = path
+
+        names = elements.lstrip('/').split('/')
+        if names[-1] == '':
+            names = names[:-1]
+
+        self.steps = tuple(Step(name) for name in names)
+        self.absolute = path.startswith('/') and not path.startswith('//')
+        self.simple = (bool(path) and all(s.simple for s in self.steps) and
+                       '//' not in elements and self.attr_xmlns is None and
+                       (bool(self.steps) or not self.absolute))
+
+        if self.absolute:
+            self._rest = '/'.join(names[1:])
+        else:
+            self._rest = '/'.join(names)
+        self._xpath = LazyXPath(expression) if path else None
+        self._split = None
+
+    def __str__(self):
+        return self.string
+
+    def __repr__(self):
+        return 'CompiledPath({!r})'.format(self.string)
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledPath):
+            return self.string == other.string
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.string)
+
+    @property
+    def names(self) -> tuple:
+        """Names of all element steps"""
+        return tuple(s.name for s in self.steps)
+
+    def _elements(self, dom: lxml.etree.Element) -> list:
+        """Elements matching the element steps of a simple path"""
+        if self.absolute:
+            root = dom.getroottree().getroot()
+            if root.tag != self.steps[0].name:
+                return []
+            if self._rest:
+                return root.findall(self._rest)
+            return [root]
+        elif self._rest:
+            return dom.findall(self._rest)
+        return [dom]
+
+    def _first_element(self, dom: lxml.etree.Element):
+        """First element matching the element steps of a simple path"""
+        if self.absolute:
+            root = dom.getroottree().getroot()
+            if root.tag != self.steps[0].name:
+                return None
+            if self._rest:
+                return root.find(self._rest)
+            return root
+        elif self._rest:
+            return dom.find(self._rest)
+        return dom
+
+    def select(self, dom: lxml.etree.Element) -> list:
+        """Evaluate this path with context element `dom`.
+        Equivalent to ``dom.xpath(path)``.
+
+        :param dom:     the context element
+        :type dom:      lxml.etree.Element
+        :return:        matching elements or attribute values
+        :rtype:         list
+        """
+        if not self.simple:
+            return self._xpath(dom)
+        elif self.attribute is None:
+            return self._elements(dom)
+
+        attribute = self.attribute
+        values = []
+        for element in self._elements(dom):
+            value = element.get(attribute)
+            if value is not None:
+                values.append(value)
+        return values
+
+    def exists(self, dom: lxml.etree.Element) -> bool:
+        """Does this path yield a non-empty result with context element `dom`?
+
+        :param dom:     the context element
+        :type dom:      lxml.etree.Element
+        :return:        True if at least one element or attribute matches
+        :rtype:         bool
+        """
+        if not self.string:
+            return False
+        elif not self.simple:
+            return bool(self._xpath(dom))
+        elif self.attribute is None:
+            return self._first_element(dom) is not None
+        return bool(self.select(dom))
+
+    def first(self, dom: lxml.etree.Element) -> str:
+        """Return the text content (or attribute value) of the first match.
+        If nothing matches, return an empty string.
+        This corresponds to the behavior of @source.
+
+        :param dom:     the context element
+        :type dom:      lxml.etree.Element
+        :return:        text content, attribute or ''
+        :rtype:         str
+        """
+        if not self.string:
+            return ''
+        elif not self.simple:
+            values = self._xpath(dom)
+            if not values:
+                return ''
+            elif self.attribute is not None or '@' in self.string:
+                return values[0] or ''
+            return values[0].text or ''
+        elif self.attribute is None:
+            element = self._first_element(dom)
+            if element is None:
+                return ''
+            return element.text or ''
+
+        attribute = self.attribute
+        for element in self._elements(dom):
+            value = element.get(attribute)
+            if value is not None:
+                return value
+        return ''
+
+    def split_last(self) -> tuple:
+        """Split off the last element step.
+        For example ``/root/child`` returns ``/root`` and ``child``.
+        Raises InvalidPathException, if path refers to an attribute.
+
+        :return:        compiled parent path and name of the last step
+        :rtype:         tuple(CompiledPath, Step)
+        """
+        if self._split is None:
+            index = self.string.rfind('/')
+            if index == -1:
+                base, last = '', self.string
+            else:
+                base, last = self.string[0:index], self.string[index + 1:]
+
+            if '@' in last:
+                msg = 'Expected path {} to refer to an element; refers to attribute'
+                raise exceptions.InvalidPathException(msg.format(self.string))
+            self._split = (compile_path(base), Step(last))
+        return self._split
+
+
+class RelativePath:
+    """A path evaluated relative to the base element of an enclosing
+    @foreach. `level` is the index of this base in the stack of bases
+    (outermost first) and `steps` are the element steps following the base.
+    """
+    __slots__ = ('path', 'level', 'steps', 'attribute', 'attr_xmlns')
+
+    def __init__(self, path: CompiledPath, level: int, steps: tuple):
+        self.path = path
+        self.level = level
+        self.steps = steps
+        self.attribute = path.attribute
+        self.attr_xmlns = path.attr_xmlns
+
+    def __repr__(self):
+        return 'RelativePath({!r}, {}, {!r})'.format(self.path.string, self.level,
+            '/'.join(step.name for step in self.steps))
+
+
+def relative_path(path, bases: tuple):
+    """Express `path` relative to the base among `bases` whose element
+    steps are the longest prefix of the steps of `path`.
+
+    Returns None if `path` cannot be evaluated relative to a base
+    equivalently. This is the case if some step is not a simple name,
+    no base is a prefix of `path` or the base is ambiguous.
+
+    :param path:    a path within @foreach `bases`
+    :type path:     str | CompiledPath
+    :param bases:   paths of the enclosing @foreach bases, outermost first
+    :type bases:    tuple
+    :return:        the relative path or None
+    :rtype:         RelativePath
+    """
+    path = compile_path(path)
+    bases = [compile_path(base) for base in bases]
+    if not path.steps or not all(s.simple for s in path.steps):
+        return None
+    if not all(s.simple for base in bases for s in base.steps):
+        return None
+
+    # the longest prefix; bases below it would be preferred by `xml.traverse`
+    names, level, prefix = path.names, None, ()
+    for i, base in enumerate(bases):
+        if len(base.names) > len(prefix) and names[:len(base.names)] == base.names:
+            level, prefix = i, base.names
+
+    if level is None or sum(1 for base in bases if base.names == prefix) > 1:
+        return None
+    return RelativePath(path, level, path.steps[len(prefix):])
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile(path: str) -> CompiledPath:
+    return CompiledPath(path)
+
+
+def compile_path(path) -> CompiledPath:
+    """Compile `path`. Compiled paths are cached, hence compiling
+    the same path several times returns the same object.
+
+    :param path:    an XPath or an already compiled path
+    :type path:     str | CompiledPath
+    :return:        the compiled path
+    :rtype:         CompiledPath
+    """
+    if isinstance(path, CompiledPath):
+        return path
+    return _compile(str(path))
+
+
+class TrieNode:
+    """A node of a `PathTrie`. It represents the elements
+    reached by the element steps leading to this node.
+    """
+    __slots__ = ('index', 'children', 'elements', 'attributes')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.children = {}
+        self.elements = []
+        self.attributes = []
+
+
+class PathTrie:
+    """Paths merged into a prefix tree of element names.
+
+    Simple paths are resolved by `resolve` in one walk of a DOM.
+    The walk descends only into elements whose name is a step of some path
+    and stops descending as soon as all paths below a node are resolved.
+    Other paths are evaluated individually on demand.
+    """
+
+    def __init__(self, paths):
+        """Build the trie.
+
+        :param paths:   paths to resolve (strings or compiled paths)
+        :type paths:    iterable
+        """
+        self.paths = []
+        self.targets = {}
+        self._ancestors = []
+        self._nodes = []
+
+        # the document (children: root elements) and the context element
+        self._absolute = self._node()
+        self._relative = self._node()
+
+        for path in paths:
+            path = compile_path(path)
+            if path in self.targets or not path.simple:
+                continue
+            self.add(path)
+
+        self._counts = [0] * len(self._nodes)
+        for ancestors in self._ancestors:
+            for index in ancestors:
+                self._counts[index] += 1
+
+    def _node(self) -> TrieNode:
+        node = TrieNode(len(self._nodes))
+        self._nodes.append(node)
+        return node
+
+    def add(self, path: CompiledPath):
+        """Add simple `path` to the trie"""
+        node = self._absolute if path.absolute else self._relative
+        ancestors = [node.index]
+        for step in path.steps:
+            if step.name not in node.children:
+                node.children[step.name] = self._node()
+            node = node.children[step.name]
+            ancestors.append(node.index)
+
+        target = len(self.paths)
+        if path.attribute is None:
+            node.elements.append(target)
+        else:
+            node.attributes.append((path.attribute, target))
+
+        self.paths.append(path)
+        self.targets[path] = target
+        self._ancestors.append(tuple(ancestors))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def resolve(self, dom: lxml.etree.Element):
+        """Resolve all simple paths of the trie with context element `dom`.
+
+        :param dom:     the context element
+        :type dom:      lxml.etree.Element
+        :return:        the resolved values
+        :rtype:         Resolution
+        """
+        values = [None] * len(self.paths)
+        remaining = list(self._counts)
+        ancestors = self._ancestors
+
+        def found(target, value):
+            values[target] = value
+            for index in ancestors[target]:
+                remaining[index] -= 1
+
+        def visit(element, node):
+            for target in node.elements:
+                if values[target] is None:
+                    found(target, element.text or '')
+            for attribute, target in node.attributes:
+                if values[target] is None:
+                    value = element.get(attribute)
+                    if value is not None:
+                        found(target, value)
+
+            children = node.children
+            if not children:
+                return
+            for child in element:
+                if not remaining[node.index]:
+                    return
+                subnode = children.get(child.tag)
+                if subnode is not None and remaining[subnode.index]:
+                    visit(child, subnode)
+
+        if remaining[self._absolute.index]:
+            root = dom.getroottree().getroot()
+            subnode = self._absolute.children.get(root.tag)
+            if subnode is not None:
+                visit(root, subnode)
+        if remaining[self._relative.index]:
+            visit(dom, self._relative)
+
+        return Resolution(self, dom, values)
+
+
+class Resolution:
+    """Values of paths resolved by `PathTrie.resolve`.
+    Paths not contained in the trie are evaluated on first access.
+    """
+    __slots__ = ('trie', 'dom', 'values', '_others')
+
+    def __init__(self, trie: PathTrie, dom: lxml.etree.Element, values: list):
+        self.trie = trie
+        self.dom = dom
+        self.values = values
+        self._others = {}
+
+    def first(self, path) -> str:
+        """Text content or attribute value of the first match of `path`.
+        Equivalent to ``CompiledPath.first``.
+
+        :param path:    a path
+        :type path:     str | CompiledPath
+        :return:        text content, attribute or ''
+        :rtype:         str
+        """
+        path = compile_path(path)
+        target = self.trie.targets.get(path)
+        if target is not None:
+            return self.values[target] or ''
+
+        key = ('first', path)
+        if key not in self._others:
+            self._others[key] = path.first(self.dom)
+        return self._others[key]
+
+    def exists(self, path) -> bool:
+        """Does `path` match any element or attribute?
+        Equivalent to ``CompiledPath.exists``.
+
+        :param path:    a path
+        :type path:     str | CompiledPath
+        :return:        True if at least one element or attribute matches
+        :rtype:         bool
+        """
+        path = compile_path(path)
+        target = self.trie.targets.get(path)
+        if target is not None:
+            return self.values[target] is not None
+
+        key = ('exists', path)
+        if key not in self._others:
+            self._others[key] = path.exists(self.dom)
+        return self._others[key]
+
+
+def element_prefix(path):
+    """Return the names of the leading simple steps of absolute `path`
+    and whether the descendants of the element reached are selected
+    by other steps of the path (eg. ``/doc/items/*/name``).
+
+    :param path:    a path
+    :type path:     str | CompiledPath
+    :return:        element names and the subtree flag, or None if `path`
+                    might select elements outside this subtree
+    :rtype:         tuple(tuple, bool)
+    """
+    path = compile_path(path)
+    if not path.absolute or not path.steps or UNBOUNDED.search(path.string):
+        return None
+
+    names = []
+    for step in path.steps:
+        if not step.simple:
+            return tuple(names), True
+        names.append(step.name)
+    return tuple(names), False
+
+
+def base_relative(path) -> bool:
+    """Does `path` only select its context element or descendants of
+    it? Then it yields the same result for a copy of the context element
+    taken out of its document.
+
+    :param path:    a path
+    :type path:     str | CompiledPath
+    :return:        False if `path` might select elements outside the
+                    subtree of the context element
+    :rtype:         bool
+    """
+    path = compile_path(path)
+    return not path.string.startswith('/') and not UNBOUNDED.search(path.string)
+
+
+def reachable(paths):
+    """Build a prefix tree of the elements `paths` can reach.
+
+    Keys of the returned dictionary are names of root elements. Values
+    are dictionaries of the same structure for the children or `SUBTREE`
+    if all descendants are reachable. Elements not contained in the tree
+    are never selected by any of `paths` (nor are their descendants).
+
+    :param paths:   paths (strings or compiled paths); empty paths are ignored
+    :type paths:    iterable
+    :return:        the prefix tree or None if any element might be reached
+    :rtype:         dict
+    """
+    tree = {}
+    for path in paths:
+        if not str(path):
+            continue
+        prefix = element_prefix(path)
+        if prefix is None:
+            return None
+
+        names, subtree = prefix
+        node = tree
+        for i, name in enumerate(names):
+            child = node.get(name)
+            if child is SUBTREE:
+                break
+            elif subtree and i == len(names) - 1:
+                node[name] = SUBTREE
+            elif child is None:
+                child = node[name] = {}
+                node = child
+            else:
+                node = child
+        else:
+            if subtree and not names:
+                return None
+    return tree
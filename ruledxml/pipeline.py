@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.pipeline
+    -----------------
+
+    Pipelined application of the same rules to many files.
+
+    Processing a file consists of parsing it, applying rules and
+    serializing the output. lxml releases the GIL while parsing and
+    serializing, hence `Pipeline` runs these stages concurrently: a reader
+    thread parses file N+1 and a writer thread serializes (and fsyncs)
+    file N-1, while the calling thread applies rules to file N. Bounded
+    queues between the stages limit the number of parsed and transformed
+    documents kept in memory.
+
+    `Utilisation` tells how busy every stage was and how full the queues
+    were. If the queues are always full, the transformation is the
+    bottleneck and a larger depth does not help.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import time
+import queue
+import threading
+import traceback
+
+from . import xml
+from . import core
+from . import parallel
+
+
+STAGES = ('read', 'apply', 'write')
+QUEUES = ('parsed', 'transformed')
+
+# marks the end of the jobs in a queue
+DONE = object()
+
+
+class Utilisation:
+    """Busy time of the stages of a pipeline and fill level of its queues.
+    Every stage only updates its own counters.
+    """
+
+    def __init__(self, depth: int):
+        """Create counters for queues of `depth` items at most.
+
+        :param depth:   maximum number of items in a queue
+        :type depth:    int
+        """
+        self.depth = depth
+        self.files = 0
+        self.busy = dict.fromkeys(STAGES, 0.0)
+        self.blocked = dict.fromkeys(STAGES, 0.0)
+        self._samples = {name: [0, 0, 0] for name in QUEUES}
+        self._start = time.perf_counter()
+        self._stop = None
+
+    def sample(self, name: str, size: int):
+        """Record the number of items in queue `name`"""
+        samples = self._samples[name]
+        samples[0] += 1
+        samples[1] += size
+        samples[2] = max(samples[2], size)
+
+    def stop(self):
+        """Stop measuring the elapsed time"""
+        self._stop = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the pipeline started (until it stopped)"""
+        return (self._stop or time.perf_counter()) - self._start
+
+    def as_dict(self) -> dict:
+        """Return all measurements as dictionary.
+
+        :return:    number of files, elapsed seconds, busy and blocked
+                    seconds per stage, average and maximum fill level per queue
+        :rtype:     dict
+        """
+        return {
+            'files': self.files,
+            'elapsed': self.elapsed,
+            'depth': self.depth,
+            'stages': {stage: {'busy': self.busy[stage], 'blocked': self.blocked[stage]}
+                       for stage in STAGES},
+            'queues': {name: {'avg': total / count if count else 0.0, 'max': maximum}
+                       for name, (count, total, maximum) in self._samples.items()}
+        }
+
+
+def report(utilisation: dict) -> str:
+    """Format measurements of a pipeline as one line of text.
+
+    :param utilisation:     measurements as returned by `Utilisation.as_dict`
+    :type utilisation:      dict
+    :return:                the measurements
+    :rtype:                 str
+    """
+    elapsed = max(utilisation['elapsed'], 1e-9)
+    stages = ', '.join('{} {:.0%} (blocked {:.0%})'.format(stage,
+        values['busy'] / elapsed, values['blocked'] / elapsed)
+        for stage, values in utilisation['stages'].items())
+    queues = ', '.join('{} avg {:.1f} max {}/{}'.format(name, values['avg'],
+        values['max'], utilisation['depth'])
+        for name, values in utilisation['queues'].items())
+    return '{} files in {:.1f}s; busy {}; queued {}'.format(utilisation['files'],
+        utilisation['elapsed'], stages, queues)
+
+
+class Pipeline:
+    """Applies the same rules to many files in a reader, transformer
+    and writer stage.
+
+    >>> pipeline = Pipeline('rules.py', depth=4)
+    >>> for result in pipeline.run([('a.xml', 'a.out.xml'), ('b.xml', 'b.out.xml')]):
+    ...     print(result.source, result.exitcode)
+    >>> print(report(pipeline.utilisation.as_dict()))
+    """
+
+    POLL = 0.05
+
+    def __init__(self, rules, *, depth=2, fsync=True, prune=False):
+        """Load the rules.
+
+        :param rules:   a compiled plan or a filepath to a rulesfile
+        :type rules:    core.RulePlan | str
+        :param depth:   maximum number of parsed (respectively transformed)
+                        documents waiting for the next stage
+        :type depth:    int
+        :param fsync:   flush outputs to disk before reporting them finished
+        :type fsync:    bool
+        :param prune:   parse only source elements rules can reach
+        :type prune:    bool
+        """
+        self.plan = core.as_plan(rules)
+        self.depth = max(1, depth)
+        self.fsync = fsync
+        self.prune = prune
+        self.utilisation = Utilisation(self.depth)
+
+    def _put(self, q: queue.Queue, item, stage: str, stopped: threading.Event) -> bool:
+        """Put `item` into `q` and record the time `stage` was blocked.
+        Returns False if the pipeline was stopped in the meantime.
+        """
+        start = time.perf_counter()
+        try:
+            while not stopped.is_set():
+                try:
+                    q.put(item, timeout=self.POLL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            self.utilisation.blocked[stage] += time.perf_counter() - start
+
+    def _get(self, q: queue.Queue, name: str, stopped: threading.Event):
+        """Take the next item from queue `name`. Returns DONE
+        if the pipeline was stopped in the meantime.
+        """
+        self.utilisation.sample(name, q.qsize())
+        while not stopped.is_set():
+            try:
+                return q.get(timeout=self.POLL)
+            except queue.Empty:
+                pass
+        return DONE
+
+    def _read(self, files, parsed: queue.Queue, stopped: threading.Event, failures: list):
+        """Main loop of the reader thread"""
+        reachable = self.plan.reachable if self.prune else None
+        try:
+            for job_id, (source, output) in enumerate(files):
+                start = time.perf_counter()
+                dom, error = None, ''
+                try:
+                    dom = xml.read(source, reachable=reachable, **self.plan.parser_options)
+                except Exception:
+                    error = traceback.format_exc()
+                self.utilisation.busy['read'] += time.perf_counter() - start
+                if not self._put(parsed, (job_id, source, output, start, dom, error),
+                                 'read', stopped):
+                    return
+        except BaseException as e:
+            failures.append(e)
+        finally:
+            self._put(parsed, DONE, 'read', stopped)
+
+    def _write(self, transformed: queue.Queue, finished: queue.Queue, stopped: threading.Event):
+        """Main loop of the writer thread"""
+        pid = os.getpid()
+        encoding = self.plan.meta['output_encoding']
+        while True:
+            item = self._get(transformed, 'transformed', stopped)
+            if item is DONE:
+                break
+
+            job_id, source, output, start, target_dom, error = item
+            if not error:
+                begin = time.perf_counter()
+                try:
+                    with open(output, 'wb') as fd:
+                        xml.write(target_dom, fd, encoding=encoding)
+                        if self.fsync:
+                            fd.flush()
+                            os.fsync(fd.fileno())
+                except Exception:
+                    error = traceback.format_exc()
+                self.utilisation.busy['write'] += time.perf_counter() - begin
+
+            del target_dom
+            self.utilisation.files += 1
+            finished.put(parallel.JobResult(job_id, source, output, pid,
+                1 if error else 0, error, time.perf_counter() - start,
+                None, None, None, None, None))
+        finished.put(DONE)
+
+    def run(self, files):
+        """Process `files` and yield a result for every file in order.
+        `files` might be a generator; it is consumed by the reader thread.
+        `JobResult.job_id` is the index of a file in `files` and
+        `JobResult.elapsed` the time from start of parsing it until
+        its output was written.
+
+        :param files:       iterable of (source, output) filepath tuples
+        :type files:        iterable
+        :return:            a generator of `parallel.JobResult` objects
+        :rtype:             generator
+        :raises Exception:  iterating over `files` failed
+        """
+        stopped = threading.Event()
+        parsed = queue.Queue(self.depth)
+        transformed = queue.Queue(self.depth)
+        finished = queue.Queue()
+        failures = []
+        threads = [
+            threading.Thread(target=self._read, name='ruledxml-reader',
+                             args=(files, parsed, stopped, failures), daemon=True),
+            threading.Thread(target=self._write, name='ruledxml-writer',
+                             args=(transformed, finished, stopped), daemon=True)
+        ]
+        for thread in threads:
+            thread.start()
+
+        def results(block: bool):
+            while True:
+                try:
+                    result = finished.get(block)
+                except queue.Empty:
+                    return
+                if result is DONE:
+                    return
+                yield result._replace(memoization=self.plan.memoization(),
+                                      pipeline=self.utilisation.as_dict())
+
+        try:
+            while True:
+                # results of the writer are passed on while waiting for input
+                self.utilisation.sample('parsed', parsed.qsize())
+                try:
+                    item = parsed.get(timeout=self.POLL)
+                except queue.Empty:
+                    yield from results(False)
+                    continue
+                if item is DONE:
+                    break
+
+                job_id, source, output, start, dom, error = item
+                target_dom = None
+                if not error:
+                    begin = time.perf_counter()
+                    try:
+                        resolved = self.plan.resolve(dom)
+                        self.plan.check_input(dom, filepath=source, resolved=resolved)
+                        target_dom = self.plan.apply(dom, resolved=resolved)
+                    except Exception:
+                        error = traceback.format_exc()
+                    self.utilisation.busy['apply'] += time.perf_counter() - begin
+
+                del dom, item
+                self._put(transformed, (job_id, source, output, start, target_dom, error),
+                          'apply', stopped)
+                del target_dom
+                yield from results(False)
+
+            self._put(transformed, DONE, 'apply', stopped)
+            yield from results(True)
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+            self.utilisation.stop()
+
+        if failures:
+            raise failures[0]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.profiling
+    ------------------
+
+    Collection of per-phase and per-rule timing information.
+
+    A `Profile` is passed as ``profile=`` to `core.run`, `core.batch_run`
+    or `core.RulePlan.apply`. It records the wall time of phases (such as
+    reading, rule application and writing), the number of calls as well
+    as cumulative and maximum wall time of every rule and the number of
+    evaluated source, destination and iteration paths. Without a profile,
+    no measurements are taken.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import json
+import time
+import contextlib
+
+
+PATH_KINDS = ('sources', 'destinations', 'iterations')
+
+
+def record(entries: dict, name: str, elapsed: float):
+    """Record a call of `name` taking `elapsed` seconds in `entries`"""
+    entry = entries.get(name)
+    if entry is None:
+        entries[name] = {'calls': 1, 'total': elapsed, 'max': elapsed}
+    else:
+        entry['calls'] += 1
+        entry['total'] += elapsed
+        entry['max'] = max(entry['max'], elapsed)
+
+
+class Profile:
+    """Timing information of one or several runs"""
+
+    def __init__(self):
+        self.phases = {}
+        self.rules = {}
+        self.paths = dict.fromkeys(PATH_KINDS, 0)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Context manager measuring the wall time of phase `name`.
+
+        :param name:    name of the phase
+        :type name:     str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record(self.phases, name, time.perf_counter() - start)
+
+    def call(self, node, args: list):
+        """Call the rule of classified rule `node` with `args` and
+        record its wall time.
+
+        :param node:    a classified rule
+        :type node:     dict
+        :param args:    arguments of the rule
+        :type args:     list
+        :return:        the return value of the rule
+        """
+        start = time.perf_counter()
+        try:
+            return node['rule'](*args)
+        finally:
+            record(self.rules, node['name'], time.perf_counter() - start)
+
+    def count(self, kind: str, number=1):
+        """Count `number` evaluations of paths of some `kind`.
+
+        :param kind:    one of `PATH_KINDS`
+        :type kind:     str
+        :param number:  number of evaluations
+        :type number:   int
+        """
+        self.paths[kind] += number
+
+    def merge(self, data: dict):
+        """Add the measurements of `data` (as returned by `as_dict`,
+        eg. by a worker process) to this profile.
+
+        :param data:    measurements of another profile
+        :type data:     dict
+        """
+        for attr in ('phases', 'rules'):
+            entries = getattr(self, attr)
+            for name, entry in data[attr].items():
+                if name not in entries:
+                    entries[name] = dict(entry)
+                    continue
+                entries[name]['calls'] += entry['calls']
+                entries[name]['total'] += entry['total']
+                entries[name]['max'] = max(entries[name]['max'], entry['max'])
+        for kind in PATH_KINDS:
+            self.paths[kind] += data['paths'].get(kind, 0)
+
+    def as_dict(self) -> dict:
+        """Return all measurements as dictionary, which can be serialized as JSON.
+
+        :return:        phases, rules and path counts
+        :rtype:         dict
+        """
+        return {
+            'phases': {name: dict(entry) for name, entry in self.phases.items()},
+            'rules': {name: dict(entry) for name, entry in self.rules.items()},
+            'paths': dict(self.paths)
+        }
+
+    def write(self, fd):
+        """Write all measurements as JSON to file descriptor `fd`"""
+        json.dump(self.as_dict(), fd, indent=2, sort_keys=True)
+
+    def table(self) -> str:
+        """Return all measurements as human-readable table.
+        Rules are sorted by cumulative wall time.
+
+        :return:        the table
+        :rtype:         str
+        """
+        template = '{:<32s} {:>8} {:>12} {:>12} {:>12}'
+        lines = [template.format('phase', 'calls', 'total [ms]', 'mean [ms]', 'max [ms]')]
+
+        def row(name, entry):
+            lines.append(template.format(name, entry['calls'],
+                '{:.3f}'.format(entry['total'] * 1000),
+                '{:.3f}'.format(entry['total'] * 1000 / entry['calls']),
+                '{:.3f}'.format(entry['max'] * 1000)))
+
+        for name, entry in self.phases.items():
+            row(name, entry)
+
+        lines.append('')
+        lines.append(template.format('rule', 'calls', 'total [ms]', 'mean [ms]', 'max [ms]'))
+        for name, entry in sorted(self.rules.items(), key=lambda r: -r[1]['total']):
+            row(name, entry)
+
+        lines.append('')
+        lines.append('paths evaluated: ' + ', '.join('{} {}'.format(self.paths[kind], kind)
+                                                    for kind in PATH_KINDS))
+        return '\n'.join(lines)
+
+
+def timed(profile, name: str):
+    """Return a context manager measuring phase `name` in `profile`.
+    If `profile` is None, nothing is measured.
+
+    :param profile:     the profile or None
+    :type profile:      Profile
+    :param name:        name of the phase
+    :type name:         str
+    :return:            a context manager
+    """
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.phase(name)
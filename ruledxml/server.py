@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.server
+    ---------------
+
+    A resident daemon applying rules to XML documents.
+
+    The daemon listens on a Unix domain socket (see `ruledxml.client` for
+    the protocol). lxml and compiled rules files stay loaded, hence the
+    cost of a request is the transformation itself. A compiled rules file
+    is reloaded if the modification time or size of the file changes
+    and its content hash differs, or if one of its lookup documents
+    changes. Every connection is served by its own thread, hence requests
+    of several clients are processed concurrently.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import io
+import os
+import time
+import socket
+import hashlib
+import logging
+import threading
+import traceback
+import socketserver
+
+from . import core
+from . import client
+from . import exceptions
+
+
+def signature(filepath: str) -> tuple:
+    """Return modification time and size of the file at `filepath`"""
+    stat = os.stat(filepath)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def lookups_signature(plan: core.RulePlan) -> tuple:
+    """Return the signatures of all lookup documents of `plan`"""
+    return tuple(signature(index.filepath) for index in plan.lookups.values())
+
+
+class PlanRegistry:
+    """Compiled rules files, reloaded whenever the file changes"""
+
+    def __init__(self, cache=None):
+        """Initialize an empty registry.
+
+        :param cache:       cache of compiled rules files
+        :type cache:        cache.RulesCache
+        """
+        self.cache = cache
+        self.loads = 0
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def get(self, filepath: str) -> core.RulePlan:
+        """Return the compiled plan of the rules file at `filepath`.
+
+        :param filepath:            filepath to a rules file
+        :type filepath:             str
+        :return:                    the compiled plan
+        :rtype:                     core.RulePlan
+        :raises RuledXmlException:  rules file or some rule is invalid
+        """
+        filepath = os.path.realpath(filepath)
+        current = signature(filepath)
+
+        def unchanged(entry):
+            return entry is not None and entry[0] == current and \
+                lookups_signature(entry[2]) == entry[3]
+
+        entry = self._plans.get(filepath)
+        if unchanged(entry):
+            return entry[2]
+
+        # loading executes the rules file; do not do it concurrently
+        with self._lock:
+            entry = self._plans.get(filepath)
+            if unchanged(entry):
+                return entry[2]
+
+            with open(filepath, 'rb') as fp:
+                digest = hashlib.sha256(fp.read()).digest()
+            if entry is not None and entry[1] == digest and \
+                    lookups_signature(entry[2]) == entry[3]:
+                plan = entry[2]
+            else:
+                logging.info('Loading rules file %s', filepath)
+                plan = core.load_plan(filepath, cache=self.cache)
+                self.loads += 1
+
+            self._plans[filepath] = (current, digest, plan, lookups_signature(plan))
+            return plan
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """Serves all requests of one connection"""
+
+    def handle(self):
+        while True:
+            try:
+                message = client.recv_message(self.request)
+            except (OSError, ValueError, exceptions.RuledXmlException) as e:
+                logging.warning('Dropping connection: %s', e)
+                return
+            if message is None:
+                return
+
+            header, payload = self.server.transform(*message)
+            try:
+                client.send_message(self.request, header, payload)
+            except OSError as e:
+                logging.warning('Dropping connection: %s', e)
+                return
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """The ruledxml daemon.
+
+    >>> with Server('/run/ruledxml.sock') as server:
+    ...     server.serve_forever()
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str, *, cache=None):
+        """Bind the socket at `path` and start listening.
+        A stale socket file at `path` is removed.
+
+        :param path:                filepath of the socket
+        :type path:                 str
+        :param cache:               cache of compiled rules files
+        :type cache:                cache.RulesCache
+        :raises RuledXmlException:  another daemon listens at `path`
+        """
+        if os.path.exists(path):
+            remove_stale_socket(path)
+
+        self.path = path
+        self.plans = PlanRegistry(cache)
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__(path, RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def transform(self, header: dict, payload: bytes) -> tuple:
+        """Process one request.
+
+        :param header:      the request header
+        :type header:       dict
+        :param payload:     the request payload
+        :type payload:      bytes
+        :return:            header and payload of the response
+        :rtype:             tuple(dict, bytes)
+        """
+        start = time.perf_counter()
+        # requests are processed by several threads concurrently
+        with self._lock:
+            self.requests += 1
+
+        infile = header.get('input') or '<payload>'
+        output = header.get('output')
+        response = {'exitcode': 0, 'error': '', 'output': output}
+        data = b''
+        try:
+            plan = self.plans.get(header['rules'])
+            options = {'infile': infile, 'outfile': output or '',
+                       'incremental': bool(header.get('incremental')),
+                       'prune': bool(header.get('prune'))}
+
+            src_fd = io.BytesIO(payload) if header.get('input') is None \
+                     else open(header['input'], 'rb')
+            with src_fd:
+                if output is None:
+                    dest_fd = io.BytesIO()
+                    response['exitcode'] = core.run(src_fd, plan, dest_fd, **options)
+                    data = dest_fd.getvalue()
+                else:
+                    with open(output, 'wb') as dest_fd:
+                        response['exitcode'] = core.run(src_fd, plan, dest_fd, **options)
+
+        except (exceptions.RuledXmlException, OSError, KeyError) as e:
+            logging.error('Request for %s failed: %s', infile, e)
+            response['exitcode'], response['error'] = 1, '{}: {}'.format(type(e).__name__, e)
+        except Exception:
+            logging.exception('Request for %s failed', infile)
+            response['exitcode'], response['error'] = 1, traceback.format_exc()
+
+        response['elapsed'] = time.perf_counter() - start
+        logging.info('Processed %s in %.6f seconds with exit code %d',
+            infile, response['elapsed'], response['exitcode'])
+        return response, data
+
+
+def remove_stale_socket(path: str):
+    """Remove the socket file at `path`, if no process listens at it.
+
+    :param path:                filepath of the socket
+    :type path:                 str
+    :raises RuledXmlException:  another process listens at `path`
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        msg = "Socket {} is in use by another process"
+        raise exceptions.RuledXmlException(msg.format(path))
+    finally:
+        sock.close()
+
+
+def serve(path: str, *, cache=None) -> int:
+    """Run the daemon at socket `path` until interrupted.
+
+    :param path:        filepath of the socket
+    :type path:         str
+    :param cache:       cache of compiled rules files
+    :type cache:        cache.RulesCache
+    :return:            exit code
+    :rtype:             int
+    """
+    import signal
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    with Server(path, cache=cache) as server:
+        logging.info('Listening on %s', path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info('Shutting down after %d requests', server.requests)
+    return 0
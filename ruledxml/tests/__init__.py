@@ -5,8 +5,28 @@ from . import test_destination
 from . import test_source
 from . import test_foreach
 from . import test_order
-
-TEST_MODULES = [test_destination, test_source, test_foreach, test_order]
+from . import test_plan
+from . import test_paths
+from . import test_batch
+from . import test_write
+from . import test_parallel
+from . import test_cache
+from . import test_startup
+from . import test_server
+from . import test_memoize
+from . import test_lookup
+from . import test_profile
+from . import test_fingerprints
+from . import test_watch
+from . import test_pipeline
+from . import test_fs
+
+TEST_MODULES = [test_destination, test_source, test_foreach, test_order,
+                test_plan, test_paths, test_batch, test_write,
+                test_parallel, test_cache, test_startup,
+                test_server, test_memoize, test_lookup,
+                test_profile, test_fingerprints, test_watch,
+                test_pipeline, test_fs]
 
 
 def runall():
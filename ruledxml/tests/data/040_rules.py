@@ -0,0 +1,12 @@
+from ruledxml import destination, source
+
+
+@source("name")
+@destination("/person/name")
+def ruleName(name):
+    return name.upper()
+
+@source("@id")
+@destination("/person@id")
+def ruleIdentifier(identifier):
+    return identifier
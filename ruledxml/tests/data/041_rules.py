@@ -0,0 +1,25 @@
+from ruledxml import foreach, source, destination, lookup
+
+lookup_documents = {
+    "catalog": ("041_catalog.xml", "/catalog/product", "@sku"),
+    "prices": ("041_catalog.xml", "/catalog/product", "@sku", "price")
+}
+
+
+@foreach("/order/item", "/invoice/line")
+@lookup("catalog", "/order/item@sku")
+@destination("/invoice/line/product")
+def ruleProduct(product):
+    if product is None:
+        return "unknown"
+    return product.findtext("name")
+
+
+@foreach("/order/item", "/invoice/line")
+@source("/order/item@quantity")
+@lookup("prices", "/order/item@sku")
+@destination("/invoice/line/total")
+def ruleTotal(price, quantity):
+    if not price:
+        return "0"
+    return str(int(price) * int(quantity))
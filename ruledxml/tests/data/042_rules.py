@@ -0,0 +1,17 @@
+from ruledxml import destination, source
+
+
+@source("/xml/record/name")
+@destination("/person/first")
+def ruleFirst(name):
+    return name
+
+@source("/xml/record[3]/name")
+@destination("/person/last")
+def ruleLast(name):
+    return name
+
+@source("@id")
+@destination("/person@id")
+def ruleIdentifier(identifier):
+    return identifier
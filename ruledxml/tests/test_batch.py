@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+import lxml.etree
+
+import ruledxml
+
+from . import utils
+
+
+class TestRuledXmlBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outs = [os.path.join(self.tmpdir, '{}.xml'.format(i)) for i in range(1, 4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertOutputs(self):
+        for i, out in enumerate(self.outs, 1):
+            with open(out, 'rb') as result:
+                with open(utils.data('040_target_{}.xml'.format(i)), 'rb') as target:
+                    utils.xmlEquals(self, result.read(), target.read())
+
+    def test_batch_run(self):
+        with open(utils.data('040_source.xml')) as src:
+            ruledxml.batch_run(src, utils.data('040_rules.py'), self.outs, '/xml/record')
+        self.assertOutputs()
+
+    def test_batch_run_stream(self):
+        with open(utils.data('040_source.xml'), 'rb') as src:
+            ruledxml.batch_run(src, utils.data('040_rules.py'), self.outs,
+                '/xml/record', stream=True)
+        self.assertOutputs()
+
+    def test_batch_run_parallel(self):
+        import ruledxml.parallel
+        for stream in (False, True):
+            with open(utils.data('040_source.xml'), 'rb') as src:
+                ruledxml.batch_run(src, utils.data('040_rules.py'), self.outs,
+                    '/xml/record', stream=stream, processes=2)
+            self.assertOutputs()
+
+        # workers do not have the whole document
+        with open(utils.data('040_source.xml'), 'rb') as src:
+            with self.assertRaises(ruledxml.exceptions.InvalidPathException):
+                ruledxml.batch_run(src, utils.data('042_rules.py'), self.outs,
+                    '/xml/record', processes=2)
+        plan = ruledxml.load_plan(utils.data('042_rules.py'))
+        with self.assertRaises(ruledxml.exceptions.InvalidPathException):
+            ruledxml.parallel.batch_elements(plan, [], self.outs, 2)
+
+    def test_batch_run_absolute(self):
+        with open(utils.data('040_source.xml'), 'rb') as src:
+            ruledxml.batch_run(src, utils.data('042_rules.py'), self.outs, '/xml/record')
+        for i, out in enumerate(self.outs, 1):
+            with open(out, 'rb') as result:
+                person = lxml.etree.fromstring(result.read())
+            self.assertEqual((person.get('id'), person.findtext('first'),
+                              person.findtext('last')), (str(i), 'alice', 'carol'))
+
+        with open(utils.data('040_source.xml'), 'rb') as src:
+            with self.assertRaises(ruledxml.exceptions.InvalidPathException):
+                ruledxml.batch_run(src, utils.data('042_rules.py'), self.outs,
+                    '/xml/record', stream=True)
+
+    def test_batch_elements_chunks(self):
+        import ruledxml.parallel
+        plan = ruledxml.load_plan(utils.data('040_rules.py'))
+        with open(utils.data('040_source.xml')) as src:
+            elements = ruledxml.xml.read(src).xpath('/xml/record')
+        count = ruledxml.parallel.batch_elements(plan, elements, self.outs, 2, chunksize=1)
+        self.assertEqual(count, 3)
+        self.assertOutputs()
+
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.parallel.batch_elements(plan, elements, self.outs[:2], 2)
+
+    def test_iterelements(self):
+        with open(utils.data('040_source.xml')) as src:
+            elements = list(ruledxml.xml.iterelements(src, '/xml/record'))
+        self.assertEqual([e.get('id') for e in elements], ['1', '2', '3'])
+        # every element is a complete copy below a copy of its ancestors
+        self.assertEqual([e.findtext('name') for e in elements], ['alice', 'bob', 'carol'])
+        for element in elements:
+            self.assertEqual(len(element.getparent()), 1)
+            self.assertIsNone(element.getparent().getparent())
+
+        with open(utils.data('040_source.xml')) as src:
+            with self.assertRaises(ruledxml.exceptions.InvalidPathException):
+                list(ruledxml.xml.iterelements(src, '//record'))
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import lxml.etree
+
+import ruledxml
+import ruledxml.cache
+
+from . import utils
+
+
+class TestRuledXmlCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ruledxml.cache.RulesCache(os.path.join(self.tmpdir, 'cache'))
+        self.rules = os.path.join(self.tmpdir, 'rules.py')
+        shutil.copy(utils.data('026_rules.py'), self.rules)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def transform(self, plan):
+        result = io.BytesIO()
+        with open(utils.data('026_source.xml')) as src:
+            ruledxml.run(src, plan, result)
+        return result.getvalue()
+
+    def test_hit(self):
+        first = ruledxml.load_plan(self.rules, cache=self.cache)
+        second = ruledxml.load_plan(self.rules, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(first.order, second.order)
+        self.assertEqual(self.transform(first), self.transform(second))
+
+    def test_invalidation(self):
+        ruledxml.load_plan(self.rules, cache=self.cache)
+        with open(self.rules, 'a') as fp:
+            fp.write('\n@destination("/doc/footer")\ndef ruleFooter():\n    return "end"\n')
+        plan = ruledxml.load_plan(self.rules, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        self.assertIn('ruleFooter', plan.rules)
+        self.assertIn(b'<footer>end</footer>', self.transform(plan))
+
+    def test_engine_changed(self):
+        ruledxml.load_plan(self.rules, cache=self.cache)
+        digest = ruledxml.cache._engine_digest
+        try:
+            ruledxml.cache._engine_digest = '0' * 64
+            cache = ruledxml.cache.RulesCache(self.cache.directory)
+        finally:
+            ruledxml.cache._engine_digest = digest
+        ruledxml.load_plan(self.rules, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    def test_local_metadata(self):
+        with open(self.rules, 'w') as fp:
+            fp.write('from ruledxml import foreach, source, destination, batch\n\n'
+                     'def number(value):\n    return float(value or 0)\n\n'
+                     '@batch(dtype=number, numpy=False)\n'
+                     '@foreach("/doc/items/item", "/out/entry")\n'
+                     '@source("/doc/items/item@value")\n'
+                     '@destination("/out/entry@value")\n'
+                     'def ruleDouble(values):\n'
+                     '    return [str(v * 2) for v in values]\n')
+        dom = lxml.etree.fromstring(b'<doc><items><item value="2"/><item value="3"/></items></doc>')
+
+        outputs = []
+        for _ in range(2):
+            # like a new process, which did not import the rules file yet
+            sys.modules.pop(ruledxml.core.modulename(self.rules), None)
+            plan = ruledxml.load_plan(self.rules, cache=self.cache)
+            outputs.append(lxml.etree.tostring(plan.apply(dom)))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn(b'value="4.0"', outputs[1])
+
+    def test_corrupt_entry(self):
+        ruledxml.load_plan(self.rules, cache=self.cache)
+        for entry in os.listdir(self.cache.directory):
+            with open(os.path.join(self.cache.directory, entry), 'wb') as fp:
+                fp.write(b'garbage')
+        ruledxml.load_plan(self.rules, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_invalid_rules(self):
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.load_plan(utils.data('010_rules.py'), cache=self.cache)
+
+
+class TestRuledXmlResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.results = ruledxml.cache.ResultCache(os.path.join(self.tmpdir, 'results'))
+        self.rules = os.path.join(self.tmpdir, 'rules.py')
+        shutil.copy(utils.data('026_rules.py'), self.rules)
+        with open(utils.data('026_source.xml'), 'rb') as fp:
+            self.source = fp.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def transform(self, plan, source=None):
+        result = io.BytesIO()
+        ruledxml.run(io.BytesIO(source or self.source), plan, result, results=self.results)
+        return result.getvalue()
+
+    def test_hit(self):
+        plan = ruledxml.load_plan(self.rules)
+        first = self.transform(plan)
+        second = self.transform(plan)
+        self.assertEqual(first, second)
+        self.assertEqual(self.results.counters(), {'hits': 1, 'misses': 1, 'evictions': 0})
+        with open(utils.data('026_target.xml'), 'rb') as target:
+            utils.xmlEquals(self, second, target.read())
+
+        # the same content of the rules file in another file hits as well
+        self.transform(ruledxml.load_plan(self.rules, cache=ruledxml.cache.RulesCache(self.tmpdir)))
+        self.assertEqual(self.results.hits, 2)
+
+    def test_invalidation(self):
+        plan = ruledxml.load_plan(self.rules)
+        self.transform(plan)
+        self.transform(plan, self.source.replace(b'</', b' </', 1))
+        with open(self.rules, 'a') as fp:
+            fp.write('\n# modified\n')
+        self.transform(ruledxml.load_plan(self.rules))
+        self.assertEqual((self.results.hits, self.results.misses), (0, 3))
+
+    def test_eviction(self):
+        plan = ruledxml.load_plan(self.rules)
+        size = len(self.transform(plan))
+        self.results.maxsize = 2 * size
+        self.transform(plan, self.source + b'\n')
+        os.utime(self.results.entry(self.results.key(self.source, plan)), (0, 0))
+        self.transform(plan, self.source + b'\n\n')
+
+        self.assertEqual(self.results.evictions, 1)
+        self.assertEqual(self.results.stats()['size'], 2 * size)
+        self.transform(plan)
+        self.assertEqual((self.results.hits, self.results.misses), (0, 4))
+
+    def test_helper_changed(self):
+        helper = os.path.join(self.tmpdir, 'ruledxml_test_helper.py')
+        with open(self.rules, 'w') as fp:
+            fp.write('from ruledxml import source, destination\n'
+                     'from ruledxml_test_helper import suffix\n\n'
+                     '@source("/html/head/meta@charset")\n'
+                     '@destination("/doc@charset")\n'
+                     'def ruleCharset(charset):\n'
+                     '    return suffix(charset)\n')
+
+        sys.path.insert(0, self.tmpdir)
+        try:
+            keys = []
+            for text in ('-a', '-b'):
+                with open(helper, 'w') as fp:
+                    fp.write('def suffix(value):\n    return value + {!r}\n'.format(text))
+                sys.modules.pop('ruledxml_test_helper', None)
+                plan = ruledxml.load_plan(self.rules)
+                keys.append(self.results.key(self.source, plan))
+                self.assertIn(text.encode('ascii'), self.transform(plan))
+        finally:
+            sys.path.remove(self.tmpdir)
+            sys.modules.pop('ruledxml_test_helper', None)
+
+        self.assertNotEqual(keys[0], keys[1])
+        self.assertEqual((self.results.hits, self.results.misses), (0, 2))
+
+    def test_shared_directory(self):
+        plan = ruledxml.load_plan(self.rules)
+        size = len(self.transform(plan))
+        # caches of other processes using the same directory
+        others = [ruledxml.cache.ResultCache(self.results.directory, maxsize=4 * size)
+                  for _ in range(3)]
+        for i in range(1, 13):
+            other = others[i % len(others)]
+            other.put(other.key(self.source + b'\n' * i, plan), b'x' * size)
+            self.assertLessEqual(self.results.size(), 4 * size)
+        self.assertEqual(sum(other.evictions for other in others), 9)
+
+    def test_plans_not_kept(self):
+        import gc
+
+        plan = ruledxml.load_plan(self.rules)
+        self.results.key(self.source, plan)
+        self.assertEqual(len(self.results._fingerprints), 1)
+        del plan
+        gc.collect()
+        self.assertEqual(len(self.results._fingerprints), 0)
+
+    def test_unknown_rules(self):
+        rules, meta = ruledxml.read_rulesfile(self.rules)
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            self.transform(ruledxml.compile_rules(rules, meta))
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
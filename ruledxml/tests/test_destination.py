@@ -29,6 +29,42 @@ class TestRuledXmlDestination(unittest.TestCase):
         with open(utils.data('003_target.xml'), 'rb') as target:
             utils.xmlEquals(self, result.getvalue(), target.read())
 
+    def test_index_identical(self):
+        def build(index):
+            xml = ruledxml.xml
+            dom = None
+            for path in ['/doc/head/title', '/doc/head/title@lang', '/doc/body/p',
+                         '/doc/head/meta', '/doc/body/p@class', 'body/p']:
+                dom = xml.write_destination(dom, path, path, index=index)
+
+            bases = []
+            for i in range(3):
+                section = xml.write_new_ambiguous_element(dom, '/doc/body/section',
+                    [], index=index)
+                for j in range(2):
+                    item = xml.write_new_ambiguous_element(dom,
+                        '/doc/body/section/item', [section], index=index)
+                    bases.append((section, item))
+
+            for i, (section, item) in enumerate(reversed(bases)):
+                xml.write_base_destination(dom, '/doc/body/section/item/text',
+                    i, [section, item], index=index)
+                xml.write_base_destination(dom, '/doc/body/section@n',
+                    i, [section], index=index)
+            xml.write_destination(dom, '/doc/body/section/item@first', 1, index=index)
+            xml.write_destination(dom, '/doc/body/section[2]/item', 2, index=index)
+            return lxml.etree.tostring(dom)
+
+        self.assertEqual(build(None), build(ruledxml.xml.TargetIndex()))
+
+    def test_index_forget(self):
+        index = ruledxml.xml.TargetIndex()
+        dom = ruledxml.xml.write_destination(None, '/doc/a', 'x', index=index)
+        dom.remove(dom[0])
+        index.forget(dom)
+        ruledxml.xml.write_destination(dom, '/doc/a', 'y', index=index)
+        self.assertEqual(lxml.etree.tostring(dom), b'<doc><a>y</a></doc>')
+
 
 def run():
     unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import ruledxml
+import ruledxml.fingerprints
+
+from . import utils
+
+
+RULES = '''from ruledxml import source, destination
+
+SUFFIX = "{suffix}"
+
+
+def shout(value):
+    return value.upper() + SUFFIX
+
+
+@source("/order/customer")
+@destination("/invoice/customer")
+def ruleCustomer(customer):
+    return shout(customer)
+
+
+@source("/order/total")
+@destination("/invoice/total@amount")
+def ruleTotal(total):
+    return total{total}
+'''
+
+SOURCE = b'''<?xml version="1.0"?>
+<order><customer>{customer}</customer><total>42</total></order>
+'''
+
+
+class TestRuledXmlFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source.xml')
+        self.output = os.path.join(self.tmpdir, 'target.xml')
+        self.write_source('alice')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_source(self, customer):
+        with open(self.source, 'wb') as fp:
+            fp.write(SOURCE.replace(b'{customer}', customer.encode('ascii')))
+
+    def updater(self, suffix='', total=''):
+        filepath = os.path.join(self.tmpdir, 'rules.py')
+        with open(filepath, 'w') as fp:
+            fp.write(RULES.format(suffix=suffix, total=total))
+        return ruledxml.fingerprints.Updater(ruledxml.load_plan(filepath))
+
+    def assertFullRun(self, updater, source=None):
+        result = io.BytesIO()
+        with open(source or self.source, 'rb') as src:
+            ruledxml.run(src, updater.plan, result)
+        with open(self.output, 'rb') as output:
+            utils.xmlEquals(self, output.read(), result.getvalue())
+
+    def test_fingerprint(self):
+        first, second = self.updater(), self.updater()
+        self.assertEqual(first.fingerprints, second.fingerprints)
+
+        # helper functions and global values are part of the fingerprint
+        changed = self.updater(suffix='!').fingerprints
+        self.assertNotEqual(changed['ruleCustomer'], first.fingerprints['ruleCustomer'])
+        self.assertEqual(changed['ruleTotal'], first.fingerprints['ruleTotal'])
+
+    def test_update(self):
+        updater = self.updater()
+        self.assertEqual(updater.update(self.source, self.output), 'applied')
+        self.assertEqual(updater.update(self.source, self.output), 'skipped')
+
+        # a modified rule is patched
+        updater = self.updater(suffix='!')
+        self.assertEqual(updater.update(self.source, self.output), 'patched')
+        self.assertFullRun(updater)
+
+        # a modified source value is patched
+        self.write_source('bob')
+        self.assertEqual(updater.update(self.source, self.output), 'patched')
+        self.assertFullRun(updater)
+        self.assertEqual(updater.counts, {'skipped': 0, 'patched': 2, 'applied': 0})
+
+    def test_update_fallback(self):
+        updater = self.updater()
+        updater.update(self.source, self.output)
+
+        # output modified elsewhere
+        with open(self.output, 'ab') as fp:
+            fp.write(b'\n')
+        self.assertEqual(updater.update(self.source, self.output), 'applied')
+
+        # a rule without a value cannot be patched
+        updater = self.updater(total=' if False else None')
+        self.assertEqual(updater.update(self.source, self.output), 'applied')
+        self.assertFullRun(updater)
+
+    def test_update_foreach(self):
+        rules = os.path.join(self.tmpdir, '026_rules.py')
+        shutil.copy(utils.data('026_rules.py'), rules)
+        updater = ruledxml.fingerprints.Updater(ruledxml.load_plan(rules))
+        source = utils.data('026_source.xml')
+
+        self.assertEqual(updater.update(source, self.output), 'applied')
+        self.assertEqual(updater.update(source, self.output), 'skipped')
+        with open(rules) as fp:
+            content = fp.read()
+        with open(rules, 'w') as fp:
+            fp.write(content.replace('    return li\n', '    return li.upper()\n'))
+        updater = ruledxml.fingerprints.Updater(ruledxml.load_plan(rules))
+        self.assertEqual(updater.update(source, self.output), 'applied')
+        self.assertFullRun(updater, source)
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
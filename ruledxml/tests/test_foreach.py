@@ -2,8 +2,10 @@
 
 import io
 import unittest
+import lxml.etree
 
 import ruledxml
+from ruledxml import core
 
 from . import utils
 
@@ -57,6 +59,108 @@ class TestRuledXmlForeach(unittest.TestCase):
         with open(utils.data('026_target.xml'), 'rb') as target:
             utils.xmlEquals(self, result.getvalue(), target.read())
 
+    def traversed(self, plan, dom):
+        """Apply `plan` traversing every path from the root element"""
+        order = core.attach_rules(plan.order, plan.rules)
+        classified = core.freeze(core.compile_paths(order))
+        target = core.run_rules(dom, None, classified, plan.meta['output_xml_namespaces'])
+        return lxml.etree.tostring(target)
+
+    def test_relative_identical(self):
+        for number in ['021', '022', '023', '024', '025', '026']:
+            rules, meta = core.read_rulesfile(utils.data(number + '_rules.py'))
+            plan = ruledxml.compile_rules(rules, meta)
+            dom = ruledxml.xml.read(utils.data(number + '_source.xml'))
+            self.assertEqual(lxml.etree.tostring(plan.apply(dom)),
+                             self.traversed(plan, dom), number)
+
+    def test_relative_ambiguous(self):
+        dom = lxml.etree.fromstring(b"""<a>
+          <b><c><d>1</d><d>2</d><e>x</e></c><c><d>3</d><e>y</e></c></b>
+          <b><c><d>4</d></c></b>
+        </a>""")
+        foreach = ruledxml.foreach
+        rules = {
+            'ruleD': foreach('/a/b/c/d', '/o/p/q/r')(foreach('/a/b/c', '/o/p/q')(
+                ruledxml.source('/a/b/c/d')(ruledxml.source('/a/b/c/e')(
+                ruledxml.destination('/o/p/q/r/v')(lambda d, e: d + e))))),
+            'ruleE': foreach('/a/b/c', '/o/p/q')(
+                ruledxml.source('/a/b/c/e')(ruledxml.source('/a/b/d')(
+                ruledxml.destination('/o/p/q@e')(lambda e, d: e + d)))),
+            'ruleF': ruledxml.destination('/o/p/first')(lambda: 'f')
+        }
+        plan = ruledxml.compile_rules(rules)
+        self.assertEqual(lxml.etree.tostring(plan.apply(dom)), self.traversed(plan, dom))
+
+        iteration = [obj for obj in plan.classified if obj['class'] == 'iteration'][0]
+        self.assertIsNone(iteration['srciter'])
+        inner = [obj for obj in iteration['children'] if obj['class'] == 'iteration'][0]
+        self.assertEqual(inner['srciter'].level, 0)
+        rule = inner['children'][0]
+        levels = {str(rel.path): rel.level for rel in rule['srcrel']}
+        self.assertEqual(levels, {'/a/b/c/d': 1, '/a/b/c/e': 0})
+
+    def batch_rules(self, scale):
+        foreach, source, destination = ruledxml.foreach, ruledxml.source, ruledxml.destination
+        return {
+            'ruleName': foreach('/doc/items/item', '/out/entry')(
+                source('/doc/items/item/name')(destination('/out/entry/name')(
+                    lambda name: name.upper()))),
+            'ruleValue': foreach('/doc/items/item', '/out/entry')(
+                source('/doc/items/item@value')(destination('/out/entry@value', order=1)(
+                    scale)))
+        }
+
+    def test_batch_identical(self):
+        dom = lxml.etree.fromstring(b"""<doc><items>
+          <item value="1.5"><name>a</name></item>
+          <item value="-2"><name>b</name></item>
+          <item value="4"><name>c</name></item>
+        </items></doc>""")
+
+        expected = ruledxml.compile_rules(self.batch_rules(
+            lambda value: None if value.startswith('-') else float(value) * 2)).apply(dom)
+
+        @ruledxml.batch(dtype=float)
+        def scale(values):
+            return [None if value < 0 else value * 2 for value in values]
+        target = ruledxml.compile_rules(self.batch_rules(scale)).apply(dom)
+        self.assertEqual(lxml.etree.tostring(target), lxml.etree.tostring(expected))
+
+        @ruledxml.batch(numpy=False)
+        def concat(values):
+            self.assertEqual(values, ['1.5', '-2', '4'])
+            return [None if value.startswith('-') else str(float(value) * 2)
+                    for value in values]
+        target = ruledxml.compile_rules(self.batch_rules(concat)).apply(dom)
+        self.assertEqual(lxml.etree.tostring(target), lxml.etree.tostring(expected))
+
+    def test_batch_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('NumPy is not available')
+
+        dom = lxml.etree.fromstring(b'<doc><items><item value="1"/><item value="3"/></items></doc>')
+
+        @ruledxml.batch(dtype=float)
+        def normalize(values):
+            self.assertIsInstance(values, numpy.ndarray)
+            return values / values.max()
+        target = ruledxml.compile_rules(self.batch_rules(normalize)).apply(dom)
+        self.assertEqual([e.get('value') for e in target.findall('entry')],
+                         [str(1 / 3), '1.0'])
+
+    def test_batch_invalid(self):
+        dom = lxml.etree.fromstring(b'<doc><items><item value="1"/><item value="3"/></items></doc>')
+        plan = ruledxml.compile_rules(self.batch_rules(ruledxml.batch(lambda values: [1])))
+        with self.assertRaises(ruledxml.exceptions.InvalidBatchResult):
+            plan.apply(dom)
+
+        rules = {'ruleA': ruledxml.batch(ruledxml.destination('/out/a')(lambda: []))}
+        with self.assertRaises(ruledxml.exceptions.MissingRuleForeach):
+            ruledxml.compile_rules(rules)
+
 
 def run():
     unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import string
+import doctest
+import tempfile
+import itertools
+import unittest
+import multiprocessing
+
+import ruledxml.fs
+
+
+def allocate_many(folder, count):
+    allocator = ruledxml.fs.UniqueFilepaths(folder)
+    return [allocator.allocate('out', '.xml', reserve=True) for _ in range(count)]
+
+
+class TestRuledXmlFs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, *names):
+        for name in names:
+            open(os.path.join(self.tmpdir, name), 'w').close()
+
+    def test_doctest(self):
+        os.mkdir(os.path.join(self.tmpdir, 'target'))
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            failed, _ = doctest.testmod(ruledxml.fs)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(failed, 0)
+
+    def test_candidates(self):
+        allocator = ruledxml.fs.UniqueFilepaths(self.tmpdir, alphabet='ab')
+        variations = (''.join(v) for i in itertools.count(1)
+                      for v in itertools.product('ab', repeat=i))
+        expected = ['x.xml'] + ['x_' + v + '.xml' for v in itertools.islice(variations, 30)]
+        self.assertEqual([allocator.candidate('x', '.xml', i) for i in range(31)], expected)
+
+        allocator = ruledxml.fs.UniqueFilepaths(self.tmpdir)
+        self.assertEqual(allocator.candidate('x', '', 10), 'x_9')
+        self.assertEqual(allocator.candidate('x', '', 11), 'x_00')
+
+    def test_allocate(self):
+        self.touch('out.xml', 'out_0.xml', 'out_1.xml', 'other.xml')
+        allocator = ruledxml.fs.UniqueFilepaths(self.tmpdir)
+
+        filepath = os.path.join(self.tmpdir, 'out_2.xml')
+        self.assertEqual(allocator.allocate('out', '.xml'), filepath)
+        self.assertEqual(allocator.allocate('out', '.xml'), filepath)
+        self.assertFalse(os.path.exists(filepath))
+
+        self.assertEqual(allocator.allocate('out', '.xml', reserve=True), filepath)
+        self.assertTrue(os.path.exists(filepath))
+        self.touch('out_3.xml')
+        self.assertEqual(allocator.allocate('out', '.xml', reserve=True),
+                         os.path.join(self.tmpdir, 'out_4.xml'))
+        self.assertEqual(allocator.allocate('new', '.xml'),
+                         os.path.join(self.tmpdir, 'new.xml'))
+
+    def test_allocate_scanned(self):
+        self.touch('out.xml', *('out_{}.xml'.format(c) for c in string.digits))
+        allocator = ruledxml.fs.UniqueFilepaths(self.tmpdir)
+        allocator.SCAN_AFTER = 2
+        other = ruledxml.fs.UniqueFilepaths(self.tmpdir)
+
+        first = allocator.allocate('out', '.xml', reserve=True)
+        self.assertEqual(first, os.path.join(self.tmpdir, 'out_00.xml'))
+        # files created by others after scanning are skipped
+        self.assertEqual(other.allocate('out', '.xml', reserve=True),
+                         os.path.join(self.tmpdir, 'out_01.xml'))
+        self.assertEqual(allocator.allocate('out', '.xml', reserve=True),
+                         os.path.join(self.tmpdir, 'out_02.xml'))
+
+    def test_create_unique_filepath(self):
+        filepaths = [ruledxml.fs.create_unique_filepath(self.tmpdir, 'a', '.xml', reserve=True)
+                     for _ in range(12)]
+        self.assertEqual(len(set(filepaths)), 12)
+        self.assertEqual(filepaths[11], os.path.join(self.tmpdir, 'a_00.xml'))
+        self.assertEqual(ruledxml.fs.create_unique_filepath(self.tmpdir, 'b'),
+                         os.path.join(self.tmpdir, 'b'))
+
+    def test_concurrent_processes(self):
+        self.touch('out.xml')
+        ctx = multiprocessing.get_context()
+        with ctx.Pool(4) as pool:
+            results = pool.starmap(allocate_many, [(self.tmpdir, 30)] * 4)
+
+        filepaths = [filepath for result in results for filepath in result]
+        self.assertEqual(len(set(filepaths)), 120)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 121)
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
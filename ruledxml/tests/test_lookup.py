@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import ruledxml
+import ruledxml.cache
+import ruledxml.parallel
+
+from . import utils
+
+
+class TestRuledXmlLookup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertTarget(self, plan):
+        result = io.BytesIO()
+        with open(utils.data('041_source.xml'), 'rb') as src:
+            ruledxml.run(src, plan, result)
+        with open(utils.data('041_target.xml'), 'rb') as target:
+            utils.xmlEquals(self, result.getvalue(), target.read())
+
+    def test_lookup_run(self):
+        self.assertTarget(ruledxml.load_plan(utils.data('041_rules.py')))
+
+    def test_lookup_index(self):
+        plan = ruledxml.load_plan(utils.data('041_rules.py'))
+        catalog = plan.lookups['catalog']
+        self.assertEqual(catalog.filepath, os.path.abspath(utils.data('041_catalog.xml')))
+        self.assertEqual(len(catalog), 2)
+        self.assertEqual(catalog['A1'].findtext('name'), 'Apple')
+        self.assertIsNone(catalog.get('C3'))
+        self.assertEqual(plan.lookups['prices'].get('B2'), '2')
+        self.assertEqual(plan.lookups['prices'].get('C3'), '')
+
+    def test_lookup_cache(self):
+        cache = ruledxml.cache.RulesCache(self.tmpdir)
+        for _ in range(2):
+            self.assertTarget(ruledxml.load_plan(utils.data('041_rules.py'), cache=cache))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lookup_workers(self):
+        plan = ruledxml.load_plan(utils.data('041_rules.py'))
+        outputs = [os.path.join(self.tmpdir, '{}.xml'.format(i)) for i in range(3)]
+        with ruledxml.parallel.WorkerPool(plan, 2) as pool:
+            for output in outputs:
+                pool.submit(utils.data('041_source.xml'), output)
+            results = list(pool.results())
+
+        self.assertEqual([r.exitcode for r in results], [0, 0, 0])
+        for output in outputs:
+            with open(output, 'rb') as result:
+                with open(utils.data('041_target.xml'), 'rb') as target:
+                    utils.xmlEquals(self, result.read(), target.read())
+
+    def test_lookup_invalid(self):
+        catalog = (utils.data('041_catalog.xml'), '/catalog/product', '@sku')
+        rule = ruledxml.lookup('catalog', '/order/item@sku')(
+            ruledxml.destination('/invoice/product')(lambda product: 'x'))
+
+        with self.assertRaises(ruledxml.exceptions.InvalidRuleSource):
+            ruledxml.compile_rules({'ruleProduct': rule})
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.compile_rules({'ruleProduct': rule},
+                {'lookup_documents': {'catalog': catalog[:2]}})
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.compile_rules({'ruleProduct': rule},
+                {'lookup_documents': {'catalog': ('missing.xml',) + catalog[1:]}})
+
+        rule = ruledxml.batch(ruledxml.foreach('/order/item', '/invoice/line')(
+            ruledxml.lookup('catalog', '/order/item@sku')(
+                ruledxml.destination('/invoice/line/product')(lambda products: []))))
+        with self.assertRaises(ruledxml.exceptions.InvalidRuleSource):
+            ruledxml.compile_rules({'ruleProduct': rule}, {'lookup_documents': {'catalog': catalog}})
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lxml.etree
+
+import ruledxml
+import ruledxml.parallel
+
+from . import utils
+
+
+SOURCE = b"""<doc><country>at</country><items>
+  <item code="de"/><item code="at"/><item code="de"/><item code="fr"/>
+</items></doc>"""
+EXPECTED = (b'<out><country>AT</country><codes><code>DE</code><code>AT</code>'
+            b'<code>DE</code><code>FR</code></codes></out>')
+
+
+class TestRuledXmlMemoize(unittest.TestCase):
+    def rules(self, maxsize=128):
+        calls = []
+
+        def translate():
+            def rule(code):
+                calls.append(code)
+                return code.upper()
+            return rule
+
+        memoize, foreach = ruledxml.memoize(maxsize=maxsize), ruledxml.foreach
+        source, destination = ruledxml.source, ruledxml.destination
+        rules = {
+            'ruleCountry': memoize(source('/doc/country')(
+                destination('/out/country')(translate()))),
+            'ruleCode': memoize(foreach('/doc/items/item', '/out/codes/code')(
+                source('/doc/items/item@code')(destination('/out/codes/code')(translate()))))
+        }
+        return rules, calls
+
+    def test_memoize_identical(self):
+        rules, calls = self.rules()
+        plan = ruledxml.compile_rules(rules)
+        dom = lxml.etree.fromstring(SOURCE)
+
+        for _ in range(2):
+            target = plan.apply(dom)
+            self.assertEqual(lxml.etree.tostring(target), EXPECTED)
+        self.assertEqual(sorted(calls), ['at', 'at', 'de', 'fr'])
+
+        stats = plan.memoization()
+        self.assertEqual(stats['ruleCountry']['hits'], 1)
+        self.assertEqual(stats['ruleCountry']['misses'], 1)
+        self.assertEqual(stats['ruleCode']['hits'], 5)
+        self.assertEqual(stats['ruleCode']['misses'], 3)
+        self.assertEqual(stats['ruleCode']['size'], 3)
+
+    def test_memoize_eviction(self):
+        rules, calls = self.rules(maxsize=1)
+        plan = ruledxml.compile_rules(rules)
+        plan.apply(lxml.etree.fromstring(SOURCE))
+
+        stats = plan.memoization()['ruleCode']
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (0, 4, 3))
+        self.assertEqual(stats['size'], 1)
+
+    def test_memoize_order(self):
+        rules, calls = self.rules()
+        plan = ruledxml.compile_rules(rules)
+        restored = ruledxml.RulePlan(rules, order=plan.order)
+        restored.apply(lxml.etree.fromstring(SOURCE))
+        self.assertEqual(restored.memoization()['ruleCode']['hits'], 1)
+        self.assertEqual(plan.memoization()['ruleCode']['misses'], 0)
+
+    def test_memoize_invalid(self):
+        rule = ruledxml.memoize(maxsize=-1)(ruledxml.destination('/out/a')(lambda: 'a'))
+        with self.assertRaises(ruledxml.exceptions.InvalidRuleMemoize):
+            ruledxml.compile_rules({'ruleA': rule})
+
+        rule = ruledxml.foreach('/doc/items/item', '/out/code')(
+            ruledxml.destination('/out/code')(lambda: []))
+        rule = ruledxml.memoize(ruledxml.batch(rule))
+        with self.assertRaises(ruledxml.exceptions.InvalidRuleMemoize):
+            ruledxml.compile_rules({'ruleA': rule})
+
+    def test_memoize_workers(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            rules = {'ruleName': ruledxml.memoize(ruledxml.source('name')(
+                ruledxml.destination('/person/name')(lambda name: name[0])))}
+            plan = ruledxml.compile_rules(rules)
+            with open(utils.data('040_source.xml')) as src:
+                elements = ruledxml.xml.read(src).xpath('/xml/record') * 2
+            outs = [os.path.join(tmpdir, '{}.xml'.format(i)) for i in range(6)]
+            ruledxml.parallel.batch_elements(plan, elements, outs, 2, chunksize=1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        stats = plan.memoization()['ruleName']
+        self.assertEqual(stats['hits'] + stats['misses'], 6)
+        self.assertGreaterEqual(stats['misses'], 3)
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ruledxml
+import ruledxml.cache
+import ruledxml.parallel
+
+from . import utils
+
+
+class TestRuledXmlParallel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_worker_pool(self):
+        jobs = {}
+        with ruledxml.parallel.WorkerPool(utils.data('026_rules.py'), 2) as pool:
+            for i in range(4):
+                output = os.path.join(self.tmpdir, '{}.xml'.format(i))
+                jobs[pool.submit(utils.data('026_source.xml'), output)] = output
+            invalid = os.path.join(self.tmpdir, 'invalid.xml')
+            jobs[pool.submit(utils.data('026_rules.py'), invalid)] = None
+
+            results = list(pool.results())
+
+        self.assertEqual(len(results), 5)
+        for result in results:
+            if jobs[result.job_id] is None:
+                self.assertEqual(result.exitcode, 1)
+                self.assertIn('Traceback', result.error)
+                continue
+
+            self.assertEqual(result.exitcode, 0)
+            with open(result.output, 'rb') as output:
+                with open(utils.data('026_target.xml'), 'rb') as target:
+                    utils.xmlEquals(self, output.read(), target.read())
+
+    def test_worker_pool_result_cache(self):
+        results = ruledxml.cache.ResultCache(os.path.join(self.tmpdir, 'results'))
+        with ruledxml.parallel.WorkerPool(utils.data('026_rules.py'), 2, results=results) as pool:
+            for i in range(3):
+                pool.submit(utils.data('026_source.xml'), os.path.join(self.tmpdir, '{}.xml'.format(i)))
+                self.assertEqual(pool.result().exitcode, 0)
+            counters = pool.result_cache()
+
+        self.assertEqual(counters, {'hits': 2, 'misses': 1, 'evictions': 0})
+        with open(os.path.join(self.tmpdir, '2.xml'), 'rb') as output:
+            with open(utils.data('026_target.xml'), 'rb') as target:
+                utils.xmlEquals(self, output.read(), target.read())
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
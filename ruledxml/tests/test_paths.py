@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import unittest
+import lxml.etree
+
+import ruledxml
+from ruledxml import paths
+
+
+DOCUMENT = b"""<?xml version="1.0"?>
+<root>
+  <a><b>first</b></a>
+  <a><b x="1">second</b><b x="2">third</b></a>
+  <c y="3"><d/></c>
+</root>"""
+
+
+class TestRuledXmlPaths(unittest.TestCase):
+    def setUp(self):
+        self.dom = lxml.etree.fromstring(DOCUMENT)
+
+    def test_compile_cached(self):
+        self.assertIs(paths.compile_path('/root/a/b'), paths.compile_path('/root/a/b'))
+        compiled = paths.compile_path('/root/c@y')
+        self.assertIs(paths.compile_path(compiled), compiled)
+        self.assertEqual(compiled.names, ('root', 'c'))
+        self.assertEqual(compiled.attribute, 'y')
+
+    def test_simple_equals_xpath(self):
+        for path in ['/root/a/b', '/root/a', '/root', '/root/c/d',
+                     '/root/a/b/@x', 'a/b', 'c/@y', '/other/a', '@missing']:
+            compiled = paths.compile_path(path)
+            self.assertTrue(compiled.simple)
+            self.assertEqual(compiled.select(self.dom), self.dom.xpath(path))
+            self.assertEqual(compiled.exists(self.dom), bool(self.dom.xpath(path)))
+
+    def test_first(self):
+        tests = {
+            '/root/a/b': 'first', '/root/a/b@x': '1', '/root/c@y': '3',
+            '/root/a[2]/b[2]': 'third', '/root/missing': '', '': ''
+        }
+        for path, expect in tests.items():
+            self.assertEqual(ruledxml.xml.read_source(self.dom, path), expect)
+        self.assertFalse(paths.compile_path('/root/a[2]/b').simple)
+
+    def test_split_last(self):
+        parent, last = paths.compile_path('/root/a/b').split_last()
+        self.assertEqual(str(parent), '/root/a')
+        self.assertEqual(last.name, 'b')
+        with self.assertRaises(ruledxml.exceptions.InvalidPathException):
+            paths.compile_path('/root/a@b').split_last()
+
+    def test_trie_equals_paths(self):
+        dom = lxml.etree.fromstring(b"""<root>
+          <!-- comment --><a><b/></a><a><b x="">text</b></a>
+          <n:a xmlns:n="urn:n"><b>namespaced</b></n:a>
+        </root>""")
+        tests = ['/root/a/b', '/root/a/b@x', '/root/a/b/@x', '/root/a', '/root',
+                 '/root/missing', '/other', 'a/b', 'a/@x', '@x', '/root/a[2]/b',
+                 '//b', '', '/root/a/b', '/root/a/b/c']
+        for doc in (dom, self.dom):
+            trie = paths.PathTrie(tests)
+            resolved = trie.resolve(doc)
+            for path in tests:
+                compiled = paths.compile_path(path)
+                self.assertEqual(resolved.first(path), compiled.first(doc), path)
+                self.assertEqual(resolved.exists(path), compiled.exists(doc), path)
+            self.assertEqual(resolved.first('/root/c@y'),
+                             paths.compile_path('/root/c@y').first(doc))
+
+    def test_trie_single_walk(self):
+        trie = paths.PathTrie(['/root/a/b', '/root/a/b@x', '/root/c@y', '/root/c/d'])
+        self.assertEqual(len(trie), 4)
+        self.assertEqual(len(trie._nodes), 2 + 5)
+
+        resolved = trie.resolve(self.dom)
+        self.assertEqual(resolved.values, ['first', '1', '3', ''])
+        self.assertTrue(resolved.exists('/root/c/d'))
+
+    def test_trie_shared_with_checks(self):
+        rules = {'ruleA': ruledxml.destination('/out/a')(ruledxml.source('/root/a/b')(lambda b: b))}
+        plan = ruledxml.compile_rules(rules, {
+            'input_required': {'/root/c@y'}, 'input_nonempty': {'/root/a/b'}})
+        resolved = plan.resolve(self.dom)
+        self.assertEqual(len(resolved.trie), 2)
+        plan.check_input(self.dom, resolved=resolved)
+        target = plan.apply(self.dom, resolved=resolved)
+        self.assertEqual(target.find('a').text, 'first')
+
+        plan = ruledxml.compile_rules(rules, {'input_required': {'/root/c@z'}})
+        with self.assertRaises(ruledxml.exceptions.InvalidPathException):
+            plan.check_input(self.dom)
+
+    def test_reachable(self):
+        tree = paths.reachable(['/root/a/b', '/root/a/b@x', '/root/c@y', '',
+                                '/root/d/*/e', '/root/d/f', '/root/g/text()'])
+        self.assertEqual(tree, {'root': {'a': {'b': {}}, 'c': {},
+            'd': paths.SUBTREE, 'g': paths.SUBTREE}})
+
+        for unbounded in ['//b', 'a/b', '/root/a/../c', '/root/a[/root/c]', '/*']:
+            self.assertIsNone(paths.reachable(['/root/a', unbounded]), unbounded)
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ruledxml
+import ruledxml.parallel
+import ruledxml.pipeline
+
+from . import utils
+
+
+class TestRuledXmlPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertTarget(self, filepath):
+        with open(filepath, 'rb') as output:
+            with open(utils.data('026_target.xml'), 'rb') as target:
+                utils.xmlEquals(self, output.read(), target.read())
+
+    def test_pipeline(self):
+        files = [(utils.data('026_source.xml'), os.path.join(self.tmpdir, '{}.xml'.format(i)))
+                 for i in range(5)]
+        files.insert(2, (utils.data('026_rules.py'), os.path.join(self.tmpdir, 'invalid.xml')))
+
+        pipeline = ruledxml.pipeline.Pipeline(utils.data('026_rules.py'), depth=1)
+        results = list(pipeline.run(iter(files)))
+
+        self.assertEqual([result.job_id for result in results], list(range(6)))
+        for result, (source, output) in zip(results, files):
+            self.assertEqual((result.source, result.output), (source, output))
+            if source.endswith('.py'):
+                self.assertEqual(result.exitcode, 1)
+                self.assertIn('Traceback', result.error)
+                self.assertFalse(os.path.exists(output))
+            else:
+                self.assertEqual(result.exitcode, 0)
+                self.assertTarget(output)
+
+        utilisation = results[-1].pipeline
+        self.assertEqual(utilisation['files'], 6)
+        self.assertEqual(set(utilisation['stages']), set(ruledxml.pipeline.STAGES))
+        self.assertLessEqual(utilisation['queues']['parsed']['max'], 1)
+        line = ruledxml.pipeline.report(utilisation)
+        self.assertTrue(line.startswith('6 files in'))
+        self.assertIn('parsed avg', line)
+
+    def test_pipeline_failing_files(self):
+        def files():
+            yield utils.data('026_source.xml'), os.path.join(self.tmpdir, 'first.xml')
+            raise OSError('listing failed')
+
+        pipeline = ruledxml.pipeline.Pipeline(utils.data('026_rules.py'))
+        results = []
+        with self.assertRaises(OSError):
+            for result in pipeline.run(files()):
+                results.append(result)
+        self.assertEqual([result.exitcode for result in results], [0])
+
+    def test_worker_pool_pipeline(self):
+        with ruledxml.parallel.WorkerPool(utils.data('026_rules.py'), 2, pipeline=2) as pool:
+            jobs = {pool.submit(utils.data('026_source.xml'),
+                                os.path.join(self.tmpdir, '{}.xml'.format(i))): i
+                    for i in range(6)}
+            results = list(pool.results())
+            utilisation = pool.pipeline()
+
+        self.assertEqual(sorted(result.job_id for result in results), sorted(jobs))
+        for result in results:
+            self.assertEqual(result.exitcode, 0)
+            self.assertEqual(result.output, os.path.join(self.tmpdir,
+                '{}.xml'.format(jobs[result.job_id])))
+            self.assertTarget(result.output)
+        self.assertEqual(sum(values['files'] for values in utilisation.values()), 6)
+
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.parallel.WorkerPool(utils.data('026_rules.py'), 1,
+                pipeline=2, update=True)
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
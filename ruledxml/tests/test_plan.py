@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import logging
+import tempfile
+import unittest
+
+import ruledxml
+
+from . import utils
+
+
+class TestRuledXmlPlan(unittest.TestCase):
+    def test_plan_reuse(self):
+        plan = ruledxml.load_plan(utils.data('026_rules.py'))
+        for _ in range(3):
+            result = io.BytesIO()
+            with open(utils.data('026_source.xml')) as src:
+                ruledxml.run(src, plan, result)
+            with open(utils.data('026_target.xml'), 'rb') as target:
+                utils.xmlEquals(self, result.getvalue(), target.read())
+
+        timing = plan.timing()
+        self.assertEqual(timing['applications'], 3)
+        self.assertGreaterEqual(timing['compile_time'], 0.0)
+
+    def test_plan_immutable(self):
+        plan = ruledxml.load_plan(utils.data('031_rules.py'))
+        self.assertIsInstance(plan.classified, tuple)
+        with self.assertRaises(TypeError):
+            plan.meta['output_encoding'] = 'latin-1'
+        with self.assertRaises(AttributeError):
+            plan.foo = 42
+
+    def test_run_many(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            failing = os.path.join(tmpdir, 'failing_rules.py')
+            with open(utils.data('026_rules.py')) as src, open(failing, 'w') as dst:
+                dst.write(src.read() + '\ninput_required = ["/missing"]\n')
+
+            plan = ruledxml.load_plan(utils.data('026_rules.py'))
+            rules = [plan, utils.data('026_rules.py'), failing]
+            for processes in (None, 2):
+                outputs = [io.BytesIO() for _ in rules]
+                with open(utils.data('026_source.xml'), 'rb') as src:
+                    with self.assertLogs(level=logging.ERROR) as logs:
+                        exitcodes = ruledxml.run_many(src, list(zip(rules, outputs)),
+                            processes=processes)
+
+                self.assertEqual(exitcodes, [0, 0, 1])
+                self.assertIn('/missing', logs.output[0])
+                self.assertEqual(outputs[2].getvalue(), b'')
+                for output in outputs[:2]:
+                    with open(utils.data('026_target.xml'), 'rb') as target:
+                        utils.xmlEquals(self, output.getvalue(), target.read())
+
+        self.assertEqual(ruledxml.run_many(io.BytesIO(b'<xml/>'), []), [])
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
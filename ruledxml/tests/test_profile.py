@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import lxml.etree
+
+import ruledxml
+import ruledxml.profiling
+
+from . import utils
+
+
+class TestRuledXmlProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_profile_run(self):
+        profile = ruledxml.profiling.Profile()
+        result = io.BytesIO()
+        with open(utils.data('041_source.xml'), 'rb') as src:
+            ruledxml.run(src, utils.data('041_rules.py'), result, profile=profile)
+        with open(utils.data('041_target.xml'), 'rb') as target:
+            utils.xmlEquals(self, result.getvalue(), target.read())
+
+        data = profile.as_dict()
+        self.assertEqual(list(data['phases']), ['load', 'read', 'resolve',
+                                                'check_input', 'apply', 'write'])
+        self.assertEqual(data['rules']['ruleProduct']['calls'], 3)
+        self.assertEqual(data['rules']['ruleTotal']['calls'], 3)
+        self.assertEqual(data['paths'], {'sources': 9, 'destinations': 6, 'iterations': 1})
+        for entry in data['rules'].values():
+            self.assertLessEqual(entry['max'], entry['total'])
+
+        self.assertEqual(json.loads(json.dumps(data)), data)
+        table = profile.table()
+        self.assertIn('ruleProduct', table)
+        self.assertIn('9 sources, 6 destinations, 1 iterations', table)
+
+    def test_profile_batch_run(self):
+        outs = [os.path.join(self.tmpdir, '{}.xml'.format(i)) for i in range(3)]
+        for processes in (None, 2):
+            profile = ruledxml.profiling.Profile()
+            with open(utils.data('040_source.xml')) as src:
+                ruledxml.batch_run(src, utils.data('040_rules.py'), outs, '/xml/record',
+                    processes=processes, profile=profile)
+
+            data = profile.as_dict()
+            self.assertEqual(data['rules']['ruleName']['calls'], 3)
+            self.assertEqual(data['phases']['apply']['calls'], 3)
+            self.assertEqual(data['phases']['load']['calls'], 1)
+
+    def test_profile_paths(self):
+        dom = lxml.etree.fromstring(b"""<doc><title>t</title><lang>en</lang><items>
+          <item value="1"><name>a</name></item>
+          <item value="2"><name>b</name></item>
+          <item value="3"><name>c</name></item>
+        </items></doc>""")
+        foreach, source, destination = ruledxml.foreach, ruledxml.source, ruledxml.destination
+        rules = {
+            'ruleHeader': source('/doc/title')(source('/doc/lang')(
+                destination('/out@header')(lambda title, lang: title + lang))),
+            'ruleName': foreach('/doc/items/item', '/out/entry')(
+                source('/doc/items/item/name')(destination('/out/entry/name')(
+                    lambda name: name.upper()))),
+            'ruleValue': foreach('/doc/items/item', '/out/entry')(
+                source('/doc/items/item@value')(destination('/out/entry@value', order=1)(
+                    ruledxml.batch(numpy=False)(lambda values: values))))
+        }
+
+        profile = ruledxml.profiling.Profile()
+        ruledxml.compile_rules(rules).apply(dom, profile=profile)
+        self.assertEqual(profile.rules['ruleValue']['calls'], 1)
+        # two resolved paths of ruleHeader, three names, three values of the @batch column
+        self.assertEqual(profile.paths, {'sources': 8, 'destinations': 7, 'iterations': 1})
+
+    def test_profile_merge(self):
+        profile = ruledxml.profiling.Profile()
+        other = {
+            'phases': {'read': {'calls': 2, 'total': 0.5, 'max': 0.3}},
+            'rules': {'ruleA': {'calls': 1, 'total': 0.1, 'max': 0.1}},
+            'paths': {'sources': 4, 'destinations': 1, 'iterations': 0}
+        }
+        profile.merge(other)
+        profile.merge(other)
+        data = profile.as_dict()
+        self.assertEqual(data['phases']['read'], {'calls': 4, 'total': 1.0, 'max': 0.3})
+        self.assertEqual(data['paths']['sources'], 8)
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
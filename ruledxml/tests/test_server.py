@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+
+import ruledxml
+import ruledxml.client
+import ruledxml.server
+
+from . import utils
+
+
+class TestRuledXmlServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket = os.path.join(self.tmpdir, 'ruledxml.sock')
+        self.rules = os.path.join(self.tmpdir, 'rules.py')
+        shutil.copy(utils.data('026_rules.py'), self.rules)
+
+        self.server = ruledxml.server.Server(self.socket)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, rules):
+        result = io.BytesIO()
+        with open(utils.data('026_source.xml'), 'rb') as src:
+            ruledxml.run(src, rules, result)
+        return result.getvalue()
+
+    def test_transform(self):
+        expected = self.expected(self.rules)
+        output = os.path.join(self.tmpdir, 'target.xml')
+        with ruledxml.client.Client(self.socket) as client:
+            response = client.transform(self.rules, utils.data('026_source.xml'),
+                output=output)
+            self.assertEqual(response.exitcode, 0)
+            self.assertEqual(response.error, '')
+            with open(output, 'rb') as fp:
+                self.assertEqual(fp.read(), expected)
+
+            with open(utils.data('026_source.xml'), 'rb') as fp:
+                response = client.transform(self.rules, data=fp.read())
+            self.assertEqual(response.data, expected)
+
+        self.assertEqual(self.server.plans.loads, 1)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_reload(self):
+        with ruledxml.client.Client(self.socket) as client:
+            client.transform(self.rules, utils.data('026_source.xml'))
+
+            # touching the rules file does not recompile it
+            os.utime(self.rules, ns=(0, 0))
+            client.transform(self.rules, utils.data('026_source.xml'))
+            self.assertEqual(self.server.plans.loads, 1)
+
+            with open(self.rules) as fp:
+                rules = fp.read()
+            with open(self.rules, 'w') as fp:
+                fp.write(rules.replace('text-indent:5px', 'text-indent:9px'))
+            response = client.transform(self.rules, utils.data('026_source.xml'))
+            self.assertEqual(self.server.plans.loads, 2)
+
+        self.assertIn(b'text-indent:9px', response.data)
+        self.assertNotIn(b'text-indent:5px', response.data)
+
+    def test_concurrent(self):
+        expected = self.expected(self.rules)
+        responses = []
+
+        def work():
+            with ruledxml.client.Client(self.socket) as client:
+                for _ in range(5):
+                    responses.append(client.transform(self.rules,
+                        utils.data('026_source.xml')))
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(responses), 20)
+        for response in responses:
+            self.assertEqual(response.data, expected)
+        self.assertEqual(self.server.requests, 20)
+        self.assertEqual(self.server.plans.get(self.rules).timing()['applications'], 20)
+
+    def test_error(self):
+        with ruledxml.client.Client(self.socket) as client:
+            response = client.transform(self.rules, os.path.join(self.tmpdir, 'missing.xml'))
+            self.assertEqual(response.exitcode, 1)
+            self.assertIn('missing.xml', response.error)
+
+            # the connection is still usable
+            response = client.transform(self.rules, utils.data('026_source.xml'))
+            self.assertEqual(response.exitcode, 0)
+
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.client.Client(self.socket).transform(self.rules)
+
+    def test_socket_in_use(self):
+        with self.assertRaises(ruledxml.exceptions.RuledXmlException):
+            ruledxml.server.Server(self.socket)
+
+
+def run():
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+import ruledxml
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NEW_MODULES = '''
+import sys, json
+before = set(sys.modules)
+{}
+print(json.dumps(sorted(set(sys.modules) - before)))
+'''
+
+
+def imported_modules(code):
+    """Modules newly imported by `code` in a new interpreter"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', NEW_MODULES.format(code)],
+        env=env, universal_newlines=True)
+    return set(json.loads(output))
+
+
+class TestRuledXmlStartup(unittest.TestCase):
+    def test_import_is_lazy(self):
+        modules = imported_modules('import ruledxml')
+        self.assertIn('ruledxml.decorators', modules)
+        for name in ['ruledxml.core', 'lxml.etree', 'argparse', 'pathlib']:
+            self.assertNotIn(name, modules)
+
+    def test_hot_path(self):
+        modules = imported_modules('import ruledxml; ruledxml.run')
+        self.assertIn('ruledxml.core', modules)
+        for name in ['ruledxml.cache', 'ruledxml.parallel', 'argparse',
+                     'pathlib', 'shutil', 'tempfile', 'multiprocessing']:
+            self.assertNotIn(name, modules)
+
+    def test_lazy_names(self):
+        self.assertIs(ruledxml.run, ruledxml.core.run)
+        self.assertIs(ruledxml.read_source_xml, ruledxml.xml.read)
+        for name in ruledxml.__all__:
+            self.assertTrue(hasattr(ruledxml, name), name)
+        self.assertIn('load_plan', dir(ruledxml))
+        with self.assertRaises(AttributeError):
+            ruledxml.does_not_exist
+
+
+def run():
+    unittest.main()
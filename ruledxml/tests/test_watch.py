@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import ruledxml.watch
+
+
+class TestRuledXmlWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content=b'<xml/>'):
+        filepath = os.path.join(self.tmpdir, name)
+        with open(filepath, 'wb') as fp:
+            fp.write(content)
+        return filepath
+
+    def collect(self, watcher, count, timeout=2.0):
+        files = []
+        deadline = time.monotonic() + timeout
+        while len(files) < count and time.monotonic() < deadline:
+            files.extend(watcher.wait(0.05))
+        return files
+
+    def check_watcher(self, watcher):
+        existing = self.write('existing.xml')
+        self.assertEqual(watcher.existing(), [existing])
+
+        new = self.write('new.xml')
+        hidden = self.write('.new.xml.tmp')
+        moved = os.path.join(self.tmpdir, 'moved.xml')
+        os.rename(hidden, moved)
+        self.assertEqual(sorted(self.collect(watcher, 2)), [moved, new])
+
+        # modified files are reported again, unmodified ones are not
+        self.write('new.xml', b'<xml>modified</xml>')
+        self.assertEqual(self.collect(watcher, 1), [new])
+        self.assertEqual(self.collect(watcher, 1, timeout=0.3), [])
+
+    def test_polling(self):
+        with ruledxml.watch.PollingWatcher([self.tmpdir], interval=0.05) as watcher:
+            self.check_watcher(watcher)
+
+    def test_inotify(self):
+        try:
+            watcher = ruledxml.watch.InotifyWatcher([self.tmpdir])
+        except OSError as e:
+            self.skipTest(str(e))
+        with watcher:
+            self.check_watcher(watcher)
+
+    def test_polling_incomplete(self):
+        with ruledxml.watch.PollingWatcher([self.tmpdir], interval=0.05) as watcher:
+            watcher.existing()
+            filepath = self.write('growing.xml', b'<xml>')
+            self.assertEqual(watcher.wait(0), [])
+            with open(filepath, 'ab') as fp:
+                fp.write(b'</xml>')
+            self.assertEqual(self.collect(watcher, 1), [filepath])
+
+    def test_abstract(self):
+        class Incomplete(ruledxml.watch.Watcher):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete([self.tmpdir])
+
+    def test_throughput(self):
+        throughput = ruledxml.watch.Throughput()
+        throughput.record(time.monotonic() - 1.0)
+        throughput.record(time.monotonic(), exitcode=1)
+        line = throughput.report(pending=3)
+        self.assertIn('2 files in', line)
+        self.assertIn('2 total, 1 failed, 3 pending', line)
+        self.assertTrue(throughput.report().startswith('0 files'))
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
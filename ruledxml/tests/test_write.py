@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+import threading
+import unittest
+import lxml.etree
+
+import ruledxml
+
+from . import utils
+
+
+class TestRuledXmlWrite(unittest.TestCase):
+    def test_incremental_identical(self):
+        for number in ['002', '003', '011', '012', '021', '022',
+                       '023', '024', '025', '026', '030', '031']:
+            outputs = []
+            for incremental in (False, True):
+                result = io.BytesIO()
+                with open(utils.data(number + '_source.xml')) as src:
+                    ruledxml.run(src, utils.data(number + '_rules.py'), result,
+                        incremental=incremental)
+                outputs.append(result.getvalue())
+            self.assertEqual(outputs[0], outputs[1], number)
+
+    def test_early_flush(self):
+        class Recorder(io.BytesIO):
+            def __init__(self):
+                super().__init__()
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(data)
+                return super().write(data)
+
+        plan = ruledxml.load_plan(utils.data('031_rules.py'))
+        with open(utils.data('031_source.xml')) as src:
+            dom = ruledxml.xml.read(src)
+
+        result = Recorder()
+        writer = ruledxml.xml.IncrementalWriter(result)
+        target = plan.apply(dom, writer=writer)
+        self.assertEqual(writer.written, 4)
+        self.assertEqual(len(target), 0)
+        writer.close(target)
+
+        self.assertEqual(len(result.chunks), 6)
+        with open(utils.data('031_target.xml'), 'rb') as target:
+            utils.xmlEquals(self, result.getvalue(), target.read())
+
+    def test_flush_forgets_subtrees(self):
+        index = ruledxml.xml.TargetIndex()
+        writer = ruledxml.xml.IncrementalWriter(io.BytesIO())
+        dom = None
+        for i in range(200):
+            dom = ruledxml.xml.write_destination(dom, '/out/g{:04d}/a/b'.format(i),
+                str(i), index=index)
+            writer.flush(dom)
+            index.forget(dom)
+            self.assertLessEqual(len(index), 1)
+        self.assertEqual(len(dom), 0)
+        writer.close(dom)
+
+    def test_namespaces(self):
+        dom = lxml.etree.Element('{urn:doc}doc', nsmap={None: 'urn:doc', 'x': 'urn:x'})
+        for name in ('a', 'b'):
+            child = lxml.etree.SubElement(dom, name, nsmap=dom.nsmap)
+            child.set('{urn:x}attr', name)
+        expect = lxml.etree.tostring(dom, xml_declaration=True,
+            pretty_print=True, encoding='utf-8')
+
+        result = io.BytesIO()
+        ruledxml.xml.write(dom, result, incremental=True)
+        self.assertEqual(result.getvalue(), expect)
+
+    def test_read(self):
+        content = b'<?xml version="1.0"?>\n<doc>\n  <!-- note -->\n  <a>1</a>\n</doc>\n'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir, 'source.xml')
+            with open(filepath, 'wb') as fp:
+                fp.write(content)
+            with open(filepath) as textfd, open(filepath, 'rb') as binaryfd:
+                sources = [filepath, textfd, binaryfd, content, io.BytesIO(content)]
+                roots = [ruledxml.xml.read(src) for src in sources]
+
+        for root in roots:
+            # blank text and comments are kept by default
+            self.assertTrue(root.text.isspace())
+            self.assertEqual(len(root), 2)
+            self.assertEqual(root.findtext('a'), '1')
+        stripped = ruledxml.xml.read(content, remove_comments=True, remove_blank_text=True)
+        self.assertEqual([e.tag for e in stripped], ['a'])
+        self.assertIsNone(stripped.text)
+
+    def test_read_pruned(self):
+        content = (b'<doc><head><title>T</title><blob>AAAA</blob></head>text'
+                   b'<blob>BBBB</blob>tail<item id="1"><name>a</name><log><e/></log></item>'
+                   b'<item id="2"><log/><name>b</name></item><x:item xmlns:x="urn:x"/></doc>')
+        plan = ruledxml.compile_rules({
+            'ruleTitle': ruledxml.destination('/out/title')(
+                ruledxml.source('/doc/head/title')(lambda t: t)),
+            'ruleName': ruledxml.destination('/out/name')(
+                ruledxml.source('/doc/item/name')(lambda n: n))
+        }, {'input_required': {'/doc/item@id'}})
+        self.assertEqual(plan.reachable,
+            {'doc': {'head': {'title': {}}, 'item': {'name': {}}}})
+
+        for source in (content, io.BytesIO(content)):
+            root = ruledxml.xml.read(source, reachable=plan.reachable)
+            self.assertEqual(lxml.etree.tostring(root),
+                b'<doc><head><title>T</title></head>text<item id="1"><name>a</name></item>'
+                b'<item id="2"><name>b</name></item></doc>')
+
+        results = []
+        for prune in (False, True):
+            result = io.BytesIO()
+            ruledxml.run(io.BytesIO(content), plan, result, prune=prune)
+            results.append(result.getvalue())
+        self.assertEqual(results[0], results[1])
+
+    def test_parser_reuse(self):
+        self.assertIs(ruledxml.xml.parser(), ruledxml.xml.parser())
+        self.assertIsNot(ruledxml.xml.parser(), ruledxml.xml.parser(remove_comments=True))
+
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(ruledxml.xml.parser()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(parsers[0], ruledxml.xml.parser())
+
+    def test_parser_options(self):
+        meta = {'input_required': [], 'input_nonempty': []}
+        rule = {'class': 'basicrule', 'name': 'rule', 'src': ['/doc/a'], 'dst': ['/out/a']}
+        self.assertEqual(ruledxml.core.parser_options([rule], meta),
+            {'remove_blank_text': False, 'remove_comments': True, 'remove_pis': True})
+
+        rule['src'] = ['/doc/comment()']
+        meta['input_remove_blank_text'] = True
+        self.assertEqual(ruledxml.core.parser_options([rule], meta),
+            {'remove_blank_text': True, 'remove_comments': False, 'remove_pis': True})
+
+
+def run():
+    unittest.main()
+
+if __name__ == '__main__':
+    run()
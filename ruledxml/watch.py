@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+"""
+    ruledxml.watch
+    --------------
+
+    Detection of new files in source directories for long-running
+    batch processing.
+
+    On Linux, `InotifyWatcher` uses inotify (via ctypes) and reports a
+    file as soon as it was closed after writing or moved into a watched
+    directory. Elsewhere, `PollingWatcher` scans the directories regularly
+    and reports a file once its size and modification time did not change
+    between two scans. Use `watcher` to get the best available one.
+
+    `Throughput` measures how many files were processed and how long
+    it took from detection of a file until its output was written.
+
+    (C) 2015, meisterluk, BSD 3-clause license
+"""
+
+import os
+import abc
+import time
+import select
+import struct
+import logging
+
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+EVENT = struct.Struct('iIII')
+
+
+def signature(filepath: str):
+    """Return modification time and size of a regular file or None"""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    if not os.path.isfile(filepath):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def listing(directories: list) -> dict:
+    """Return the signatures of all regular files in `directories`.
+    Hidden files (eg. temporary files of editors) are skipped.
+
+    :param directories:     directories to scan
+    :type directories:      list
+    :return:                filepaths associated to their `signature`
+    :rtype:                 dict
+    """
+    files = {}
+    for directory in directories:
+        try:
+            with os.scandir(directory) as it:
+                for dirent in it:
+                    if dirent.name.startswith('.') or not dirent.is_file():
+                        continue
+                    try:
+                        stat = dirent.stat()
+                    except FileNotFoundError:
+                        continue
+                    files[dirent.path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            logging.warning('Directory %s to watch does not exist', directory)
+    return files
+
+
+class Watcher(abc.ABC):
+    """Base class of watchers. A file is reported again
+    if it was modified after it has been reported.
+    Subclasses implement `wait`.
+    """
+
+    def __init__(self, directories: list):
+        """Watch `directories`.
+
+        :param directories:     directories to watch (not recursively)
+        :type directories:      list
+        """
+        self.directories = list(directories)
+        self._reported = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def existing(self) -> list:
+        """Return all files, which currently exist in the directories.
+
+        :return:        filepaths in alphabetical order
+        :rtype:         list
+        """
+        return self._report(listing(self.directories))
+
+    @abc.abstractmethod
+    def wait(self, timeout: float) -> list:
+        """Wait at most `timeout` seconds and return files,
+        which were completely written in the meantime.
+
+        :param timeout:     seconds to wait at most
+        :type timeout:      float
+        :return:            filepaths in alphabetical order
+        :rtype:             list
+        """
+
+    def close(self):
+        """Stop watching"""
+
+    def _report(self, files: dict) -> list:
+        """Filter out files reported before with the same signature"""
+        new = []
+        for filepath, sig in sorted(files.items()):
+            if sig is not None and self._reported.get(filepath) != sig:
+                self._reported[filepath] = sig
+                new.append(filepath)
+        return new
+
+
+class PollingWatcher(Watcher):
+    """Watcher scanning directories every `interval` seconds"""
+
+    def __init__(self, directories: list, interval=1.0):
+        """Watch `directories`.
+
+        :param directories:     directories to watch (not recursively)
+        :type directories:      list
+        :param interval:        seconds between two scans
+        :type interval:         float
+        """
+        super().__init__(directories)
+        self.interval = interval
+        self._previous = {}
+        self._next = time.monotonic()
+
+    def wait(self, timeout: float) -> list:
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now >= self._next:
+                self._next = now + self.interval
+                current = listing(self.directories)
+                settled = {filepath: sig for filepath, sig in current.items()
+                           if self._previous.get(filepath) == sig}
+                self._previous = current
+                new = self._report(settled)
+                if new:
+                    return new
+            if now >= deadline:
+                return []
+            time.sleep(max(0.0, min(self._next, deadline) - now))
+
+
+class InotifyWatcher(Watcher):
+    """Watcher using the inotify API of Linux"""
+
+    def __init__(self, directories: list):
+        """Watch `directories`.
+
+        :param directories:     directories to watch (not recursively)
+        :type directories:      list
+        :raises OSError:        inotify is not available
+        """
+        super().__init__(directories)
+        self._libc = libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes_errno(), 'inotify_init1 failed')
+
+        self._watches = {}
+        for directory in self.directories:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                errno = ctypes_errno()
+                os.close(self._fd)
+                raise OSError(errno, 'Cannot watch {}: {}'.format(directory, os.strerror(errno)))
+            self._watches[wd] = directory
+
+    def wait(self, timeout: float) -> list:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        files = {}
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logging.warning('inotify queue overflowed; rescanning directories')
+                files.update(listing(self.directories))
+            elif wd in self._watches and name and not name.startswith(b'.'):
+                filepath = os.path.join(self._watches[wd], os.fsdecode(name))
+                files[filepath] = signature(filepath)
+
+        return self._report(files)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def libc():
+    """Load the C library with inotify functions.
+
+    :return:            the C library
+    :rtype:             ctypes.CDLL
+    :raises OSError:    inotify is not available
+    """
+    import ctypes
+    import ctypes.util
+
+    name = ctypes.util.find_library('c')
+    if name is None:
+        raise OSError('C library not found')
+    lib = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(lib, 'inotify_init1'):
+        raise OSError('inotify is not available')
+    return lib
+
+
+def ctypes_errno() -> int:
+    """Return errno of the last call through ctypes"""
+    import ctypes
+    return ctypes.get_errno()
+
+
+def watcher(directories: list, *, interval=1.0, polling=False) -> Watcher:
+    """Return an `InotifyWatcher` if inotify is available (and `polling`
+    is not set). Otherwise return a `PollingWatcher`.
+
+    :param directories:     directories to watch (not recursively)
+    :type directories:      list
+    :param interval:        seconds between two scans when polling
+    :type interval:         float
+    :param polling:         always use polling
+    :type polling:          bool
+    :return:                the watcher
+    :rtype:                 Watcher
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            logging.info('Using polling, inotify is not available: %s', e)
+    return PollingWatcher(directories, interval)
+
+
+class Throughput:
+    """Counts processed files and their latency in a reporting period"""
+
+    def __init__(self):
+        self.total = 0
+        self.failures = 0
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float):
+        self._start = now
+        self._count = 0
+        self._latency = 0.0
+        self._max = 0.0
+
+    def record(self, detected: float, exitcode=0):
+        """Record a processed file.
+
+        :param detected:    `time.monotonic` when the file was detected
+        :type detected:     float
+        :param exitcode:    exit code of the job
+        :type exitcode:     int
+        """
+        latency = time.monotonic() - detected
+        self.total += 1
+        self.failures += exitcode != 0
+        self._count += 1
+        self._latency += latency
+        self._max = max(self._max, latency)
+
+    def due(self, interval: float) -> bool:
+        """Did the current period last for at least `interval` seconds?"""
+        return time.monotonic() - self._start >= interval
+
+    def report(self, pending=0) -> str:
+        """Format the statistics of the current period as one line
+        of text and start a new period.
+
+        :param pending:     number of files currently processed
+        :type pending:      int
+        :return:            the statistics
+        :rtype:             str
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._start, 1e-9)
+        template = ('{} files in {:.1f}s ({:.2f} files/s), latency avg {:.3f}s max {:.3f}s; '
+                    '{} total, {} failed, {} pending')
+        line = template.format(self._count, elapsed, self._count / elapsed,
+            self._latency / self._count if self._count else 0.0, self._max,
+            self.total, self.failures, pending)
+        self._reset(now)
+        return line
@@ -10,34 +10,456 @@
     (C) 2015, meisterluk, BSD 3-clause license
 """
 
+import io
+import os
+import copy
+import threading
+
 import lxml.etree
 
+from . import paths
 from . import exceptions
 
 
-def read(xmlinfile: str):
-    """Given a filepath or file descriptor to an XML file, read the XML.
+# options of parsers returned by `parser`
+PARSER_OPTIONS = {
+    'remove_blank_text': False,
+    'collect_ids': False,
+    'huge_tree': False,
+    'remove_comments': False,
+    'remove_pis': False
+}
 
-    :param xmlinfile:   file descriptor to XML file
-    :type xmlinfile:    str
+# inputs of at least this size in bytes are parsed with huge_tree
+HUGE_TREE_SIZE = 64 * 1024 * 1024
+
+_local = threading.local()
+
+
+def parser(**options) -> lxml.etree.XMLParser:
+    """Return an XML parser for the current thread. Parsers are reused
+    by all subsequent calls with the same options in the same thread
+    (lxml parsers must not be shared between threads).
+
+    :param options:     options of `lxml.etree.XMLParser` overriding
+                        `PARSER_OPTIONS`
+    :type options:      dict
+    :return:            the parser
+    :rtype:             lxml.etree.XMLParser
+    """
+    opts = dict(PARSER_OPTIONS, **options)
+    key = tuple(sorted(opts.items()))
+    parsers = _local.__dict__.setdefault('parsers', {})
+    if key not in parsers:
+        parsers[key] = lxml.etree.XMLParser(**opts)
+    return parsers[key]
+
+
+def parse_buffer(data, base_url=None, **options) -> lxml.etree.Element:
+    """Parse an XML document from bytes or a buffer (eg. mmap) without copying it.
+
+    :param data:        the XML document
+    :type data:         bytes | bytearray | memoryview | mmap.mmap
+    :param base_url:    URL (filepath) of the document
+    :type base_url:     str
+    :param options:     parser options, see `parser`
+    :type options:      dict
+    :return:            root element of the document
+    :rtype:             lxml.etree.Element
+    """
+    if 'huge_tree' not in options and len(data) >= HUGE_TREE_SIZE:
+        options['huge_tree'] = True
+    xmlparser = parser(**options)
+    try:
+        return lxml.etree.fromstring(data, xmlparser, base_url=base_url)
+    except TypeError:
+        # lxml versions without support of the buffer protocol
+        return lxml.etree.fromstring(bytes(data), xmlparser, base_url=base_url)
+
+
+def parse_file(fd, base_url=None, **options) -> lxml.etree.Element:
+    """Parse the file open as binary file descriptor `fd` from its
+    beginning. It is memory-mapped instead of read, if possible.
+
+    :param fd:          the file descriptor
+    :type fd:           io.BufferedReader
+    :param base_url:    URL (filepath) of the document
+    :type base_url:     str
+    :param options:     parser options, see `parser`
+    :type options:      dict
+    :return:            root element of the document
+    :rtype:             lxml.etree.Element
+    """
+    import mmap
+
+    try:
+        mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        # empty files, pipes and other unmappable files
+        return parse_buffer(fd.read(), base_url, **options)
+
+    with mapped:
+        return parse_buffer(mapped, base_url, **options)
+
+
+def read(xmlinfile, *, reachable=None, **options):
+    """Given a filepath, file descriptor or bytes of an XML file, read the XML.
+
+    The document is parsed with a reusable parser (see `parser`). Files are
+    memory-mapped and file descriptors opened in text mode are read as
+    bytes, hence the content is neither copied nor decoded by python.
+
+    If a prefix tree of `reachable` elements is given (see
+    `paths.reachable`), the document is parsed by `read_pruned`.
+
+    :param xmlinfile:   filepath, file descriptor or content of an XML file
+    :type xmlinfile:    str | _io.BufferedReader | bytes
+    :param reachable:   prefix tree of elements to keep
+    :type reachable:    dict
+    :param options:     parser options, see `parser`
+    :type options:      dict
     :return:            an object representing the document object model
     :rtype:             lxml.etree.Element
     """
-    return lxml.etree.parse(xmlinfile).getroot()
+    if reachable is not None:
+        return read_pruned(xmlinfile, reachable, **options)
+
+    if isinstance(xmlinfile, (bytes, bytearray, memoryview)):
+        return parse_buffer(xmlinfile, **options)
+    elif isinstance(xmlinfile, str):
+        with open(xmlinfile, 'rb') as fd:
+            return parse_file(fd, xmlinfile, **options)
+
+    base_url = getattr(xmlinfile, 'name', None)
+    base_url = base_url if isinstance(base_url, str) else None
+
+    if isinstance(xmlinfile, io.BytesIO):
+        start = xmlinfile.tell()
+        with xmlinfile.getbuffer() as view, view[start:] as remainder:
+            root = parse_buffer(remainder, **options)
+        xmlinfile.seek(0, io.SEEK_END)
+        return root
+    elif isinstance(xmlinfile, io.TextIOBase) and hasattr(xmlinfile, 'buffer') \
+            and position(xmlinfile) == 0:
+        xmlinfile = xmlinfile.buffer
+
+    if isinstance(xmlinfile, io.BufferedReader) and position(xmlinfile) == 0:
+        return parse_file(xmlinfile, base_url, **options)
+    return parse_buffer(xmlinfile.read(), base_url, **options)
+
+
+def read_pruned(xmlinfile, reachable: dict, **options):
+    """Parse an XML file, but keep only elements contained in the prefix
+    tree `reachable` (see `paths.reachable`) and the root element.
+
+    The parser reports only the end of elements, which have reachable
+    children. Their unreachable children (eg. embedded attachments) are
+    removed including their tail text as soon as the element or one of
+    its reported siblings ends, hence they do not accumulate in memory.
+
+    :param xmlinfile:   filepath, file descriptor or content of an XML file
+    :type xmlinfile:    str | _io.BufferedReader | bytes
+    :param reachable:   prefix tree of elements to keep
+    :type reachable:    dict
+    :param options:     parser options, see `parser`
+    :type options:      dict
+    :return:            root element of the pruned document
+    :rtype:             lxml.etree.Element
+    """
+    if isinstance(xmlinfile, (bytes, bytearray, memoryview)):
+        xmlinfile = io.BytesIO(xmlinfile)
+    elif isinstance(xmlinfile, io.TextIOBase):
+        if not hasattr(xmlinfile, 'buffer') or position(xmlinfile) != 0:
+            return read(xmlinfile, **options)
+        xmlinfile = xmlinfile.buffer
+
+    if 'huge_tree' not in options and (size(xmlinfile) or 0) >= HUGE_TREE_SIZE:
+        options['huge_tree'] = True
+
+    # like `traverse`, accept a namespaced root element
+    tags = {'{*}' + name for name in reachable}
+    nodes = list(reachable.values())
+    while nodes:
+        node = nodes.pop()
+        if node is not paths.SUBTREE:
+            tags.update(name for name, child in node.items() if child)
+            nodes.extend(node.values())
+
+    events = lxml.etree.iterparse(xmlinfile, events=('end',), tag=sorted(tags),
+        **dict(PARSER_OPTIONS, **options))
+
+    # the last parent element looked up and its node in `reachable`
+    cache = [None, None]
+
+    def locate(element):
+        # node of `element` in `reachable`; None if unreachable or in a subtree
+        parent = element.getparent()
+        if parent is None:
+            node = reachable.get(element.tag)
+            if node is None:
+                node = reachable.get(lxml.etree.QName(element).localname, {})
+            return node
+        if parent is not cache[0]:
+            node = locate(parent)
+            cache[:] = [parent, node]
+        siblings = cache[1]
+        if siblings is None or siblings is paths.SUBTREE:
+            return None
+        return siblings.get(element.tag)
+
+    for _, element in events:
+        node = locate(element)
+        if node is None or node is paths.SUBTREE:
+            continue
+
+        # remove unreachable children and children of reachable leaves
+        for child in [child for child in element if child.tag not in node or
+                      (not node[child.tag] and len(child))]:
+            if child.tag in node:
+                del child[:]
+            else:
+                element.remove(child)
+
+        # remove unreachable preceding siblings, which are complete
+        parent, siblings = cache
+        if parent is not None:
+            sibling = element.getprevious()
+            while sibling is not None and sibling.tag not in siblings:
+                previous = sibling.getprevious()
+                parent.remove(sibling)
+                sibling = previous
+
+    return events.root
+
+
+def size(fd):
+    """Return the size in bytes of the file at filepath or
+    file descriptor `fd` or None if unknown.
+    """
+    try:
+        if isinstance(fd, str):
+            return os.path.getsize(fd)
+        elif isinstance(fd, io.BytesIO):
+            return fd.getbuffer().nbytes
+        return os.fstat(fd.fileno()).st_size
+    except (OSError, ValueError, AttributeError, io.UnsupportedOperation):
+        return None
+
+
+def position(fd):
+    """Return the position of file descriptor `fd` or None if unknown"""
+    try:
+        return fd.tell()
+    except (OSError, ValueError):
+        return None
+
+
+def detach(element: lxml.etree.Element) -> lxml.etree.Element:
+    """Return a deep copy of `element` in a document of its own. The copy
+    is placed below copies of its ancestors, which keep their tags,
+    attributes and namespaces, but no other content.
+
+    :param element:     the element to copy
+    :type element:      lxml.etree.Element
+    :return:            the copy of `element`
+    :rtype:             lxml.etree.Element
+    """
+    parent = None
+    for ancestor in reversed(list(element.iterancestors())):
+        if parent is None:
+            parent = lxml.etree.Element(ancestor.tag, ancestor.attrib, nsmap=ancestor.nsmap)
+        else:
+            parent = lxml.etree.SubElement(parent, ancestor.tag, ancestor.attrib,
+                                           nsmap=ancestor.nsmap)
+
+    duplicate = copy.deepcopy(element)
+    duplicate.tail = None
+    if parent is not None:
+        parent.append(duplicate)
+    return duplicate
+
+
+def iterelements(xmlinfile, path, **options):
+    """Incrementally parse an XML file and yield every element at `path`.
+
+    The document is never materialised as a whole. Every element is
+    yielded as detached copy (see `detach`), which is independent of how
+    far the parser has read ahead. Afterwards, the element is cleared and
+    all preceding siblings are removed from the tree. Hence memory
+    consumption depends on the size of one element, not the size of the
+    file. Only copies of the ancestors of the element are available, but
+    neither their other children (eg. a header) nor following elements.
+    Therefore rules must only read paths relative to the yielded element
+    (see `paths.base_relative`).
+
+    :param xmlinfile:   filepath or file descriptor to XML file
+    :type xmlinfile:    str
+    :param path:        simple, absolute path to the elements to yield
+    :type path:         str | paths.CompiledPath
+    :param options:     parser options overriding `PARSER_OPTIONS`
+    :type options:      dict
+    :return:            a generator of elements
+    :rtype:             generator
+    :raises InvalidPathException: path cannot be matched while streaming
+    """
+    path = paths.compile_path(path)
+    if not path.simple or not path.absolute or path.attribute is not None:
+        msg = ("Streaming requires an absolute path of element names, "
+               "but {} given")
+        raise exceptions.InvalidPathException(msg.format(path))
+
+    if isinstance(xmlinfile, io.TextIOBase) and hasattr(xmlinfile, 'buffer'):
+        xmlinfile = xmlinfile.buffer
+
+    ancestors = tuple(reversed(path.names[:-1]))
+    events = lxml.etree.iterparse(xmlinfile, events=('end',), tag=path.names[-1],
+        **dict(PARSER_OPTIONS, **options))
+    for _, element in events:
+        current = element
+        for name in ancestors:
+            current = current.getparent()
+            if current is None or current.tag != name:
+                break
+        else:
+            if current.getparent() is not None:
+                continue
+
+            yield detach(element)
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
 
 
-def write(dom: lxml.etree.Element, fd, encoding='utf-8', **lxml_options):
+def has_text_children(element: lxml.etree.Element) -> bool:
+    """Does `element` have mixed content, ie. text nodes next to children?
+
+    :param element:     the element to test
+    :type element:      lxml.etree.Element
+    :return:            True if text content occurs between child nodes
+    :rtype:             bool
+    """
+    if element.text is not None:
+        return True
+    return any(child.tail is not None for child in element)
+
+
+class IncrementalWriter:
+    """Serialize a DOM into a file descriptor top-level subtree
+    by top-level subtree.
+
+    Every subtree is serialized on its own and removed from the DOM once it
+    was written. Subtrees are serialized inside an empty copy of the root
+    element, hence namespace declarations and indentation equal the output
+    of ``write``. Roots with mixed content are written at once on `close`.
+    """
+    PLACEHOLDER = 'ruledxml-placeholder'
+
+    def __init__(self, fd, encoding='utf-8'):
+        """Initialize the writer. Nothing is written yet.
+
+        :param fd:          the file descriptor to write to
+        :type fd:           _io.BufferedWriter
+        :param encoding:    which encoding shall be used for the XML file?
+        :type encoding:     str
+        """
+        self.fd = fd
+        self.encoding = encoding
+        self.written = 0
+        self._shell = None
+        self._mixed = False
+        self._strip = (0, 0)
+        self._tail = b''
+        self._separator = '\n  '.encode(encoding)
+
+    def _serialize(self, element, declaration=False):
+        return lxml.etree.tostring(element, xml_declaration=declaration,
+            pretty_print=True, encoding=self.encoding)
+
+    def _open(self, dom: lxml.etree.Element):
+        if has_text_children(dom):
+            self._mixed = True
+            return
+
+        self._shell = lxml.etree.Element(dom.tag, dom.attrib, nsmap=dom.nsmap)
+        self._shell.append(lxml.etree.Element(self.PLACEHOLDER))
+        marker = '<{}/>'.format(self.PLACEHOLDER).encode(self.encoding)
+
+        head, self._tail = self._serialize(self._shell, True).split(marker)
+        prefix, tail = self._serialize(self._shell).split(marker)
+        self._strip = (len(prefix), len(tail))
+        self._shell.remove(self._shell[0])
+
+        # everything up to the first child, excluding its indentation
+        self.fd.write(head[:-len(self._separator)])
+
+    def _write(self, dom: lxml.etree.Element, child: lxml.etree.Element):
+        self._shell.append(child)
+        start, end = self._strip
+        chunk = self._serialize(self._shell)
+        self.fd.write(self._separator + chunk[start:-end])
+        self._shell.remove(child)
+        self.written += 1
+
+    def flush(self, dom: lxml.etree.Element, names=None):
+        """Write leading children of the root element `dom` and remove
+        them from `dom`. If `names` is given, only children with a tag
+        contained in `names` are written and the first child with
+        another tag stops the flush.
+
+        :param dom:     the root element of the DOM to write
+        :type dom:      lxml.etree.Element
+        :param names:   tags of children which are complete
+        :type names:    set
+        """
+        if self._shell is None and not self._mixed:
+            self._open(dom)
+        if self._mixed:
+            return
+
+        while len(dom):
+            child = dom[0]
+            if names is not None and child.tag not in names:
+                break
+            self._write(dom, child)
+
+    def close(self, dom: lxml.etree.Element):
+        """Write all remaining children of `dom` and finish the document.
+
+        :param dom:     the root element of the DOM to write
+        :type dom:      lxml.etree.Element
+        """
+        if self._shell is None and (len(dom) == 0 or has_text_children(dom)):
+            self.fd.write(self._serialize(dom, True))
+            return
+
+        self.flush(dom)
+        self.fd.write(self._tail)
+
+
+def write(dom: lxml.etree.Element, fd, encoding='utf-8', incremental=False,
+    **lxml_options):
     """Write a given DOM into open file descriptor `fd`.
 
+    If `incremental` is set, the DOM is written subtree by subtree
+    instead of serializing it into one bytes object first.
+    Written subtrees are removed from `dom`.
+
     :param dom:             a DOM (ie. root element) to store in an XML file
     :type dom:              lxml.etree.Element
     :param fd:              the file descriptor to write to
     :type fd:               _io.TextIOWrapper
     :param encoding:        which encoding shall be used for the XML file?
     :type encoding:         str
+    :param incremental:     write top-level subtrees one by one
+    :type incremental:      bool
     :param lxml_options:    options for the lxml.etree.tostring
     :type lxml_options:     dict
     """
+    if incremental and not lxml_options:
+        IncrementalWriter(fd, encoding).close(dom)
+        return
+
     opts = {
         'xml_declaration': True,
         'pretty_print': True,
@@ -69,11 +491,117 @@ def strip_last_element(path):
         return base, last
 
 
+class ChildList(list):
+    """Children of an element with the same name in document order.
+    `position` maps every child to its index in the list.
+    """
+    __slots__ = ('position',)
+
+    def __init__(self, children=()):
+        super().__init__(children)
+        self.position = {child: i for i, child in enumerate(self)}
+
+    def append(self, child):
+        self.position[child] = len(self)
+        super().append(child)
+
+
+class TargetIndex:
+    """Index of the elements of a DOM under construction.
+
+    Maps a parent element and an element name to the children with this
+    name. `traverse` looks up children in the index instead of searching
+    them and registers every element it creates. Hence writing to a path
+    costs a dictionary lookup per existing step. All elements appended to
+    indexed parents have to be registered with `add`; if children are
+    removed from a parent, call `forget`.
+    """
+    __slots__ = ('_parents',)
+
+    def __init__(self):
+        self._parents = {}
+
+    def children(self, parent: lxml.etree.Element, name: str) -> ChildList:
+        """Children of `parent` named `name`. Equivalent to ``parent.findall(name)``.
+
+        :param parent:      the parent element
+        :type parent:       lxml.etree.Element
+        :param name:        a simple element name
+        :type name:         str
+        :return:            the children in document order
+        :rtype:             ChildList
+        """
+        names = self._parents.get(parent)
+        if names is None:
+            names = self._parents[parent] = {}
+        children = names.get(name)
+        if children is None:
+            children = names[name] = ChildList(parent.findall(name))
+        return children
+
+    def add(self, parent: lxml.etree.Element, name: str, child: lxml.etree.Element):
+        """Register `child` which was appended to `parent`.
+
+        :param parent:      the parent element
+        :type parent:       lxml.etree.Element
+        :param name:        the name `child` was created with
+        :type name:         str
+        :param child:       the new last child of `parent`
+        :type child:        lxml.etree.Element
+        """
+        names = self._parents.get(parent)
+        if names is not None and name in names:
+            names[name].append(child)
+
+    def __len__(self):
+        return len(self._parents)
+
+    def forget(self, parent: lxml.etree.Element):
+        """Drop all entries of `parent`, eg. because children were removed.
+        Entries of removed children and their descendants are dropped too,
+        hence the index does not keep removed subtrees alive.
+
+        :param parent:      the parent element
+        :type parent:       lxml.etree.Element
+        """
+        names = self._parents.pop(parent, None)
+        if not names:
+            return
+        for children in names.values():
+            for child in children:
+                if child.getparent() is not parent:
+                    for element in child.iter():
+                        self._parents.pop(element, None)
+
+
+def prefer_bases(alternatives: list, bases) -> lxml.etree.Element:
+    """Return the first element of `alternatives` contained in `bases`.
+    If no alternative is a base, return the first alternative.
+
+    :param alternatives:    elements in document order
+    :type alternatives:     list | ChildList
+    :param bases:           elements to prefer
+    :type bases:            list
+    :return:                one of `alternatives`
+    :rtype:                 lxml.etree.Element
+    """
+    position = getattr(alternatives, 'position', None)
+    if position is not None:
+        hits = [position[base] for base in bases if base in position]
+        return alternatives[min(hits)] if hits else alternatives[0]
+
+    for alt in alternatives:
+        if alt in bases:
+            return alt
+    return alternatives[0]
+
+
 def traverse(dom, path, *,
     initial_element=lambda elem: lxml.etree.Element(elem),
     multiple_options=lambda opts: opts[0],
-    no_options=lambda elem, current: None,
-    finish=lambda elem, attribute='', attr_xmlns='': None) -> tuple:
+    no_options=lambda name, current: None,
+    finish=lambda element, attribute='', attr_xmlns='': None,
+    index=None) -> tuple:
     """Traverse an XPath `path` in `dom`.
 
     *initial_element(name)*
@@ -92,26 +620,29 @@ def traverse(dom, path, *,
       in the original `path` and `attr_xmlns` attribute's namespace.
       Return value is second return value of `traverse` function.
 
+    If a `TargetIndex` is given, children are looked up in the index
+    and elements returned by `no_options` are registered in the index.
+
     :param dom:                 a root node representing a DOM
     :type dom:                  lxml.etree.Element
     :param path:                an XPath to traverse
-    :type path:                 str
+    :type path:                 str | paths.CompiledPath
     :param multiple_options:    see above
     :type multiple_options:     function
     :param no_options:      see above
     :type no_options:       function
     :param finish:      see above
     :type finish:       function
+    :param index:       index of the elements of `dom`
+    :type index:        TargetIndex
     :return:        A root node for the new XML DOM and the finish return value
     :rtype:         tuple([lxml.etree.Element, *])
     """
-    path, *attrs = str(path).split('@')
-    elements = path.lstrip('/').split('/')
-    if elements[-1] == '':
-        elements = elements[:-1]
+    path = paths.compile_path(path)
 
     current = dom
-    for i, pelement in enumerate(elements):
+    for i, step in enumerate(path.steps):
+        pelement = step.name
         if i == 0 and dom is None:
             current = dom = initial_element(pelement)
             continue
@@ -119,24 +650,26 @@ def traverse(dom, path, *,
             # <tag>.xpath("tag") returns []   => current = dom
             continue
 
-        options = current.xpath(pelement)
+        if index is not None and step.simple:
+            options = index.children(current, pelement)
+        else:
+            options = step.select(current)
 
         if len(options) == 0 or options is None:
+            parent = current
             current = no_options(name=pelement, current=current)
             if current is None:
                 return dom, None
+            elif index is not None:
+                index.add(parent, pelement, current)
         elif len(options) == 1:
             current = options[0]
         else:
             current = multiple_options(options)
 
-    if attrs:
-        if ':' in attrs[0]:
-            xmlns, attr = attrs[0].split(':')
-        else:
-            xmlns, attr = None, attrs[0]
-
-        return dom, finish(element=current, attribute=attr, attr_xmlns=xmlns)
+    if path.attribute is not None:
+        return dom, finish(element=current, attribute=path.attribute,
+            attr_xmlns=path.attr_xmlns)
     else:
         return dom, finish(element=current)
 
@@ -186,7 +719,7 @@ def xmlns_to_lxml(element, xmlmap={}):
 
 
 def write_base_destination(dom: lxml.etree.Element, path: str, value,
-    bases: list, xmlmap=None) -> lxml.etree.Element:
+    bases: list, xmlmap=None, index=None) -> lxml.etree.Element:
     """Behaves very much like `write_destination`, but also accepts `bases`,
     which defines a set of elements which is considered if the path is ambiguous.
 
@@ -195,13 +728,15 @@ def write_base_destination(dom: lxml.etree.Element, path: str, value,
     :param dom:     root element of an XML DOM
     :type dom:      lxml.etree.Element
     :param path:    XPath to apply
-    :type path:     str
+    :type path:     str | paths.CompiledPath
     :param value:   the value to be written as text content or attribute value
     :param bases:   a set of elements considered if path is ambiguous
     :type bases:    iterable
     :param xmlmap:  Create new elements with given xmlmap and
                     traverse `path` with given `xmlmap`
     :type xmlmap:   dict
+    :param index:   index of the elements of `dom`
+    :type index:    TargetIndex
     :return:        text content, attribute or ''
     :rtype:         str
     """
@@ -209,10 +744,7 @@ def write_base_destination(dom: lxml.etree.Element, path: str, value,
         return lxml.etree.Element(xmlns_to_lxml(name, xmlmap))
 
     def base_or_first(alternatives):
-        for alt in alternatives:
-            if alt in bases:
-                return alt
-        return alternatives[0]
+        return prefer_bases(alternatives, bases)
 
     def write(element, *, attribute='', attr_xmlns=None):
         if attribute and not attr_xmlns:
@@ -230,7 +762,7 @@ def write_base_destination(dom: lxml.etree.Element, path: str, value,
 
     return traverse(dom, path, initial_element=root,
         multiple_options=base_or_first, no_options=create_element,
-        finish=write)[0]
+        finish=write, index=index)[0]
 
 
 def read_base_source(dom: lxml.etree.Element, path: str, bases: list) -> str:
@@ -240,17 +772,14 @@ def read_base_source(dom: lxml.etree.Element, path: str, bases: list) -> str:
     :param dom:     root element of an XML DOM
     :type dom:      lxml.etree.Element
     :param path:    XPath to apply
-    :type path:     str
+    :type path:     str | paths.CompiledPath
     :param bases:   a set of elements considered if path is ambiguous
     :type bases:    iterable
     :return:        text content, attribute or ''
     :rtype:         str
     """
     def base_or_first(alternatives):
-        for alt in alternatives:
-            if alt in bases:
-                return alt
-        return alternatives[0]
+        return prefer_bases(alternatives, bases)
 
     def read(element, attribute='', attr_xmlns=None):
         # TODO: namespace support
@@ -266,8 +795,140 @@ def read_base_source(dom: lxml.etree.Element, path: str, bases: list) -> str:
         no_options=abort, finish=read)[1] or ''
 
 
+def find_relative(base: lxml.etree.Element, steps: tuple):
+    """Follow `steps` from `base` and take the first match at every step.
+    Returns None if some step has no match.
+
+    :param base:    the element to start at
+    :type base:     lxml.etree.Element
+    :param steps:   simple element steps
+    :type steps:    tuple(paths.Step)
+    :return:        the element reached or None
+    :rtype:         lxml.etree.Element
+    """
+    element = base
+    for step in steps:
+        element = element.find(step.name)
+        if element is None:
+            return None
+    return element
+
+
+def read_relative_source(base: lxml.etree.Element, path) -> str:
+    """Behaves like `read_base_source` for a path relative to a base.
+
+    :param base:    the base element `path` is relative to
+    :type base:     lxml.etree.Element
+    :param path:    the relative path
+    :type path:     paths.RelativePath
+    :return:        text content, attribute or ''
+    :rtype:         str
+    """
+    element = find_relative(base, path.steps)
+    if element is None:
+        return ''
+    elif path.attribute:
+        return str(element.attrib[path.attribute])
+    return str(element.text or '')
+
+
+def iter_relative_elements(base: lxml.etree.Element, path):
+    """Behaves like `read_ambiguous_element` for a path relative to a base,
+    but yields elements lazily.
+
+    :param base:    the base element `path` is relative to
+    :type base:     lxml.etree.Element
+    :param path:    the relative path with at least one step
+    :type path:     paths.RelativePath
+    :return:        a generator of elements at `path`
+    :rtype:         generator
+    """
+    parent = find_relative(base, path.steps[:-1])
+    if parent is not None:
+        yield from parent.iterchildren(path.steps[-1].name)
+
+
+def create_relative(base: lxml.etree.Element, steps: tuple, xmlmap=None, index=None):
+    """Follow `steps` from `base` like `find_relative`,
+    but create missing elements.
+
+    :param base:    the element to start at
+    :type base:     lxml.etree.Element
+    :param steps:   simple element steps
+    :type steps:    tuple(paths.Step)
+    :param xmlmap:  namespace map of new elements
+    :type xmlmap:   dict
+    :param index:   index of the elements of the DOM
+    :type index:    TargetIndex
+    :return:        the element reached
+    :rtype:         lxml.etree.Element
+    """
+    element = base
+    for step in steps:
+        name = step.name
+        if index is not None:
+            options = index.children(element, name)
+            child = options[0] if options else None
+        else:
+            child = element.find(name)
+        if child is None:
+            child = lxml.etree.Element(name, nsmap=xmlmap)
+            element.append(child)
+            if index is not None:
+                index.add(element, name, child)
+        element = child
+    return element
+
+
+def write_relative_destination(base: lxml.etree.Element, path, value,
+    xmlmap=None, index=None):
+    """Behaves like `write_base_destination` for a path relative to a base.
+
+    :param base:    the base element `path` is relative to
+    :type base:     lxml.etree.Element
+    :param path:    the relative path
+    :type path:     paths.RelativePath
+    :param value:   the value to be written as text content or attribute value
+    :param xmlmap:  namespace map of new elements
+    :type xmlmap:   dict
+    :param index:   index of the elements of the DOM
+    :type index:    TargetIndex
+    """
+    element = create_relative(base, path.steps, xmlmap, index)
+    if path.attribute and not path.attr_xmlns:
+        element.attrib[path.attribute] = str(value)
+    elif path.attribute and path.attr_xmlns:
+        attrname = '{%s}%s' % (path.attr_xmlns, path.attribute)
+        element.attrib[attrname] = str(value)
+    else:
+        element.text = str(value)
+
+
+def new_relative_element(base: lxml.etree.Element, path, xmlmap=None, index=None):
+    """Behaves like `write_new_ambiguous_element` for a path relative to a base.
+
+    :param base:    the base element `path` is relative to
+    :type base:     lxml.etree.Element
+    :param path:    the relative path with at least one step
+    :type path:     paths.RelativePath
+    :param xmlmap:  namespace map of new elements
+    :type xmlmap:   dict
+    :param index:   index of the elements of the DOM
+    :type index:    TargetIndex
+    :return:        the new created element at `path`
+    :rtype:         lxml.etree.Element
+    """
+    parent = create_relative(base, path.steps[:-1], xmlmap, index)
+    name = path.steps[-1].name
+    new_element = lxml.etree.Element(name, nsmap=xmlmap)
+    parent.append(new_element)
+    if index is not None:
+        index.add(parent, name, new_element)
+    return new_element
+
+
 def write_new_ambiguous_element(dom: lxml.etree.Element, path: str,
-    bases=None, xmlmap=None) -> lxml.etree.Element:
+    bases=None, xmlmap=None, index=None) -> lxml.etree.Element:
     """Given a `path`, traverse it in `path`, use `bases` on ambiguous elements
     and create a new element for the top-level element of `path`.
 
@@ -276,28 +937,27 @@ def write_new_ambiguous_element(dom: lxml.etree.Element, path: str,
     :param dom:     root element of a DOM tree
     :type dom:      lxml.etree.Element
     :param path:    XPath to apply
-    :type path:     str
+    :type path:     str | paths.CompiledPath
     :param bases:   bases (ie. elements) to use if ambiguous
     :type bases:    list
     :param xmlmap:  Create new elements with given xmlmap and
                     traverse `path` with given `xmlmap`
     :type xmlmap:   dict
+    :param index:   index of the elements of `dom`
+    :type index:    TargetIndex
     :return:        the new created element at `path`
     :rtype:         lxml.etree.Element
     """
-    path, last = strip_last_element(path)
+    path, last = paths.compile_path(path).split_last()
 
     if bases is None:
         bases = []
-    if not last:
+    if not last.name:
         msg = "Path '{}' does not specify an element to create"
         raise exceptions.InvalidPathException(msg.format(path))
 
     def base_or_first(alternatives):
-        for alt in alternatives:
-            if alt in bases:
-                return alt
-        return alternatives[0]
+        return prefer_bases(alternatives, bases)
 
     def return_element(element, attribute='', attr_xmlns=None):
         if attribute:
@@ -311,8 +971,10 @@ def write_new_ambiguous_element(dom: lxml.etree.Element, path: str,
         return new_element
 
     last_element = traverse(dom, path, multiple_options=base_or_first,
-        no_options=create_element, finish=return_element)[1]
-    new_element = create_element(last, last_element)
+        no_options=create_element, finish=return_element, index=index)[1]
+    new_element = create_element(last.name, last_element)
+    if index is not None:
+        index.add(last_element, last.name, new_element)
 
     return new_element
 
@@ -326,24 +988,21 @@ def read_ambiguous_element(dom: lxml.etree.Element, path: str, bases=None) -> li
     :param dom:     root element of a DOM tree
     :type dom:      lxml.etree.Element
     :param path:    XPath to apply
-    :type path:     str
+    :type path:     str | paths.CompiledPath
     :param bases:   bases (ie. elements) to use if ambiguous
     :type bases:    list
     :return:        a list of elements at `path`
     :rtype:         list([lxml.etree.Element])
     """
-    path, last = strip_last_element(path)
+    path, last = paths.compile_path(path).split_last()
 
     if bases is None:
         bases = []
-    if not last:
-        return dom.xpath(last)
+    if not last.name:
+        return last.select(dom)
 
     def base_or_first(alternatives):
-        for alt in alternatives:
-            if alt in bases:
-                return alt
-        return alternatives[0]
+        return prefer_bases(alternatives, bases)
 
     def return_element(element, attribute='', attr_xmlns=None):
         if attribute:
@@ -359,11 +1018,11 @@ def read_ambiguous_element(dom: lxml.etree.Element, path: str, bases=None) -> li
     if last_element is None:
         return []
 
-    return last_element.xpath(last) or []
+    return last.select(last_element) or []
 
 
 def write_destination(dom: lxml.etree.Element, path: str, value,
-    xmlmap=None) -> lxml.etree.Element:
+    xmlmap=None, index=None) -> lxml.etree.Element:
     """Write a `value` to an XPath `path` in `dom`.
     If `path` points to element, set text node to `value`.
     If `path` points to attribute, set attribute content to `value`.
@@ -374,11 +1033,13 @@ def write_destination(dom: lxml.etree.Element, path: str, value,
     :param dom:     root element of an XML DOM
     :type dom:      lxml.etree.Element
     :param path:    XPath to apply
-    :type path:     str
+    :type path:     str | paths.CompiledPath
     :param value:   a value to write, string representation is taken
     :param xmlmap:  Create new elements with given xmlmap and
                     traverse `path` with given `xmlmap`
     :type xmlmap:   dict
+    :param index:   index of the elements of `dom`
+    :type index:    TargetIndex
     :return:        the (potentially modified) `dom` element
     :rtype:         lxml.etree.Element
     """
@@ -407,7 +1068,7 @@ def write_destination(dom: lxml.etree.Element, path: str, value,
         return new_element
 
     return traverse(dom, path, initial_element=root,
-        multiple_options=first, no_options=cont, finish=write)[0]
+        multiple_options=first, no_options=cont, finish=write, index=index)[0]
 
 
 def read_source(dom: lxml.etree.Element, path: str) -> str:
@@ -421,22 +1082,9 @@ def read_source(dom: lxml.etree.Element, path: str) -> str:
     :param dom:     root element of an XML DOM
     :type dom:      lxml.etree.Element
     :param path:    XPath to apply
-    :type path:     str
+    :type path:     str | paths.CompiledPath
     :return:        text content, attribute or ''
     :rtype:         str
     """
     # TODO: namespace support
-    if path == '':
-        return ''
-    elif '@' in path:
-        val = dom.xpath(path)
-        if val:
-            return val[0] or ''
-        else:
-            return ''
-    else:
-        elements = dom.xpath(path)
-        if elements:
-            return elements[0].text or ''
-        else:
-            return ''
+    return paths.compile_path(path).first(dom)
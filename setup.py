@@ -42,10 +42,18 @@ setup(
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Office/Business',
         'Topic :: Text Processing :: Markup :: XML'
     ],
+    python_requires='>=3.7',
     requires=['lxml (==3.4.4)'],
     scripts=['bin/ruledxml', 'bin/ruledxml-batched']
 )